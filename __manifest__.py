@@ -42,14 +42,19 @@
     'data': [
         'security/ir.model.access.csv',
         'data/hr_payroll_data.xml',
+        'data/hr_payroll_cron.xml',
         'views/hr_contract_views.xml',
         'views/hr_payroll_views.xml',
+        'views/hr_payroll_job_views.xml',
+        'views/hr_payroll_fifth_category_views.xml',
+        'views/hr_payroll_forecast_views.xml',
         'views/hr_employee_views.xml',
         'views/hr_payroll_settings_views.xml',
         'reports/paperformat.xml',
         'reports/peruanita_layout_background_a5_vertical.xml',
         'reports/report_payslip_templates.xml',
         'reports/payslip_template.xml',
+        'reports/report_fifth_certificate_templates.xml',
     ],
         "assets": {
         "web.assets_backend": [
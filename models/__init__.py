@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 
 from . import hr_afp_pension
+from . import hr_afp_pension_rate
 from . import hr_employee
 from . import hr_contract
 from . import hr_payroll_monthly
+from . import hr_payroll_job
 from . import hr_payroll_line
+from . import hr_payroll_fifth_category
+from . import hr_payroll_fifth_certificate
+from . import hr_payroll_benefits
+from . import hr_payroll_plame
+from . import hr_payroll_afpnet
+from . import hr_payroll_bank
+from . import hr_payroll_xlsx
+from . import hr_payroll_input_import
+from . import hr_payroll_simulation
+from . import hr_payroll_forecast
 from . import hr_payroll_config
-from . import hr_payroll_settings
\ No newline at end of file
+from . import hr_payroll_settings
@@ -1,6 +1,36 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from odoo.tools import SQL
+
+def _afp_lines(afp):
+    return SQL("line.pension_system = 'afp' AND line.afp_id = %s", afp.id)
+
+
+def _commission_lines(afp, commission_type):
+    """Líneas de la AFP que pagan comisión del tipo indicado (el del empleado o el de la AFP)"""
+    return SQL(
+        "%s AND NOT COALESCE(line.exempt_afp_commission, FALSE) AND COALESCE(line.commission_type, %s) = %s",
+        _afp_lines(afp), afp.commission_type or 'flow', commission_type,
+    )
+
+
+# Condición SQL de las líneas afectadas por cada tasa de la AFP, según sus
+# valores anterior y nuevo (ver hr.payroll.line._recompute_impacted)
+AFP_IMPACT = {
+    'fund_percentage': lambda afp, old, new: _afp_lines(afp),
+    'insurance_percentage': lambda afp, old, new: _afp_lines(afp),
+    'commission_flow_percentage': lambda afp, old, new: _commission_lines(afp, 'flow'),
+    'commission_mixed_percentage': lambda afp, old, new: _commission_lines(afp, 'mixed'),
+    # El tope solo cambia la comisión mixta de bases que superan el menor de los dos topes
+    'tope_amount': lambda afp, old, new: SQL(
+        "%s AND COALESCE(line.taxable_base, 0) > %s", _commission_lines(afp, 'mixed'), min(old, new)),
+    # El tipo de la AFP solo aplica a empleados sin tipo de comisión propio
+    'commission_type': lambda afp, old, new: SQL(
+        "%s AND line.commission_type IS NULL AND NOT COALESCE(line.exempt_afp_commission, FALSE)",
+        _afp_lines(afp)),
+}
+
 
 class HrAfpPension(models.Model):
     _name = 'hr.afp.pension'
@@ -20,6 +50,9 @@ class HrAfpPension(models.Model):
     active = fields.Boolean(string='Activo', default=True)
     tope_amount = fields.Float(string='Tope S/', digits=(10,2), default=12027.91, help="Tope máximo para cálculo de comisión mixta")
     
+    # Tasas por vigencia (si no hay, se usan las tasas de arriba)
+    rate_ids = fields.One2many('hr.afp.pension.rate', 'afp_id', string='Tasas por Vigencia')
+    
     # Campos computados para mostrar totales
     total_flow_percentage = fields.Float(
         string='% Total (Flujo)', 
@@ -43,6 +76,32 @@ class HrAfpPension(models.Model):
             record.total_flow_percentage = record.fund_percentage + record.insurance_percentage + record.commission_flow_percentage
             record.total_mixed_percentage = record.fund_percentage + record.insurance_percentage + record.commission_mixed_percentage
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['hr.payroll.settings']._invalidate_payroll_snapshot()
+        return records
+
+    def write(self, vals):
+        impact_fields = [fname for fname in AFP_IMPACT if fname in vals]
+        old_values = {
+            record.id: {fname: record[fname] for fname in impact_fields}
+            for record in self
+        }
+        res = super().write(vals)
+        # Las tasas AFP forman parte de los parámetros en caché de la planilla
+        self.env['hr.payroll.settings']._invalidate_payroll_snapshot()
+        
+        # Recalcular solo las líneas que usan las tasas modificadas
+        conditions = [
+            AFP_IMPACT[fname](record, old_values[record.id][fname], record[fname])
+            for record in self
+            for fname in impact_fields
+            if old_values[record.id][fname] != record[fname]
+        ]
+        self.env['hr.payroll.line']._recompute_impacted(conditions)
+        return res
+
     def get_commission_percentage(self, commission_type):
         """Retorna el porcentaje de comisión según el tipo"""
         self.ensure_one()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+
+from ..tools.payroll_engine import AfpRates, find_effective
+from .hr_afp_pension import _afp_lines
+from .hr_payroll_settings import SNAPSHOT_GENERATION_KEY
+
+# Tasas que pueden variar por vigencia
+RATE_FIELDS = ('fund_percentage', 'insurance_percentage', 'commission_flow_percentage',
+               'commission_mixed_percentage', 'tope_amount')
+
+
+class HrAfpPensionRate(models.Model):
+    """
+    Tasas de una AFP vigentes desde una fecha. Si una AFP no tiene tasas por
+    vigencia se usan las tasas registradas en la propia AFP.
+    """
+    _name = 'hr.afp.pension.rate'
+    _description = 'Tasas AFP por Vigencia'
+    _order = 'afp_id, valid_from desc'
+    
+    afp_id = fields.Many2one('hr.afp.pension', string='AFP', required=True, ondelete='cascade', index=True)
+    valid_from = fields.Date(string='Vigente Desde', required=True)
+    valid_to = fields.Date(string='Vigente Hasta', help="Vacío: hasta la siguiente vigencia")
+    fund_percentage = fields.Float(string='% Fondo', digits=(5,2), default=10.0)
+    insurance_percentage = fields.Float(string='% Seguro', digits=(5,2), default=1.37)
+    commission_flow_percentage = fields.Float(string='% Comisión Flujo', digits=(5,2))
+    commission_mixed_percentage = fields.Float(string='% Comisión Mixta', digits=(5,2))
+    tope_amount = fields.Float(string='Tope S/', digits=(10,2), default=12027.91)
+    
+    @api.constrains('afp_id', 'valid_from', 'valid_to')
+    def _check_validity(self):
+        """Las vigencias de una misma AFP no pueden superponerse"""
+        for rate in self:
+            if rate.valid_to and rate.valid_to < rate.valid_from:
+                raise ValidationError(_('La fecha "Vigente Hasta" no puede ser anterior a "Vigente Desde".'))
+            domain = [
+                ('id', '!=', rate.id),
+                ('afp_id', '=', rate.afp_id.id),
+                '|', ('valid_to', '=', False), ('valid_to', '>=', rate.valid_from),
+            ]
+            if rate.valid_to:
+                domain.append(('valid_from', '<=', rate.valid_to))
+            if self.search_count(domain):
+                raise ValidationError(_('Las vigencias de las tasas de %s se superponen.', rate.afp_id.name))
+    
+    @api.model
+    @tools.ormcache(SNAPSHOT_GENERATION_KEY)
+    def _get_rate_index(self):
+        """
+        Tasas por vigencia de todas las AFP ordenadas por inicio de vigencia
+        
+        Returns:
+            dict: {id AFP: (fechas valid_from, tuplas con RATE_FIELDS, fechas valid_to)}
+        """
+        rates = defaultdict(list)
+        for rate in self.sudo().search_read([], ['afp_id', 'valid_from', 'valid_to', *RATE_FIELDS],
+                                            order='afp_id, valid_from, id', load=None):
+            rates[rate['afp_id']].append(rate)
+        return {
+            afp_id: (
+                tuple(rate['valid_from'] for rate in items),
+                tuple(tuple(rate[name] for name in RATE_FIELDS) for rate in items),
+                tuple(rate['valid_to'] for rate in items),
+            )
+            for afp_id, items in rates.items()
+        }
+    
+    @api.model
+    def _get_afp_rates(self, day):
+        """
+        Tasas de todas las AFP (incluso archivadas) vigentes en la fecha; si
+        ninguna vigencia de la AFP cubre la fecha se usan las de la AFP
+        """
+        index = self._get_rate_index()
+        afps = self.env['hr.afp.pension'].sudo().with_context(active_test=False).search([])
+        result = []
+        for afp in afps:
+            values = None
+            if afp.id in index:
+                starts, versions, ends = index[afp.id]
+                values = find_effective(starts, versions, day, ends)
+            if values is None:
+                values = tuple(afp[name] for name in RATE_FIELDS)
+            result.append(AfpRates(afp.id, afp.code, *values[:4], afp.commission_type, values[4]))
+        return tuple(result)
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        rates = super().create(vals_list)
+        rates._recompute_afp_lines(rates.afp_id)
+        return rates
+    
+    def write(self, vals):
+        afps = self.afp_id
+        res = super().write(vals)
+        self._recompute_afp_lines(afps | self.afp_id)
+        return res
+    
+    def unlink(self):
+        afps = self.afp_id
+        res = super().unlink()
+        self._recompute_afp_lines(afps)
+        return res
+    
+    def _recompute_afp_lines(self, afps):
+        """Invalida los parámetros en caché y recalcula las líneas de las AFP"""
+        self.env['hr.payroll.settings']._invalidate_payroll_snapshot()
+        self.env['hr.payroll.line']._recompute_impacted([_afp_lines(afp) for afp in afps])
@@ -2,6 +2,17 @@
 
 from odoo import models, fields, api
 
+from .hr_payroll_line import FROZEN_PAYROLL_STATES
+
+# Campos del contrato copiados en hr.payroll.line
+PAYROLL_LINE_CONTRACT_FIELDS = {
+    'wage': 'contract_wage',
+    'night_bonus': 'contract_night_bonus',
+    'essalud_percentage': 'contract_essalud_percentage',
+    'sctr_percentage': 'contract_sctr_percentage',
+    'has_sctr': 'contract_has_sctr',
+}
+
 class HrContract(models.Model):
     _inherit = 'hr.contract'
     
@@ -15,4 +26,20 @@ class HrContract(models.Model):
     # Configuración de seguros
     has_sctr = fields.Boolean(string='Tiene SCTR', default=False)
     sctr_percentage = fields.Float(string='% SCTR', digits=(5,2), default=1.23)
-    essalud_percentage = fields.Float(string='% EsSalud', digits=(5,2), default=9.0)
\ No newline at end of file
+    essalud_percentage = fields.Float(string='% EsSalud', digits=(5,2), default=9.0)
+    
+    def write(self, vals):
+        res = super().write(vals)
+        # Propagar los cambios solo a las líneas de planillas abiertas
+        line_vals = {
+            line_field: vals[contract_field]
+            for contract_field, line_field in PAYROLL_LINE_CONTRACT_FIELDS.items()
+            if contract_field in vals
+        }
+        if line_vals:
+            lines = self.env['hr.payroll.line'].sudo().search([
+                ('contract_id', 'in', self.ids),
+                ('payroll_id.state', 'not in', FROZEN_PAYROLL_STATES),
+            ])
+            lines.write(line_vals)
+        return res
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import tempfile
+from itertools import groupby
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+# Tipo de documento de identidad en AFPnet: DNI
+AFPNET_DOC_TYPE_DNI = '0'
+
+# Tipo de trabajo o rubro en AFPnet: empleado normal
+AFPNET_WORK_TYPE = 'N'
+
+# Columnas de la planilla de declaración de AFPnet
+AFPNET_HEADER = (
+    'Secuencia', 'CUSPP', 'Tipo Doc.', 'Nro. Doc.', 'Apellido Paterno', 'Apellido Materno',
+    'Nombres', 'Relación Laboral', 'Inicio RL', 'Cese RL', 'Excepción Aportar',
+    'Remuneración Asegurable', 'Aporte Voluntario c/Fin', 'Aporte Voluntario s/Fin',
+    'Aporte Voluntario Empleador', 'Rubro',
+)
+
+# Montos que se acumulan por AFP para los totales de control
+AFPNET_TOTALS = ('taxable_base', 'afp_fund', 'afp_insurance', 'afp_commission', 'afp_total')
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    afpnet_attachment_id = fields.Many2one('ir.attachment', string='Archivos AFPnet', readonly=True, copy=False)
+
+    def action_export_afpnet(self):
+        """
+        Genera la planilla de declaración de AFPnet de cada AFP en un ZIP
+
+        Todas las AFP salen de una sola consulta ordenada por AFP: el archivo
+        cambia cuando cambia la AFP. Los totales de control de cada archivo
+        se acumulan en la misma pasada y se concilian con el Total AFP de la
+        planilla.
+        """
+        self.ensure_one()
+        if self.state not in ('calculated', 'validated', 'paid'):
+            raise UserError(_('Solo se pueden declarar a AFPnet planillas calculadas, validadas o pagadas.'))
+        if self.payroll_type != 'monthly':
+            raise UserError(_('Solo se pueden declarar a AFPnet planillas mensuales.'))
+
+        attachment = self._generate_afpnet_files()
+        return self._download_attachment_action(attachment)
+
+    def _get_afpnet_query(self):
+        return SQL(
+            """
+            SELECT line.id, line.afp_id, afp.code AS afp_code, afp.name AS afp_name,
+                   line.cuspp, line.identification_id, employee.name AS employee_name,
+                   contract.date_start, contract.date_end,
+                   COALESCE(line.taxable_base, 0) AS taxable_base,
+                   COALESCE(line.afp_fund, 0) AS afp_fund,
+                   COALESCE(line.afp_insurance, 0) AS afp_insurance,
+                   COALESCE(line.afp_commission, 0) AS afp_commission,
+                   COALESCE(line.afp_total, 0) AS afp_total
+              FROM hr_payroll_line AS line
+              JOIN hr_employee AS employee ON employee.id = line.employee_id
+              JOIN hr_contract AS contract ON contract.id = line.contract_id
+              LEFT JOIN hr_afp_pension AS afp ON afp.id = line.afp_id
+             WHERE line.payroll_id = %s
+               AND line.pension_system = 'afp'
+             ORDER BY line.afp_id NULLS FIRST, line.identification_id, line.id
+            """,
+            self.id,
+        )
+
+    def _format_afpnet_row(self, sequence, row):
+        """Fila de la planilla de declaración (separada por tabuladores)"""
+        starts = bool(row['date_start'] and self.date_from <= row['date_start'] <= self.date_to)
+        ends = bool(row['date_end'] and self.date_from <= row['date_end'] <= self.date_to)
+        values = (
+            sequence,
+            (row['cuspp'] or '').strip(),
+            AFPNET_DOC_TYPE_DNI,
+            (row['identification_id'] or '').strip(),
+            '', '',
+            row['employee_name'],
+            'S',
+            'S' if starts else 'N',
+            'S' if ends else 'N',
+            '',
+            f"{row['taxable_base']:.2f}",
+            '0.00', '0.00', '0.00',
+            AFPNET_WORK_TYPE,
+        )
+        return '\t'.join(str(value).replace('\t', ' ') for value in values)
+
+    def _generate_afpnet_files(self):
+        """Escribe un archivo por AFP y el resumen de control en una sola pasada"""
+        period = self.date_period.strftime('%Y%m')
+        files = {}
+        paths = []
+        totals = {}
+        try:
+            rows = self._stream_query(self._get_afpnet_query())
+            for afp_id, afp_rows in groupby(rows, key=lambda row: row['afp_id']):
+                afp_totals = dict.fromkeys(AFPNET_TOTALS, 0.0)
+                afp_totals['count'] = 0
+                handle, path = tempfile.mkstemp(suffix='.txt', prefix='afpnet_')
+                paths.append(path)
+                with os.fdopen(handle, 'w', encoding='utf-8', newline='\r\n') as output:
+                    output.write('\t'.join(AFPNET_HEADER) + '\n')
+                    for row in afp_rows:
+                        if not afp_id:
+                            raise UserError(_('%s está afiliado a AFP pero no tiene AFP asignada.',
+                                              row['employee_name']))
+                        afp_totals['count'] += 1
+                        output.write(self._format_afpnet_row(afp_totals['count'], row) + '\n')
+                        for name in AFPNET_TOTALS:
+                            afp_totals[name] += row[name]
+                code = re.sub(r'[^A-Za-z0-9]', '', row['afp_code'] or str(afp_id))
+                files[f'AFPnet_{code}_{period}.txt'] = path
+                totals[row['afp_name']] = afp_totals
+
+            if not totals:
+                raise UserError(_('No hay afiliados a AFP en esta planilla.'))
+            path = self._write_afpnet_summary(totals)
+            paths.append(path)
+            files[f'AFPnet_Resumen_{period}.txt'] = path
+            zip_path = self._zip_files(files)
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+        try:
+            return self._store_export_file(
+                'afpnet_attachment_id', f'AFPnet {self.name.replace("/", "-")}.zip', zip_path, 'application/zip')
+        finally:
+            os.unlink(zip_path)
+
+    def _write_afpnet_summary(self, totals):
+        """
+        Totales de control por AFP y conciliación con el Total AFP de la planilla
+
+        Raises:
+            UserError: si la suma declarada no coincide con total_afp_discount
+        """
+        declared = round(sum(afp_totals['afp_total'] for afp_totals in totals.values()), 2)
+        if round(declared - self.total_afp_discount, 2):
+            raise UserError(_(
+                'El total declarado a las AFP (S/ %(declared).2f) no coincide con el Total AFP de la '
+                'planilla (S/ %(total).2f). Recalcule la planilla antes de exportar.',
+                declared=declared, total=self.total_afp_discount,
+            ))
+
+        handle, path = tempfile.mkstemp(suffix='.txt', prefix='afpnet_')
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='\r\n') as output:
+            output.write('\t'.join(('AFP', 'Afiliados', 'Remuneración Asegurable', 'Fondo', 'Seguro',
+                                    'Comisión', 'Total', 'Diferencia Redondeo')) + '\n')
+            for name, afp_totals in totals.items():
+                parts = afp_totals['afp_fund'] + afp_totals['afp_insurance'] + afp_totals['afp_commission']
+                output.write('\t'.join((
+                    name,
+                    str(afp_totals['count']),
+                    *(f'{afp_totals[column]:.2f}' for column in AFPNET_TOTALS),
+                    f"{afp_totals['afp_total'] - parts:.2f}",
+                )) + '\n')
+            output.write('\t'.join(('TOTAL', '', '', '', '', '', f'{declared:.2f}', '')) + '\n')
+            output.write('\t'.join(('TOTAL AFP PLANILLA', '', '', '', '', '', f'{self.total_afp_discount:.2f}', '')) + '\n')
+        return path
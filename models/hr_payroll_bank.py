@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import re
+import tempfile
+import unicodedata
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+# Máximo de errores que se muestran al validar
+BANK_MAX_ERRORS = 50
+
+# Tamaño de bloque al unir la cabecera con los detalles
+BANK_COPY_BLOCK_SIZE = 1024 * 1024
+
+# Diseños de registro de ancho fijo por banco. Cada campo es
+# (clave, ancho, tipo): 'a' alfanumérico alineado a la izquierda, 'n' numérico
+# con ceros a la izquierda y 'm' importe con dos decimales y ceros a la izquierda.
+# 'checksum_skip' son los dígitos iniciales de cada cuenta que no entran en la
+# suma de control.
+BANK_LAYOUTS = {
+    'bcp': {
+        'label': 'BCP',
+        'checksum_skip': 3,
+        'header': (
+            ('1', 1, 'a'), ('count', 6, 'n'), ('date', 8, 'a'), ('C', 1, 'a'), ('0001', 4, 'a'),
+            ('debit_account', 20, 'a'), ('total', 17, 'm'), ('reference', 40, 'a'), ('checksum', 15, 'n'),
+        ),
+        'detail': (
+            ('2', 1, 'a'), ('A', 1, 'a'), ('account', 20, 'a'), ('1', 1, 'a'), ('dni', 12, 'a'),
+            ('name', 75, 'a'), ('reference', 40, 'a'), ('0001', 4, 'a'), ('amount', 17, 'm'), ('S', 1, 'a'),
+        ),
+    },
+    'interbank': {
+        'label': 'IBK',
+        'checksum_skip': 0,
+        'header': (
+            ('01', 2, 'a'), ('ruc', 11, 'a'), ('date', 8, 'a'), ('01', 2, 'a'), ('count', 6, 'n'),
+            ('total', 15, 'm'), ('debit_account', 20, 'a'), ('checksum', 15, 'n'),
+        ),
+        'detail': (
+            ('02', 2, 'a'), ('01', 2, 'a'), ('dni', 15, 'a'), ('name', 60, 'a'), ('account', 20, 'a'),
+            ('01', 2, 'a'), ('amount', 15, 'm'),
+        ),
+    },
+    'bbva': {
+        'label': 'BBVA',
+        'checksum_skip': 0,
+        'header': (
+            ('700', 3, 'a'), ('debit_account', 20, 'a'), ('PEN', 3, 'a'), ('total', 15, 'm'), ('A', 1, 'a'),
+            ('date', 8, 'a'), ('reference', 25, 'a'), ('count', 6, 'n'), ('S', 1, 'a'), ('checksum', 15, 'n'),
+        ),
+        'detail': (
+            ('002', 3, 'a'), ('L', 1, 'a'), ('dni', 12, 'a'), ('P', 1, 'a'), ('account', 20, 'a'),
+            ('name', 40, 'a'), ('amount', 15, 'm'), ('reference', 40, 'a'),
+        ),
+    },
+}
+
+# La suma de control se guarda en 15 posiciones
+BANK_CHECKSUM_MODULE = 10 ** 15
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    bank_file_format = fields.Selection([
+        ('bcp', 'BCP - Telecrédito'),
+        ('interbank', 'Interbank'),
+        ('bbva', 'BBVA - Net Cash'),
+    ], string='Formato de Archivo Bancario')
+    bank_debit_account_id = fields.Many2one(
+        'res.partner.bank', string='Cuenta de Cargo',
+        domain="[('partner_id.ref_company_ids', 'in', company_id)]",
+        help="Cuenta de la compañía desde la que se abonan los sueldos"
+    )
+    bank_file_attachment_id = fields.Many2one('ir.attachment', string='Archivo Bancario', readonly=True, copy=False)
+
+    def action_export_bank_file(self):
+        """Genera el archivo de abonos de haberes para el banco seleccionado"""
+        self.ensure_one()
+        if self.state not in ('validated', 'paid'):
+            raise UserError(_('Solo se puede generar el archivo bancario de planillas validadas o pagadas.'))
+
+        attachment = self._generate_bank_file()
+        return self._download_attachment_action(attachment)
+
+    def action_mark_as_paid(self):
+        """Con transferencia bancaria se genera el archivo de abonos si aún no existe"""
+        self.ensure_one()
+        if (self.state == 'validated' and self.payment_method == 'bank_transfer'
+                and self.bank_file_format and not self.bank_file_attachment_id):
+            self._generate_bank_file()
+        return super().action_mark_as_paid()
+
+    def _get_bank_file_query(self):
+        return SQL(
+            """
+            SELECT line.id, line.identification_id, employee.name AS employee_name,
+                   bank.sanitized_acc_number AS account, line.net_pay
+              FROM hr_payroll_line AS line
+              JOIN hr_employee AS employee ON employee.id = line.employee_id
+              LEFT JOIN res_partner_bank AS bank ON bank.id = employee.bank_account_id
+             WHERE line.payroll_id = %s
+               AND line.net_pay > 0
+             ORDER BY line.identification_id, line.id
+            """,
+            self.id,
+        )
+
+    def _check_bank_file_settings(self):
+        """Retorna el diseño del banco y la cuenta de cargo (solo dígitos)"""
+        if not self.bank_file_format:
+            raise UserError(_('Seleccione el formato de archivo bancario de la planilla.'))
+        debit_account = re.sub(r'\D', '', self.bank_debit_account_id.acc_number or '')
+        if not debit_account:
+            raise UserError(_('Seleccione la cuenta de cargo de la compañía para generar el archivo bancario.'))
+        return BANK_LAYOUTS[self.bank_file_format], debit_account
+
+    def _validate_bank_row(self, row):
+        """Errores de una fila: DNI de 8 dígitos y cuenta de abono numérica"""
+        errors = []
+        name = row['employee_name']
+        if not re.fullmatch(r'\d{8}', (row['identification_id'] or '').strip()):
+            errors.append(_('%(name)s: DNI inválido "%(dni)s".', name=name, dni=row['identification_id'] or ''))
+        if not row['account']:
+            errors.append(_('%s: no tiene cuenta bancaria registrada.', name))
+        elif not re.fullmatch(r'\d{10,20}', row['account']):
+            errors.append(_('%(name)s: cuenta bancaria inválida "%(account)s".', name=name, account=row['account']))
+        return errors
+
+    @staticmethod
+    def _format_fixed_width(layout, values):
+        """Arma un registro de ancho fijo; las claves que no están en values son literales"""
+        parts = []
+        for key, width, kind in layout:
+            value = values.get(key, key)
+            if kind == 'm':
+                value = f'{value // 100}.{value % 100:02d}'.zfill(width)
+            elif kind == 'n':
+                value = str(value).zfill(width)
+            else:
+                value = str(value or '').ljust(width)
+            parts.append(value[:width])
+        return ''.join(parts)
+
+    def _generate_bank_file(self):
+        """
+        Escribe el archivo de abonos en una sola pasada y lo guarda como adjunto
+
+        Los detalles se escriben primero a un archivo temporal mientras se
+        acumulan la cantidad, el total y la suma de control; la cabecera, que
+        lleva esos totales, se antepone al final. También asigna la referencia
+        de pago de la planilla.
+        """
+        self.ensure_one()
+        layout, debit_account = self._check_bank_file_settings()
+        period = self.date_period.strftime('%Y%m')
+        reference = f'HABERES {period}'
+        skip = layout['checksum_skip']
+
+        count = total = 0
+        checksum = int(debit_account[skip:] or 0)
+        errors = []
+        error_count = 0
+        handle, details_path = tempfile.mkstemp(suffix='.txt', prefix='banco_')
+        try:
+            with os.fdopen(handle, 'w', encoding='ascii', errors='replace', newline='\r\n') as details:
+                for row in self._stream_query(self._get_bank_file_query()):
+                    row_errors = self._validate_bank_row(row)
+                    if row_errors:
+                        error_count += len(row_errors)
+                        errors.extend(row_errors[:BANK_MAX_ERRORS - len(errors)])
+                        continue
+                    if error_count:
+                        # Con errores ya no se escribe: solo se sigue validando
+                        continue
+                    amount = round(row['net_pay'] * 100)
+                    count += 1
+                    total += amount
+                    checksum = (checksum + int(row['account'][skip:] or 0)) % BANK_CHECKSUM_MODULE
+                    details.write(self._format_fixed_width(layout['detail'], {
+                        'account': row['account'],
+                        'dni': row['identification_id'].strip(),
+                        # Los bancos no aceptan tildes ni eñes
+                        'name': unicodedata.normalize('NFKD', row['employee_name']).encode(
+                            'ascii', 'ignore').decode().upper(),
+                        'reference': reference,
+                        'amount': amount,
+                    }) + '\n')
+
+            if error_count:
+                message = '\n'.join(errors)
+                if error_count > len(errors):
+                    message += '\n' + _('... y %s errores más.', error_count - len(errors))
+                raise UserError(_('No se pudo generar el archivo bancario:\n%s', message))
+            if not count:
+                raise UserError(_('No hay montos netos por abonar en esta planilla.'))
+
+            header = self._format_fixed_width(layout['header'], {
+                'count': count,
+                'date': fields.Date.context_today(self).strftime('%Y%m%d'),
+                'debit_account': debit_account,
+                'total': total,
+                'reference': reference,
+                'ruc': re.sub(r'\D', '', self.company_id.vat or ''),
+                'checksum': checksum,
+            })
+            # Cabecera y detalles se unen en disco; el hash se calcula al copiar
+            digest = hashlib.sha1()
+            handle, path = tempfile.mkstemp(suffix='.txt', prefix='banco_')
+            with os.fdopen(handle, 'wb') as output:
+                block = header.encode('ascii', errors='replace') + b'\r\n'
+                with open(details_path, 'rb') as details:
+                    while block:
+                        digest.update(block)
+                        output.write(block)
+                        block = details.read(BANK_COPY_BLOCK_SIZE)
+        finally:
+            os.unlink(details_path)
+
+        label = layout['label']
+        try:
+            attachment = self._store_export_file(
+                'bank_file_attachment_id', f'{label}_HABERES_{period}.txt', path, 'text/plain')
+        finally:
+            os.unlink(path)
+        self.payment_reference = f'{label}-{period}-{count:06d}-{digest.hexdigest()[:8].upper()}'
+        return attachment
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+from odoo.tools import SQL
+
+from ..tools import payroll_engine
+
+# Semestre de cada beneficio según el mes de pago: meses relativos al período
+# de la planilla (inicio, fin). La gratificación de diciembre incluye el mes
+# de pago; las demás cubren los seis meses anteriores
+BENEFIT_SEMESTERS = {
+    'gratification': {7: (-6, -1), 12: (-5, 0)},
+    'cts': {5: (-6, -1), 11: (-6, -1)},
+}
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    payroll_type = fields.Selection([
+        ('monthly', 'Mensual'),
+        ('gratification', 'Gratificación'),
+        ('cts', 'CTS'),
+    ], string='Tipo de Planilla', default='monthly', required=True, tracking=True, index=True)
+
+    @api.constrains('payroll_type', 'date_period')
+    def _check_benefit_period(self):
+        for record in self.filtered(lambda payroll: payroll.payroll_type != 'monthly'):
+            months = BENEFIT_SEMESTERS[record.payroll_type]
+            if record.date_period.month not in months:
+                names = dict(self._fields['payroll_type'].selection)
+                raise ValidationError(_(
+                    'La planilla de %(type)s solo puede ser de los meses %(months)s.',
+                    type=names[record.payroll_type], months=', '.join(str(month) for month in months),
+                ))
+
+    def _get_benefit_semester(self):
+        """Primer y último día del semestre que cubre el beneficio"""
+        self.ensure_one()
+        start, end = BENEFIT_SEMESTERS[self.payroll_type][self.date_period.month]
+        first_day = self.date_period.replace(day=1)
+        return first_day + relativedelta(months=start), first_day + relativedelta(months=end + 1, days=-1)
+
+    def _read_benefit_aggregates(self, employee_ids):
+        """
+        Datos del semestre de cada empleado con una sola consulta agrupada
+        sobre las líneas del rango de períodos (índice employee_id, date_period)
+
+        Returns:
+            dict: {employee_id: fila con days, overtime, overtime_months,
+                   night_bonus, night_bonus_months, last_gratification}
+        """
+        self.ensure_one()
+        date_from, date_to = self._get_benefit_semester()
+        self.env['hr.payroll.line'].flush_model()
+        self.flush_model(['payroll_type', 'state', 'company_id'])
+        self.env.cr.execute(SQL(
+            """
+            SELECT line.employee_id,
+                   COALESCE(SUM(line.worked_days) FILTER (WHERE payroll.payroll_type = 'monthly'), 0) AS days,
+                   COALESCE(bool_or(payroll.payroll_type = 'monthly' AND line.date_period >= %(current)s),
+                            FALSE) AS has_current,
+                   COALESCE(SUM(line.overtime_amount) FILTER (WHERE payroll.payroll_type = 'monthly'), 0)
+                       AS overtime,
+                   COUNT(*) FILTER (WHERE payroll.payroll_type = 'monthly' AND line.overtime_amount > 0)
+                       AS overtime_months,
+                   COALESCE(SUM(line.night_bonus) FILTER (WHERE payroll.payroll_type = 'monthly'), 0)
+                       AS night_bonus,
+                   COUNT(*) FILTER (WHERE payroll.payroll_type = 'monthly' AND line.night_bonus > 0)
+                       AS night_bonus_months,
+                   COALESCE(SUM(line.gratification_amount) FILTER (WHERE payroll.payroll_type = 'gratification'), 0)
+                       AS last_gratification
+              FROM hr_payroll_line AS line
+              JOIN hr_payroll_monthly AS payroll ON payroll.id = line.payroll_id
+             WHERE line.employee_id IN %(employee_ids)s
+               AND line.date_period BETWEEN %(date_from)s AND %(date_to)s
+               AND payroll.company_id = %(company_id)s
+               AND payroll.payroll_type IN ('monthly', 'gratification')
+               AND payroll.state != 'cancelled'
+               AND payroll.id != %(payroll_id)s
+             GROUP BY line.employee_id
+            """,
+            current=self.date_from, employee_ids=tuple(employee_ids) or (0,),
+            date_from=date_from, date_to=date_to, company_id=self.company_id.id, payroll_id=self.id,
+        ))
+        columns = [description[0] for description in self.env.cr.description]
+        return {row[0]: dict(zip(columns, row)) for row in self.env.cr.fetchall()}
+
+
+class HrPayrollLine(models.Model):
+    _inherit = 'hr.payroll.line'
+
+    # Beneficios semestrales (planillas de gratificación y CTS)
+    months_worked = fields.Float(string='Meses Computables', digits=(5,2), readonly=True)
+    computable_remuneration = fields.Float(string='Remuneración Computable', digits=(10,2), readonly=True)
+    gratification_amount = fields.Float(string='Gratificación', digits=(10,2), readonly=True)
+    extraordinary_bonus = fields.Float(string='Bonificación Extraordinaria', digits=(10,2), readonly=True)
+    cts_amount = fields.Float(string='CTS', digits=(10,2), readonly=True)
+
+    def _filter_monthly(self):
+        """Líneas de planillas mensuales (las de beneficios no usan el motor mensual)"""
+        return self.filtered(lambda line: line.payroll_id.payroll_type == 'monthly')
+
+    def _compute_amounts(self):
+        monthly = self._filter_monthly()
+        for lines, results in (self - monthly)._filter_open()._compute_benefit_results():
+            for name in payroll_engine.LINE_RESULTS:
+                for line, value in zip(lines, results[name]):
+                    line[name] = value
+        return super(HrPayrollLine, monthly)._compute_amounts()
+
+    def _calculate_batch(self):
+        monthly = self._filter_monthly()
+        (self - monthly)._filter_open()._calculate_benefits()
+        return super(HrPayrollLine, monthly)._calculate_batch()
+
+    def _calculate_benefits(self):
+        """Calcula y escribe la gratificación o la CTS de las líneas"""
+        self.flush_recordset()
+        for lines, results in self._compute_benefit_results():
+            lines._write_batch_results(results)
+
+    def _compute_benefit_results(self):
+        """
+        Gratificación o CTS de las líneas con el motor, una consulta por
+        planilla
+
+        Returns:
+            list: (líneas, columnas de resultados) por planilla
+        """
+        batches = []
+        for payroll, lines in self.grouped('payroll_id').items():
+            aggregates = payroll._read_benefit_aggregates(lines.employee_id.ids)
+            # En diciembre el mes de pago forma parte del semestre: si aún no
+            # hay planilla mensual del mes se cuenta como trabajado
+            _start, end = BENEFIT_SEMESTERS[payroll.payroll_type][payroll.date_period.month]
+            empty = dict.fromkeys(('days', 'overtime', 'overtime_months', 'night_bonus',
+                                   'night_bonus_months', 'last_gratification'), 0)
+            rows = [aggregates.get(line.employee_id.id, empty) for line in lines]
+            cols = {
+                'wage': lines.mapped('contract_wage'),
+                'family_allowance': lines.mapped('family_allowance'),
+                'days': [
+                    float(row['days']) + (30 if end == 0 and not row.get('has_current') else 0)
+                    for row in rows
+                ],
+                'essalud_percentage': lines.mapped('contract_essalud_percentage'),
+            }
+            for name in ('overtime', 'overtime_months', 'night_bonus', 'night_bonus_months', 'last_gratification'):
+                cols[name] = [float(row[name]) for row in rows]
+            snapshot = payroll._get_payroll_snapshot()
+            if payroll.payroll_type == 'gratification' and snapshot.compute_fifth_category:
+                # La gratificación es renta de 5ta: se retiene como ingreso extraordinario
+                ytd = lines._get_fifth_category_ytd()
+                cols['fifth_ytd_income'] = [ytd.get(line.employee_id.id, (0.0, 0.0))[0] for line in lines]
+            batches.append((lines, payroll_engine.compute_benefits(payroll.payroll_type, cols, snapshot)))
+        return batches
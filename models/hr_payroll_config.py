@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from dateutil.relativedelta import relativedelta
+
 from odoo import models, fields, api
 
 class HrPayrollConfig(models.TransientModel):
@@ -21,27 +23,83 @@ class HrPayrollConfig(models.TransientModel):
     # Topes y límites
     tope_prima_amount = fields.Float(string='Tope Prima (Comisión Mixta)', digits=(10,2), default=12027.91)
     
+    # Renta de 5ta categoría
+    compute_fifth_category = fields.Boolean(string='Calcular Renta de 5ta Categoría', default=False)
+    
+    # Vigencia de los parámetros
+    valid_from = fields.Date(string='Vigente Desde', required=True,
+                             default=lambda self: fields.Date.context_today(self).replace(day=1),
+                             help="Los parámetros se guardan como una nueva versión vigente desde esta fecha")
+    
     @api.model
     def default_get(self, fields_list):
-        """Carga los valores actuales desde ir.config_parameter"""
+        """Carga los valores de la configuración vigente hoy"""
         res = super().default_get(fields_list)
         
-        ICP = self.env['ir.config_parameter'].sudo()
+        settings = self.env['hr.payroll.settings'].get_current_settings()
         
         res.update({
-            'rmv_amount': float(ICP.get_param('hr.payroll.rmv_2025', '1130.0')),
-            'uit_amount': float(ICP.get_param('hr.payroll.uit_2025', '5350.0')),
-            'family_allowance_amount': float(ICP.get_param('hr.payroll.family_allowance_2025', '113.0')),
-            'onp_percentage': float(ICP.get_param('hr.payroll.onp_percentage', '13.0')),
-            'essalud_percentage': float(ICP.get_param('hr.payroll.essalud_percentage', '9.0')),
-            'sctr_percentage': float(ICP.get_param('hr.payroll.sctr_percentage', '1.23')),
-            'tope_prima_amount': float(ICP.get_param('hr.payroll.tope_prima', '12027.91')),
+            'rmv_amount': settings.rmv_amount,
+            'uit_amount': settings.uit_amount,
+            'family_allowance_amount': settings.family_allowance_amount,
+            'onp_percentage': settings.onp_percentage,
+            'essalud_percentage': settings.essalud_percentage,
+            'sctr_percentage': settings.sctr_percentage,
+            'tope_prima_amount': settings.tope_prima_amount,
+            'compute_fifth_category': settings.compute_fifth_category,
         })
         
         return res
     
+    def _save_settings_version(self):
+        """
+        Guarda los parámetros como versión vigente desde valid_from: actualiza
+        la versión que empieza ese día o crea una nueva, cerrando la vigencia
+        de la anterior
+        """
+        self.ensure_one()
+        Settings = self.env['hr.payroll.settings']
+        company = self.env.company
+        values = {
+            'rmv_amount': self.rmv_amount,
+            'uit_amount': self.uit_amount,
+            'family_allowance_amount': self.family_allowance_amount,
+            'onp_percentage': self.onp_percentage,
+            'essalud_percentage': self.essalud_percentage,
+            'sctr_percentage': self.sctr_percentage,
+            'tope_prima_amount': self.tope_prima_amount,
+            'compute_fifth_category': self.compute_fifth_category,
+        }
+        version = Settings.search([
+            ('company_id', '=', company.id),
+            ('valid_from', '=', self.valid_from),
+        ], limit=1)
+        if version:
+            version.write(values)
+            return version
+        
+        previous = Settings.search([
+            ('company_id', '=', company.id),
+            ('valid_from', '<', self.valid_from),
+            '|', ('valid_to', '=', False), ('valid_to', '>=', self.valid_from),
+        ], limit=1)
+        # La nueva versión recalcula las planillas de la compañía al crearse
+        previous.with_context(skip_payroll_impact=True).write({'valid_to': self.valid_from - relativedelta(days=1)})
+        following = Settings.search([
+            ('company_id', '=', company.id),
+            ('valid_from', '>', self.valid_from),
+        ], order='valid_from', limit=1)
+        return Settings.create(dict(
+            values,
+            name=f"Configuración de Planilla desde {self.valid_from.strftime('%d/%m/%Y')}",
+            year=self.valid_from.year,
+            company_id=company.id,
+            valid_from=self.valid_from,
+            valid_to=following.valid_from - relativedelta(days=1) if following else False,
+        ))
+    
     def save_configuration(self):
-        """Guarda la configuración en ir.config_parameter"""
+        """Guarda la configuración como versión vigente y en ir.config_parameter"""
         self.ensure_one()
         
         ICP = self.env['ir.config_parameter'].sudo()
@@ -59,6 +117,9 @@ class HrPayrollConfig(models.TransientModel):
         if afp_prima:
             afp_prima.tope_amount = self.tope_prima_amount
         
+        # Versión de la configuración usada en el cálculo
+        self._save_settings_version()
+        
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
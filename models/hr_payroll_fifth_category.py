@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .hr_payroll_line import FROZEN_PAYROLL_STATES
+from ..tools import payroll_engine
+
+
+class HrPayrollFifthAccumulator(models.Model):
+    """
+    Acumulado anual de renta de 5ta categoría por empleado
+
+    Suma la remuneración y las retenciones de las planillas validadas o
+    pagadas del año (mensuales y de gratificación). Se actualiza al validar
+    una planilla y al revertirla, de modo que el cálculo del mes no necesita
+    recorrer las líneas anteriores. Al instalar o actualizar el módulo se
+    vuelve a armar desde las líneas.
+    """
+    _name = 'hr.payroll.fifth.accumulator'
+    _description = 'Acumulado de Renta de 5ta Categoría'
+    _order = 'year desc, employee_id'
+
+    employee_id = fields.Many2one('hr.employee', string='Empleado', required=True, ondelete='cascade', readonly=True)
+    company_id = fields.Many2one('res.company', string='Compañía', required=True, readonly=True)
+    year = fields.Integer(string='Año', required=True, readonly=True)
+    taxable_income = fields.Float(string='Remuneración Acumulada', digits=(12,2), readonly=True)
+    withheld = fields.Float(string='Retenciones Acumuladas', digits=(12,2), readonly=True)
+    payroll_count = fields.Integer(string='Planillas', readonly=True)
+
+    _sql_constraints = [
+        ('employee_company_year_uniq', 'unique(employee_id, company_id, year)',
+         'Solo puede haber un acumulado por empleado, compañía y año.'),
+    ]
+
+    def init(self):
+        # Planillas validadas o pagadas antes de instalar o actualizar el módulo
+        self._rebuild()
+
+    @api.model
+    def _rebuild(self):
+        """Vuelve a armar el acumulado desde las líneas de todas las planillas validadas o pagadas"""
+        self.env.cr.execute("DELETE FROM hr_payroll_fifth_accumulator")
+        self.env['hr.payroll.monthly'].sudo().search([
+            ('state', 'in', FROZEN_PAYROLL_STATES),
+            ('payroll_type', '!=', 'cts'),
+        ])._accumulate_fifth_category(1)
+        self.invalidate_model()
+
+    def action_rebuild(self):
+        self.check_access('write')
+        self._rebuild()
+        return True
+
+    @api.model
+    def _get_ytd(self, payroll, employee_ids):
+        """
+        Renta de 5ta anterior al período de la planilla y retenciones
+        anteriores al mes de corte: {employee_id: (remuneración, retenciones)}
+
+        Cuentan las planillas validadas o pagadas del año con período anterior
+        y, para la planilla mensual, la gratificación del mismo período. El
+        acumulado anual se usa solo cuando coincide con ese corte, es decir
+        cuando no hay planillas validadas posteriores y las retenciones a
+        restar son todas o ninguna; si no, se agrupan las líneas.
+        """
+        period = payroll.date_period.replace(day=1)
+        cutoff_month = payroll_engine.FIFTH_CATEGORY_SCHEDULE[period.month][1]
+        if cutoff_month in (1, period.month) and not payroll._has_later_fifth_category_payrolls():
+            return {
+                values['employee_id']: (values['taxable_income'], values['withheld'] if cutoff_month > 1 else 0.0)
+                for values in self.sudo().search_read([
+                    ('company_id', '=', payroll.company_id.id),
+                    ('year', '=', period.year),
+                    ('employee_id', 'in', employee_ids),
+                ], ['employee_id', 'taxable_income', 'withheld'], load=None)
+            }
+        return self._read_ytd(payroll, employee_ids, period.replace(month=cutoff_month))
+
+    @api.model
+    def _read_ytd(self, payroll, employee_ids, cutoff):
+        """Acumulado anterior al período agrupando las líneas con una sola consulta"""
+        period = payroll.date_period.replace(day=1)
+        self.env['hr.payroll.line'].flush_model(['payroll_id', 'employee_id', 'total_income', 'fifth_category_tax'])
+        self.env['hr.payroll.monthly'].flush_model(['company_id', 'date_period', 'state', 'payroll_type'])
+        # En el mes de corte se restan todas las retenciones anteriores,
+        # incluida la de la gratificación del mismo período
+        withheld_filter = SQL("TRUE") if cutoff == period else SQL("payroll.date_period < %s", cutoff)
+        self.env.cr.execute(SQL(
+            """
+            SELECT line.employee_id,
+                   COALESCE(SUM(line.total_income), 0),
+                   COALESCE(SUM(line.fifth_category_tax) FILTER (WHERE %(withheld_filter)s), 0)
+              FROM hr_payroll_line AS line
+              JOIN hr_payroll_monthly AS payroll ON payroll.id = line.payroll_id
+             WHERE payroll.company_id = %(company_id)s
+               AND payroll.state IN %(states)s
+               AND payroll.id != %(payroll_id)s
+               AND line.employee_id IN %(employee_ids)s
+               -- La CTS no es renta de 5ta categoría
+               AND payroll.payroll_type != 'cts'
+               AND payroll.date_period >= %(year_start)s
+               AND (payroll.date_period < %(period)s
+                    OR (%(is_monthly)s AND payroll.date_period < %(next_period)s
+                        AND payroll.payroll_type != 'monthly'))
+             GROUP BY line.employee_id
+            """,
+            withheld_filter=withheld_filter, company_id=payroll.company_id.id, states=FROZEN_PAYROLL_STATES,
+            payroll_id=payroll.id or 0, employee_ids=tuple(employee_ids) or (0,),
+            year_start=period.replace(month=1), period=period, next_period=period + relativedelta(months=1),
+            is_monthly=payroll.payroll_type == 'monthly',
+        ))
+        return {
+            employee_id: (float(income), float(withheld))
+            for employee_id, income, withheld in self.env.cr.fetchall()
+        }
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    def write(self, vals):
+        if 'state' not in vals:
+            return super().write(vals)
+        accumulated = self.filtered(lambda payroll: payroll.state in FROZEN_PAYROLL_STATES)
+        res = super().write(vals)
+        if vals['state'] in FROZEN_PAYROLL_STATES:
+            (self - accumulated)._accumulate_fifth_category(1)
+        else:
+            accumulated._accumulate_fifth_category(-1)
+        return res
+
+    def _has_later_fifth_category_payrolls(self):
+        """
+        Indica si el acumulado anual incluye planillas validadas o pagadas
+        que no son anteriores a esta: de un período posterior del mismo año o
+        del mismo período (salvo la gratificación para la planilla mensual)
+        """
+        self.ensure_one()
+        period = self.date_period.replace(day=1)
+        next_period = period + relativedelta(months=1)
+        same_period = [('date_period', '>=', period)]
+        if self.payroll_type == 'monthly':
+            same_period = ['&', ('date_period', '>=', period), ('payroll_type', '=', 'monthly')]
+        return bool(self.sudo().search_count([
+            ('id', '!=', self.id or 0),
+            ('company_id', '=', self.company_id.id),
+            ('state', 'in', FROZEN_PAYROLL_STATES),
+            ('payroll_type', '!=', 'cts'),
+            ('date_period', '<=', period.replace(month=12, day=31)),
+            '|', ('date_period', '>=', next_period),
+        ] + same_period, limit=1))
+
+    def _accumulate_fifth_category(self, sign):
+        """
+        Suma (sign=1) o resta (sign=-1) las líneas de las planillas al
+        acumulado anual de cada empleado con un solo INSERT ... ON CONFLICT
+        """
+        if not self:
+            return
+        self.env['hr.payroll.line'].flush_model(['payroll_id', 'employee_id', 'total_income', 'fifth_category_tax'])
+        self.flush_recordset(['company_id', 'date_period'])
+        self.env.cr.execute(SQL(
+            """
+            INSERT INTO hr_payroll_fifth_accumulator AS acc
+                   (employee_id, company_id, year, taxable_income, withheld, payroll_count,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT line.employee_id, payroll.company_id,
+                   EXTRACT(YEAR FROM payroll.date_period)::int,
+                   %(sign)s * SUM(COALESCE(line.total_income, 0)),
+                   %(sign)s * SUM(COALESCE(line.fifth_category_tax, 0)),
+                   %(sign)s * COUNT(DISTINCT payroll.id),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM hr_payroll_line AS line
+              JOIN hr_payroll_monthly AS payroll ON payroll.id = line.payroll_id
+             WHERE payroll.id IN %(ids)s
+               -- La CTS no es renta de 5ta categoría
+               AND payroll.payroll_type != 'cts'
+             GROUP BY line.employee_id, payroll.company_id, EXTRACT(YEAR FROM payroll.date_period)
+            ON CONFLICT (employee_id, company_id, year) DO UPDATE
+               SET taxable_income = acc.taxable_income + EXCLUDED.taxable_income,
+                   withheld = acc.withheld + EXCLUDED.withheld,
+                   payroll_count = acc.payroll_count + EXCLUDED.payroll_count,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+            """,
+            sign=sign, uid=self.env.uid, ids=tuple(self.ids),
+        ))
+        self.env['hr.payroll.fifth.accumulator'].invalidate_model()
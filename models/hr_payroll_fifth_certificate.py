@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL, float_compare
+
+from .hr_payroll_line import FROZEN_PAYROLL_STATES
+from ..tools import payroll_engine
+
+FIFTH_CERTIFICATE_REPORT = 'peruanita_payroll.action_report_fifth_certificate'
+
+# Montos del certificado que vienen de la consulta agrupada
+FIFTH_CERTIFICATE_AMOUNTS = ('remuneration_income', 'gratification_income', 'withheld')
+
+
+class HrPayrollFifthCertificate(models.Model):
+    """
+    Certificado anual de rentas y retenciones de 5ta categoría
+
+    Guarda los montos del año de cada empleado y el PDF generado: el portal
+    del empleado lee estos registros sin volver a recorrer las planillas.
+    """
+    _name = 'hr.payroll.fifth.certificate'
+    _description = 'Certificado de Rentas y Retenciones de 5ta Categoría'
+    _order = 'year desc, employee_id'
+
+    employee_id = fields.Many2one('hr.employee', string='Empleado', required=True, ondelete='cascade',
+                                  readonly=True, index=True)
+    company_id = fields.Many2one('res.company', string='Compañía', required=True, readonly=True)
+    currency_id = fields.Many2one(related='company_id.currency_id')
+    year = fields.Integer(string='Año', required=True, readonly=True)
+    identification_id = fields.Char(string='DNI', readonly=True)
+    date_from = fields.Date(string='Primer Período', readonly=True)
+    date_to = fields.Date(string='Último Período', readonly=True)
+    payroll_count = fields.Integer(string='Planillas', readonly=True)
+
+    # Montos del año
+    remuneration_income = fields.Float(string='Remuneraciones', digits=(12,2), readonly=True)
+    gratification_income = fields.Float(string='Gratificaciones', digits=(12,2), readonly=True,
+                                        help="Gratificaciones y bonificación extraordinaria")
+    total_income = fields.Float(string='Renta Bruta', digits=(12,2), readonly=True)
+    deduction = fields.Float(string='Deducción 7 UIT', digits=(12,2), readonly=True)
+    net_income = fields.Float(string='Renta Neta', digits=(12,2), readonly=True)
+    annual_tax = fields.Float(string='Impuesto Anual', digits=(12,2), readonly=True)
+    withheld = fields.Float(string='Retenciones', digits=(12,2), readonly=True)
+
+    attachment_id = fields.Many2one('ir.attachment', string='Certificado (PDF)', readonly=True, copy=False)
+    date_generated = fields.Datetime(string='Generado el', readonly=True)
+
+    _sql_constraints = [
+        ('employee_company_year_uniq', 'unique(employee_id, company_id, year)',
+         'Solo puede haber un certificado por empleado, compañía y año.'),
+    ]
+
+    @api.depends('employee_id', 'year')
+    def _compute_display_name(self):
+        for certificate in self:
+            certificate.display_name = f'{certificate.year} - {certificate.employee_id.name or ""}'
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_('El certificado aún no tiene PDF. Vuelva a generar los certificados del año.'))
+        return self.env['hr.payroll.monthly']._download_attachment_action(self.attachment_id)
+
+    # GENERACIÓN
+
+    @api.model
+    def _read_year_aggregates(self, company_id, year):
+        """
+        Montos del año de todos los empleados con una sola consulta agrupada
+        sobre las líneas de las planillas validadas o pagadas (sin la CTS)
+
+        Returns:
+            list: filas (diccionarios), una por empleado
+        """
+        self.env['hr.payroll.line'].flush_model(['payroll_id', 'employee_id', 'identification_id',
+                                                 'total_income', 'fifth_category_tax'])
+        self.env['hr.payroll.monthly'].flush_model(['company_id', 'date_period', 'state', 'payroll_type'])
+        self.env.cr.execute(SQL(
+            """
+            SELECT line.employee_id,
+                   (array_agg(line.identification_id ORDER BY payroll.date_period DESC))[1] AS identification_id,
+                   MIN(payroll.date_period) AS date_from,
+                   MAX(payroll.date_period) AS date_to,
+                   COUNT(DISTINCT payroll.id) AS payroll_count,
+                   COALESCE(SUM(line.total_income) FILTER (WHERE payroll.payroll_type = 'monthly'), 0)
+                       AS remuneration_income,
+                   COALESCE(SUM(line.total_income) FILTER (WHERE payroll.payroll_type = 'gratification'), 0)
+                       AS gratification_income,
+                   COALESCE(SUM(line.fifth_category_tax), 0) AS withheld
+              FROM hr_payroll_line AS line
+              JOIN hr_payroll_monthly AS payroll ON payroll.id = line.payroll_id
+             WHERE payroll.company_id = %(company_id)s
+               AND payroll.date_period BETWEEN %(date_from)s AND %(date_to)s
+               AND payroll.state IN %(states)s
+               -- La CTS no es renta de 5ta categoría
+               AND payroll.payroll_type != 'cts'
+             GROUP BY line.employee_id
+            """,
+            company_id=company_id, date_from=date(year, 1, 1), date_to=date(year, 12, 31),
+            states=FROZEN_PAYROLL_STATES,
+        ))
+        return self.env.cr.dictfetchall()
+
+    @api.model
+    def _prepare_certificate_values(self, row, snapshot):
+        """Valores del certificado a partir de la fila agrupada y la UIT del año"""
+        values = {name: round(float(row[name]), 2) for name in FIFTH_CERTIFICATE_AMOUNTS}
+        total_income = values['remuneration_income'] + values['gratification_income']
+        deduction = payroll_engine.FIFTH_CATEGORY_DEDUCTION_UIT * snapshot.uit_amount
+        net_income = max(total_income - deduction, 0.0)
+        values.update({
+            'identification_id': row['identification_id'],
+            'date_from': row['date_from'],
+            'date_to': row['date_to'],
+            'payroll_count': row['payroll_count'],
+            'total_income': round(total_income, 2),
+            'deduction': round(deduction, 2),
+            'net_income': round(net_income, 2),
+            'annual_tax': round(payroll_engine.fifth_category_annual_tax(net_income, snapshot.uit_amount), 2),
+        })
+        return values
+
+    def _has_changes(self, values):
+        self.ensure_one()
+        for name, value in values.items():
+            if self._fields[name].type == 'float':
+                if float_compare(self[name], value, precision_digits=2):
+                    return True
+            elif self[name] != value:
+                return True
+        return False
+
+    @api.model
+    def _generate_certificates(self, company_id, year):
+        """
+        Calcula los certificados de todos los empleados de la compañía y año
+        y renderiza por bloques los PDF de los que cambiaron
+
+        Returns:
+            recordset: certificados del año
+        """
+        rows = self._read_year_aggregates(company_id, year)
+        if not rows:
+            raise UserError(_('No hay planillas validadas o pagadas en %s.', year))
+        # La UIT del ejercicio es la vigente en diciembre
+        snapshot = self.env['hr.payroll.settings']._get_payroll_snapshot(company_id, f'{year}-12')
+
+        existing = {
+            certificate.employee_id.id: certificate
+            for certificate in self.search([('company_id', '=', company_id), ('year', '=', year)])
+        }
+        to_create = []
+        to_render = self.browse()
+        for row in rows:
+            values = self._prepare_certificate_values(row, snapshot)
+            certificate = existing.pop(row['employee_id'], None)
+            if certificate is None:
+                to_create.append({**values, 'employee_id': row['employee_id'],
+                                  'company_id': company_id, 'year': year})
+            elif certificate._has_changes(values) or not certificate.attachment_id:
+                certificate.write(values)
+                to_render |= certificate
+        # Empleados que ya no tienen rentas en el año (planillas revertidas);
+        # sus PDF se eliminan con el registro
+        self.browse([certificate.id for certificate in existing.values()]).unlink()
+        to_render |= self.create(to_create)
+
+        to_render._render_certificate_pdfs()
+        return self.search([('company_id', '=', company_id), ('year', '=', year)])
+
+    def _render_certificate_pdfs(self):
+        """
+        Renderiza los certificados por bloques y guarda un PDF por empleado
+
+        Cada bloque se renderiza de una vez y Odoo separa el PDF por registro;
+        si no puede hacerlo se renderiza el certificado solo.
+        """
+        chunk_size = self.env['hr.payroll.monthly']._get_payslip_chunk_size()
+        report = self.env['ir.actions.report']
+        self.env.flush_all()
+        for start in range(0, len(self), chunk_size):
+            chunk = self[start:start + chunk_size]
+            streams = report._render_qweb_pdf_prepare_streams(FIFTH_CERTIFICATE_REPORT, {}, res_ids=chunk.ids)
+            vals_list = []
+            for certificate in chunk:
+                stream_data = streams.get(certificate.id)
+                if stream_data and stream_data.get('stream'):
+                    raw = stream_data['stream'].getvalue()
+                else:
+                    raw = report._render_qweb_pdf(FIFTH_CERTIFICATE_REPORT, res_ids=certificate.ids)[0]
+                vals_list.append({
+                    'name': f'Certificado 5ta {certificate.year} - {certificate.identification_id or certificate.id}.pdf',
+                    'raw': raw,
+                    'mimetype': 'application/pdf',
+                    'res_model': self._name,
+                    'res_id': certificate.id,
+                })
+            for stream_data in streams.values():
+                if stream_data.get('stream'):
+                    stream_data['stream'].close()
+            chunk.attachment_id.unlink()
+            attachments = self.env['ir.attachment'].create(vals_list)
+            now = fields.Datetime.now()
+            for certificate, attachment in zip(chunk, attachments):
+                certificate.write({'attachment_id': attachment.id, 'date_generated': now})
+
+
+class HrPayrollFifthCertificateWizard(models.TransientModel):
+    _name = 'hr.payroll.fifth.certificate.wizard'
+    _description = 'Generar Certificados de 5ta Categoría'
+
+    company_id = fields.Many2one('res.company', string='Compañía', required=True,
+                                 default=lambda self: self.env.company)
+    year = fields.Integer(string='Año', required=True, default=lambda self: fields.Date.today().year - 1)
+
+    def action_generate(self):
+        self.ensure_one()
+        certificates = self.env['hr.payroll.fifth.certificate']._generate_certificates(
+            self.company_id.id, self.year)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Certificados de 5ta Categoría %s', self.year),
+            'res_model': 'hr.payroll.fifth.certificate',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', certificates.ids)],
+        }
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+from dataclasses import replace
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+from ..tools import payroll_engine
+from .hr_payroll_benefits import BENEFIT_SEMESTERS
+
+# Montos del motor que se suman en la proyección
+FORECAST_AMOUNTS = (
+    'total_income', 'afp_total', 'onp_discount', 'net_pay',
+    'essalud', 'sctr', 'total_employer_contribution',
+)
+
+# Mes de pago de cada beneficio
+FORECAST_BENEFIT_MONTHS = {
+    month: kind for kind, months in BENEFIT_SEMESTERS.items() for month in months
+}
+
+
+class HrPayrollForecast(models.Model):
+    """
+    Proyección del costo del empleador para los próximos meses
+
+    Proyecta los contratos vigentes mes a mes (fin de contrato, cambios de
+    RMV y UIT ya programados en las versiones de la configuración,
+    gratificaciones y CTS) y calcula todos los meses con el motor de
+    planilla. El resultado se guarda agrupado por mes y departamento.
+    """
+    _name = 'hr.payroll.forecast'
+    _description = 'Proyección de Costo de Planilla'
+    _order = 'date_from desc, id desc'
+
+    name = fields.Char(string='Descripción', required=True, default=lambda self: _('Proyección de Costo'))
+    company_id = fields.Many2one('res.company', string='Compañía', required=True, default=lambda self: self.env.company)
+    currency_id = fields.Many2one(related='company_id.currency_id')
+    date_from = fields.Date(string='Primer Mes', required=True,
+                            default=lambda self: fields.Date.today().replace(day=1) + relativedelta(months=1))
+    month_count = fields.Integer(string='Meses', required=True, default=12)
+    date_computed = fields.Datetime(string='Calculado el', readonly=True, copy=False)
+    contract_count = fields.Integer(string='Contratos', readonly=True, copy=False)
+    line_ids = fields.One2many('hr.payroll.forecast.line', 'forecast_id', string='Proyección', readonly=True)
+
+    total_employer_cost = fields.Float(string='Costo Total Empleador', compute='_compute_totals', store=True,
+                                       digits=(12,2))
+    total_employer_contribution = fields.Float(string='Total Aportes Empleador', compute='_compute_totals',
+                                               store=True, digits=(12,2))
+
+    @api.depends('line_ids.total_employer_cost', 'line_ids.total_employer_contribution')
+    def _compute_totals(self):
+        for forecast in self:
+            forecast.total_employer_cost = sum(forecast.line_ids.mapped('total_employer_cost'))
+            forecast.total_employer_contribution = sum(forecast.line_ids.mapped('total_employer_contribution'))
+
+    @api.constrains('month_count')
+    def _check_month_count(self):
+        for forecast in self:
+            if not 1 <= forecast.month_count <= 36:
+                raise ValidationError(_('La proyección debe tener entre 1 y 36 meses.'))
+
+    def action_compute(self):
+        for forecast in self:
+            forecast._compute_forecast()
+        return True
+
+    def action_view_lines(self):
+        self.ensure_one()
+        action = self.env['ir.actions.act_window']._for_xml_id('peruanita_payroll.action_hr_payroll_forecast_line')
+        action['domain'] = [('forecast_id', '=', self.id)]
+        action['context'] = {'search_default_group_department': 1}
+        return action
+
+    # PROYECCIÓN
+
+    def _get_forecast_periods(self):
+        """Primer día de cada mes proyectado"""
+        first_day = self.date_from.replace(day=1)
+        return [first_day + relativedelta(months=index) for index in range(self.month_count)]
+
+    def _read_forecast_contracts(self, date_from, date_to):
+        """Contratos vigentes en algún mes del rango y sus empleados, en dos lecturas"""
+        Monthly = self.env['hr.payroll.monthly']
+        contracts = self.env['hr.contract'].search_read([
+            ('state', '=', 'open'),
+            ('company_id', '=', self.company_id.id),
+            ('employee_id', '!=', False),
+            ('date_start', '<=', date_to),
+            '|',
+            ('date_end', '=', False),
+            ('date_end', '>=', date_from),
+        ], Monthly._get_contract_read_fields(), load=None)
+        employee_fields = Monthly._get_employee_read_fields() + [
+            'department_id', 'pension_system', 'afp_id', 'commission_type', 'exempt_afp_commission',
+        ]
+        employees = {
+            employee['id']: employee
+            for employee in self.env['hr.employee'].browse(
+                list({contract['employee_id'] for contract in contracts})).read(employee_fields, load=None)
+        }
+        return contracts, employees
+
+    def _compute_forecast(self):
+        """
+        Proyecta los meses y reemplaza las líneas de la proyección
+
+        Las filas de todos los meses (una por contrato vigente en el mes) se
+        arman como columnas y se calculan en una sola pasada del motor. Las
+        entradas se derivan del contrato como al generar las líneas de una
+        planilla, sin entradas variables (horas extras, tardanzas, etc.).
+        """
+        self.ensure_one()
+        Monthly = self.env['hr.payroll.monthly']
+        settings = self.env['hr.payroll.settings']
+        periods = self._get_forecast_periods()
+        # El semestre de la gratificación y la CTS puede empezar antes del primer mes
+        history = [periods[0] + relativedelta(months=offset) for offset in range(-6, 0)]
+        months = {
+            day: Monthly.new({'date_period': day, 'company_id': self.company_id.id})
+            for day in history + periods
+        }
+        # Sin acumulado del año la 5ta categoría se proyecta con el monto fijo del contrato
+        snapshots = {
+            day: replace(settings._get_payroll_snapshot(self.company_id.id, day.strftime('%Y-%m')),
+                         compute_fifth_category=False)
+            for day in periods
+        }
+        for day in history:
+            try:
+                snapshots[day] = replace(settings._get_payroll_snapshot(self.company_id.id, day.strftime('%Y-%m')),
+                                         compute_fifth_category=False)
+            except UserError:
+                # Meses del semestre anteriores a la primera configuración vigente
+                snapshots[day] = snapshots[periods[0]]
+        contracts, employees = self._read_forecast_contracts(
+            months[history[0]].date_from, months[periods[-1]].date_to)
+        if not contracts:
+            raise UserError(_('No hay contratos vigentes para proyectar.'))
+
+        # Valores de línea (días trabajados, sueldo, asignación familiar) de
+        # cada contrato en los meses en que está vigente
+        line_values = {}
+        for day, month in months.items():
+            for contract in contracts:
+                if contract['date_start'] <= month.date_to and (
+                        not contract['date_end'] or contract['date_end'] >= month.date_from):
+                    line_values[contract['id'], day] = month._prepare_line_values(
+                        contract, employees[contract['employee_id']], snapshots[day])
+
+        cols = {name: [] for name in payroll_engine.LINE_INPUTS}
+        row_months = []
+        row_keys = []
+        for index, day in enumerate(periods):
+            for contract in contracts:
+                values = line_values.get((contract['id'], day))
+                if values is None:
+                    continue
+                employee = employees[contract['employee_id']]
+                row = dict.fromkeys(payroll_engine.LINE_INPUTS, 0.0)
+                row.update({name: values[name] for name in values if name in row})
+                row.update({
+                    'has_contract': True,
+                    'pension_system': employee['pension_system'],
+                    'afp_id': employee['afp_id'],
+                    'commission_type': employee['commission_type'],
+                    'exempt_afp_commission': employee['exempt_afp_commission'],
+                })
+                for name, value in row.items():
+                    cols[name].append(value)
+                row_months.append(index)
+                row_keys.append((contract['employee_id'], employee['department_id']))
+
+        base = snapshots[periods[0]]
+        results = payroll_engine.compute_projection(
+            cols, row_months, [snapshots[day] for day in periods], base=base)
+
+        totals = {}
+        for row, (index, (employee_id, department_id)) in enumerate(zip(row_months, row_keys)):
+            values = self._get_forecast_bucket(totals, periods[index], department_id)
+            values['employee_ids'].add(employee_id)
+            for name in FORECAST_AMOUNTS:
+                values[name] += results[name][row]
+
+        for day in periods:
+            kind = FORECAST_BENEFIT_MONTHS.get(day.month)
+            if kind:
+                self._add_forecast_benefits(totals, kind, day, contracts, employees, line_values, snapshots, base)
+
+        vals_list = []
+        for (day, department_id), values in totals.items():
+            employee_ids = values.pop('employee_ids')
+            vals = {name: round(value, 2) for name, value in values.items()}
+            vals.update({
+                'forecast_id': self.id,
+                'date_period': day,
+                'department_id': department_id,
+                'employee_count': len(employee_ids),
+                'total_employer_cost': round(values['net_pay'] + values['total_employer_contribution'], 2),
+            })
+            vals_list.append(vals)
+        self.line_ids.unlink()
+        self.env['hr.payroll.forecast.line'].create(vals_list)
+        self.write({
+            'date_computed': fields.Datetime.now(),
+            'contract_count': len({contract_id for contract_id, day in line_values if day >= periods[0]}),
+        })
+
+    @api.model
+    def _get_forecast_bucket(self, totals, day, department_id):
+        key = (day, department_id)
+        if key not in totals:
+            totals[key] = dict.fromkeys(FORECAST_AMOUNTS + ('gratification_amount', 'cts_amount'), 0.0)
+            totals[key]['employee_ids'] = set()
+        return totals[key]
+
+    def _add_forecast_benefits(self, totals, kind, day, contracts, employees, line_values, snapshots, base):
+        """
+        Suma la gratificación o la CTS proyectada del mes de pago
+
+        Se paga a los contratos vigentes en el mes, por los días del semestre
+        dentro del contrato. La bonificación del contrato cuenta como concepto
+        variable de todos los meses trabajados; la CTS toma como última
+        gratificación la remuneración computable completa.
+        """
+        start, end = BENEFIT_SEMESTERS[kind][day.month]
+        semester = [day + relativedelta(months=offset) for offset in range(start, end + 1)]
+        snapshot = snapshots[day]
+        rows = [contract for contract in contracts if (contract['id'], day) in line_values]
+        if not rows:
+            return
+        cols = {name: [] for name in ('has_contract', 'contract_wage', 'salary', 'family_allowance', 'days',
+                                      'night_bonus', 'night_bonus_months', 'essalud_percentage')}
+        for contract in rows:
+            month_values = [line_values.get((contract['id'], month)) for month in semester]
+            month_values = [values for values in month_values if values]
+            current = line_values[contract['id'], day]
+            cols['has_contract'].append(True)
+            cols['contract_wage'].append(contract['wage'])
+            cols['salary'].append(contract['wage'])
+            cols['family_allowance'].append(current['family_allowance'])
+            cols['days'].append(sum(values['worked_days'] for values in month_values))
+            cols['night_bonus'].append(contract['night_bonus'] * len(month_values))
+            cols['night_bonus_months'].append(len(month_values) if contract['night_bonus'] else 0)
+            cols['essalud_percentage'].append(contract['essalud_percentage'])
+        # Sueldos bajo la RMV del mes elevados como en los meses proyectados
+        cols = payroll_engine.simulated_inputs(cols, base, snapshot)
+        count = len(rows)
+        cols['wage'] = cols['contract_wage']
+        cols['overtime'] = cols['overtime_months'] = [0.0] * count
+        cols['last_gratification'] = [wage + family for wage, family in zip(cols['wage'], cols['family_allowance'])]
+        results = payroll_engine.compute_benefits(kind, cols, snapshot)
+
+        amount_field = 'cts_amount' if kind == 'cts' else 'gratification_amount'
+        for row, contract in enumerate(rows):
+            employee = employees[contract['employee_id']]
+            values = self._get_forecast_bucket(totals, day, employee['department_id'])
+            values['employee_ids'].add(contract['employee_id'])
+            values[amount_field] += results['total_income'][row]
+            values['total_income'] += results['total_income'][row]
+            values['net_pay'] += results['net_pay'][row]
+
+
+class HrPayrollForecastLine(models.Model):
+    """Costo proyectado de un mes y un departamento"""
+    _name = 'hr.payroll.forecast.line'
+    _description = 'Línea de Proyección de Costo de Planilla'
+    _order = 'date_period, department_id'
+
+    forecast_id = fields.Many2one('hr.payroll.forecast', string='Proyección', required=True,
+                                  ondelete='cascade', index=True)
+    company_id = fields.Many2one(related='forecast_id.company_id', store=True)
+    currency_id = fields.Many2one(related='forecast_id.currency_id')
+    date_period = fields.Date(string='Mes', required=True)
+    department_id = fields.Many2one('hr.department', string='Departamento')
+    employee_count = fields.Integer(string='Empleados')
+    total_income = fields.Float(string='Total Ingresos', digits=(12,2))
+    gratification_amount = fields.Float(string='Gratificaciones', digits=(12,2),
+                                        help="Gratificación y bonificación extraordinaria")
+    cts_amount = fields.Float(string='CTS', digits=(12,2))
+    afp_total = fields.Float(string='Total AFP', digits=(12,2))
+    onp_discount = fields.Float(string='Total ONP', digits=(12,2))
+    net_pay = fields.Float(string='Neto a Pagar', digits=(12,2))
+    essalud = fields.Float(string='EsSalud', digits=(12,2))
+    sctr = fields.Float(string='SCTR', digits=(12,2))
+    total_employer_contribution = fields.Float(string='Total Aportes Empleador', digits=(12,2))
+    total_employer_cost = fields.Float(string='Costo Total Empleador', digits=(12,2))
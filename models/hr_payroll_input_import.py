@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import csv
+import io
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from .hr_payroll_line import VARIABLE_INPUTS
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Máximo de filas rechazadas que se muestran en el resultado
+IMPORT_MAX_ERRORS = 200
+
+# Otros nombres de columna aceptados (exportación del reloj marcador)
+IMPORT_COLUMN_ALIASES = {
+    'documento': 'identification_id',
+    'nro_documento': 'identification_id',
+    'dias_trabajados': 'worked_days',
+    'dias': 'worked_days',
+    'tardanzas': 'tardiness_count',
+    'descanso_medico': 'medical_rest_days',
+    'dias_descanso_medico': 'medical_rest_days',
+    'vacaciones': 'vacation_days',
+    'dias_vacaciones': 'vacation_days',
+    'horas_extras': 'overtime_amount',
+    'adelanto': 'advance_payment',
+}
+
+
+class HrPayrollInputImport(models.TransientModel):
+    """
+    Carga las entradas variables del mes (tardanzas, horas extras, adelantos,
+    etc.) en las líneas de una planilla, desde la planilla exportada a Excel
+    o desde el CSV del reloj marcador
+
+    Las filas se emparejan por DNI con un índice en memoria y todos los
+    cambios se aplican con una sola actualización en bloque.
+    """
+    _name = 'hr.payroll.input.import'
+    _description = 'Importar Entradas de Planilla'
+
+    payroll_id = fields.Many2one('hr.payroll.monthly', string='Planilla', required=True, readonly=True)
+    file = fields.Binary(string='Archivo', required=True)
+    filename = fields.Char(string='Nombre del Archivo')
+    result = fields.Text(string='Resultado', readonly=True)
+    rejected_file = fields.Binary(string='Filas Rechazadas', readonly=True, attachment=False)
+    rejected_filename = fields.Char(string='Nombre del Archivo de Rechazos', readonly=True)
+
+    def action_import(self):
+        self.ensure_one()
+        if self.payroll_id.state not in ('draft', 'calculated'):
+            raise UserError(_('Solo se pueden cargar entradas en planillas en borrador o calculadas.'))
+
+        content = base64.b64decode(self.file)
+        if (self.filename or '').lower().endswith(('.csv', '.txt')):
+            header, rows = self._read_csv(content)
+        else:
+            header, rows = self._read_xlsx(content)
+        updated, rejected = self._import_rows(header, rows)
+        self.write({
+            'result': self._format_result(updated, rejected),
+            'rejected_file': self._write_rejected_file(header, rejected) if rejected else False,
+            'rejected_filename': 'rechazados.csv' if rejected else False,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _read_xlsx(self, content):
+        """
+        Lee la hoja en modo de solo lectura (las filas se leen a medida que se usan)
+
+        Returns:
+            tuple: (encabezados, iterador de filas)
+        """
+        if openpyxl is None:
+            raise UserError(_('Se necesita la librería openpyxl para leer archivos de Excel.'))
+        try:
+            workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        except Exception:
+            raise UserError(_('El archivo no es un Excel (.xlsx) válido.'))
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            raise UserError(_('La hoja está vacía.'))
+        return header, rows
+
+    def _read_csv(self, content):
+        """
+        Lee el CSV del reloj marcador (UTF-8 o Latin-1, separado por coma,
+        punto y coma o tabulador) sin cargar todas las filas a la vez
+
+        Returns:
+            tuple: (encabezados, iterador de filas)
+        """
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = content.decode('latin-1')
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(io.StringIO(text), dialect)
+        header = next(rows, None)
+        if not header:
+            raise UserError(_('El archivo está vacío.'))
+        return header, rows
+
+    @api.model
+    def _get_column_map(self, header):
+        """
+        Columna de cada campo: se aceptan la etiqueta del campo (como en la
+        exportación) o su nombre técnico
+
+        Returns:
+            tuple: (columna del DNI, {campo de VARIABLE_INPUTS: columna})
+        """
+        line_fields = self.env['hr.payroll.line']._fields
+        names = {'dni': 'identification_id', 'identification_id': 'identification_id', **IMPORT_COLUMN_ALIASES}
+        for name in VARIABLE_INPUTS:
+            names[name] = name
+            names[line_fields[name].string.strip().lower()] = name
+        columns = {}
+        for index, label in enumerate(header):
+            label = str(label or '').strip().lower()
+            name = names.get(label) or names.get(label.replace(' ', '_'))
+            if name and name not in columns:
+                columns[name] = index
+        dni_column = columns.pop('identification_id', None)
+        if dni_column is None:
+            raise UserError(_('El archivo no tiene la columna DNI.'))
+        if not columns:
+            raise UserError(_('El archivo no tiene ninguna columna de entradas variables.'))
+        return dni_column, columns
+
+    def _get_line_index(self, fnames):
+        """Índice {DNI: valores actuales de la línea} de la planilla en una sola lectura"""
+        index = {}
+        duplicated = set()
+        for values in self.env['hr.payroll.line'].search_read(
+                [('payroll_id', '=', self.payroll_id.id)], ['identification_id'] + fnames, load=None):
+            dni = (values['identification_id'] or '').strip()
+            if dni in index:
+                duplicated.add(dni)
+            index[dni] = values
+        for dni in duplicated:
+            del index[dni]
+        return index, duplicated
+
+    @staticmethod
+    def _normalize_dni(value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, int):
+            return str(value).zfill(8)
+        value = str(value or '').strip()
+        # Los relojes suelen quitar los ceros a la izquierda del DNI
+        return value.zfill(8) if value.isdigit() else value
+
+    @staticmethod
+    def _parse_number(cell):
+        """Número de una celda; en los CSV se acepta la coma decimal"""
+        if isinstance(cell, str):
+            cell = cell.strip()
+            if ',' in cell and '.' not in cell:
+                cell = cell.replace(',', '.')
+        return float(cell)
+
+    def _import_rows(self, header, rows):
+        """
+        Valida las filas contra el índice por DNI y aplica los cambios en bloque
+
+        Returns:
+            tuple: (líneas actualizadas, [(nro. de fila, motivo, fila), ...])
+        """
+        line_fields = self.env['hr.payroll.line']._fields
+        dni_column, columns = self._get_column_map(header)
+        index, duplicated = self._get_line_index(list(columns))
+
+        changes = {}
+        rejected = []
+        seen = set()
+        for number, row in enumerate(rows, start=2):
+            if not row or all(cell is None or str(cell).strip() == '' for cell in row):
+                continue
+            dni = self._normalize_dni(row[dni_column] if dni_column < len(row) else None)
+            if not dni:
+                # Fila de totales u otra fila sin trabajador
+                continue
+            if dni in duplicated:
+                rejected.append((number, _('el DNI %s está repetido en la planilla', dni), row))
+                continue
+            if dni in seen:
+                rejected.append((number, _('el DNI %s está repetido en el archivo', dni), row))
+                continue
+            current = index.get(dni)
+            if current is None:
+                rejected.append((number, _('el DNI %s no está en la planilla', dni), row))
+                continue
+            seen.add(dni)
+
+            line_changes = {}
+            error = None
+            for name, column in columns.items():
+                cell = row[column] if column < len(row) else None
+                if cell is None or str(cell).strip() == '':
+                    continue
+                try:
+                    number_value = self._parse_number(cell)
+                    value = line_fields[name].convert_to_cache(number_value, self.env['hr.payroll.line'])
+                except (TypeError, ValueError):
+                    error = _('%(field)s no es un número: "%(value)s"', field=line_fields[name].string, value=cell)
+                    break
+                # convert_to_cache trunca los decimales de los campos enteros
+                if line_fields[name].type == 'integer' and value != number_value:
+                    error = _('%(field)s debe ser un número entero: "%(value)s"',
+                              field=line_fields[name].string, value=cell)
+                    break
+                if value < 0:
+                    error = _('%s no puede ser negativo', line_fields[name].string)
+                    break
+                if name == 'worked_days' and value > 30:
+                    error = _('los días trabajados no pueden ser más de 30')
+                    break
+                if value != current[name]:
+                    line_changes[name] = value
+            if error:
+                rejected.append((number, error, row))
+            elif line_changes:
+                changes[current['id']] = line_changes
+
+        lines = self.env['hr.payroll.line'].browse()
+        if changes:
+            lines = lines._bulk_update_inputs(changes)
+            self.payroll_id.message_post(
+                body=f'Entradas variables importadas desde {self.filename or "archivo"}: '
+                     f'{len(lines)} líneas actualizadas, {len(rejected)} filas rechazadas.',
+                message_type='notification'
+            )
+        return lines, rejected
+
+    def _format_result(self, lines, rejected):
+        message = _('%s líneas actualizadas.', len(lines))
+        if rejected:
+            message += '\n' + _('%s filas rechazadas:', len(rejected))
+            message += ''.join('\n' + _('Fila %(number)s: %(reason)s', number=number, reason=reason)
+                               for number, reason, _row in rejected[:IMPORT_MAX_ERRORS])
+            if len(rejected) > IMPORT_MAX_ERRORS:
+                message += '\n' + _('... y %s filas más.', len(rejected) - IMPORT_MAX_ERRORS)
+        return message
+
+    def _write_rejected_file(self, header, rejected):
+        """CSV con las filas rechazadas tal como vinieron y el motivo, para corregirlas y volver a cargarlas"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow([_('Fila'), *header, _('Motivo')])
+        for number, reason, row in rejected:
+            writer.writerow([number, *('' if cell is None else cell for cell in row), reason])
+        return base64.b64encode(output.getvalue().encode('utf-8-sig'))
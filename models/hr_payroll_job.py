@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import traceback
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from .hr_payroll_monthly import ACTIVE_JOB_STATES, _render_payslip_chunk_env, _write_tempfile
+
+
+class HrPayrollJob(models.Model):
+    """
+    Trabajo en segundo plano sobre una planilla (generar, calcular o imprimir)
+
+    Lo procesa el cron por bloques y confirma la transacción después de cada
+    bloque: si el proceso se interrumpe, la siguiente ejecución del cron
+    continúa desde el último bloque confirmado.
+    """
+    _name = 'hr.payroll.job'
+    _description = 'Trabajo de Planilla'
+    _order = 'id desc'
+
+    payroll_id = fields.Many2one('hr.payroll.monthly', string='Planilla', required=True, ondelete='cascade', index=True)
+    company_id = fields.Many2one(related='payroll_id.company_id', store=True)
+    user_id = fields.Many2one('res.users', string='Solicitado por', default=lambda self: self.env.user, readonly=True)
+    job_type = fields.Selection([
+        ('generate', 'Generar Líneas'),
+        ('calculate', 'Calcular'),
+        ('print', 'Imprimir Boletas'),
+    ], string='Tipo', required=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En Proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', required=True, readonly=True, index=True)
+
+    # Avance
+    total_count = fields.Integer(string='Total', readonly=True)
+    done_count = fields.Integer(string='Procesados', readonly=True)
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress', store=True, digits=(5,2))
+    date_start = fields.Datetime(string='Inicio', readonly=True)
+    date_end = fields.Datetime(string='Fin', readonly=True)
+    elapsed_time = fields.Float(string='Tiempo (seg.)', readonly=True, digits=(10,1))
+    error_message = fields.Text(string='Error', readonly=True)
+
+    # Trabajo pendiente por procesar (ids de líneas o plan de generación)
+    payload = fields.Json(string='Datos Pendientes', readonly=True, copy=False)
+
+    def init(self):
+        # Un solo trabajo pendiente o en proceso por planilla
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS hr_payroll_job_active_payroll_uniq
+                ON hr_payroll_job (payroll_id)
+             WHERE state IN ('pending', 'running')
+        """)
+
+    @api.depends('total_count', 'done_count', 'state')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.total_count:
+                job.progress = round(job.done_count * 100.0 / job.total_count, 2)
+            else:
+                job.progress = 0.0
+
+    @api.depends('payroll_id', 'job_type')
+    def _compute_display_name(self):
+        types = dict(self._fields['job_type'].selection)
+        for job in self:
+            job.display_name = f'{types.get(job.job_type, "")} - {job.payroll_id.name or ""}'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        payroll_ids = [vals['payroll_id'] for vals in vals_list if vals.get('payroll_id')]
+        if self.search_count([('payroll_id', 'in', payroll_ids), ('state', 'in', ACTIVE_JOB_STATES)]):
+            raise UserError(_('La planilla ya tiene un trabajo en proceso. Espere a que termine.'))
+        jobs = super().create(vals_list)
+        self.env.ref('peruanita_payroll.ir_cron_hr_payroll_job')._trigger()
+        return jobs
+
+    # PROCESAMIENTO
+
+    @api.model
+    def _get_job_params(self):
+        """Líneas por bloque y segundos máximos por ejecución del cron"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        chunk_size = max(int(ICP.get_param('hr.payroll.job_chunk_size', '500')), 1)
+        time_limit = max(int(ICP.get_param('hr.payroll.job_time_limit', '120')), 1)
+        return chunk_size, time_limit
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Procesa los trabajos pendientes hasta agotar el tiempo de la ejecución"""
+        _chunk_size, time_limit = self._get_job_params()
+        deadline = time.monotonic() + time_limit
+        while time.monotonic() < deadline:
+            job = self._acquire_next_job()
+            if not job:
+                return
+            job._process(deadline)
+        # Quedan trabajos: volver a ejecutar el cron de inmediato
+        if self.search_count([('state', 'in', ACTIVE_JOB_STATES)]):
+            self.env.ref('peruanita_payroll.ir_cron_hr_payroll_job')._trigger()
+
+    @api.model
+    def _acquire_next_job(self):
+        """Bloquea el trabajo más antiguo que no esté tomado por otro proceso"""
+        self.env.cr.execute("""
+            SELECT id FROM hr_payroll_job
+             WHERE state IN ('pending', 'running')
+             ORDER BY id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        return self.browse(row[0]) if row else self.browse()
+
+    def _process(self, deadline):
+        """Ejecuta bloques del trabajo, confirmando cada uno, hasta terminar o agotar el tiempo"""
+        self.ensure_one()
+        job_id = self.id
+        try:
+            if self.state == 'pending':
+                self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+                getattr(self, f'_start_{self.job_type}')()
+                self._commit_progress()
+            while self.state == 'running' and time.monotonic() < deadline:
+                if getattr(self, f'_run_{self.job_type}_chunk')():
+                    getattr(self, f'_finish_{self.job_type}')()
+                    self.write({'state': 'done', 'date_end': fields.Datetime.now(), 'payload': False})
+                self._commit_progress()
+        except Exception as error:
+            self.env.cr.rollback()
+            job = self.browse(job_id)
+            message = error.args[0] if isinstance(error, UserError) else traceback.format_exc()
+            job._cleanup_files()
+            job.write({
+                'state': 'failed',
+                'date_end': fields.Datetime.now(),
+                'error_message': message,
+                'payload': False,
+            })
+            job._commit_progress()
+
+    def _commit_progress(self):
+        """Actualiza el tiempo transcurrido y confirma el bloque procesado"""
+        if self.date_start:
+            self.elapsed_time = (fields.Datetime.now() - self.date_start).total_seconds()
+        self.env.flush_all()
+        # Confirmar por bloque para poder retomar el trabajo si se interrumpe
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+
+    # GENERAR LÍNEAS
+
+    def _start_generate(self):
+        payroll = self.payroll_id
+        if payroll.state != 'draft':
+            raise UserError(_('Solo se pueden generar líneas en planillas en borrador.'))
+        plan = payroll._prepare_line_plan()
+        if not plan['contract_count']:
+            raise UserError(_('No se encontraron contratos activos para el período seleccionado.'))
+        self.write({
+            'payload': {
+                'to_unlink': plan['to_unlink'],
+                'to_create': plan['to_create'],
+                'to_update': list(plan['to_update'].items()),
+                'counts': [len(plan['to_create']), len(plan['to_update']), len(plan['to_unlink'])],
+            },
+            'total_count': len(plan['to_unlink']) + len(plan['to_create']) + len(plan['to_update']),
+        })
+
+    def _run_generate_chunk(self):
+        """Aplica un bloque del plan de generación. Retorna True al terminar"""
+        chunk_size, _time_limit = self._get_job_params()
+        payload = dict(self.payload)
+        chunk = {'to_unlink': [], 'to_create': [], 'to_update': {}}
+        size = chunk_size
+        for key in ('to_unlink', 'to_create', 'to_update'):
+            items, payload[key] = payload[key][:size], payload[key][size:]
+            chunk[key] = dict(items) if key == 'to_update' else items
+            size -= len(items)
+        self.payroll_id._apply_line_plan(chunk)
+        self.write({
+            'payload': payload,
+            'done_count': self.done_count + chunk_size - size,
+        })
+        return not (payload['to_unlink'] or payload['to_create'] or payload['to_update'])
+
+    def _finish_generate(self):
+        created, updated, removed = self.payload['counts']
+        self.payroll_id.message_post(
+            body=f'Líneas de planilla generadas: {created} nuevas, {updated} actualizadas y {removed} eliminadas.',
+            message_type='notification'
+        )
+
+    # CALCULAR
+
+    def _start_calculate(self):
+        payroll = self.payroll_id
+        if payroll.state not in ('draft', 'calculated'):
+            raise UserError(_('Solo se pueden calcular planillas en borrador o calculadas.'))
+        if not payroll.payroll_line_ids:
+            raise UserError(_('No hay líneas de planilla para calcular.'))
+        line_ids = payroll.payroll_line_ids.ids
+        self.write({'payload': {'line_ids': line_ids}, 'total_count': len(line_ids)})
+
+    def _run_calculate_chunk(self):
+        """Calcula un bloque de líneas. Retorna True al terminar"""
+        chunk_size, _time_limit = self._get_job_params()
+        line_ids = self.payload['line_ids']
+        chunk, remaining = line_ids[:chunk_size], line_ids[chunk_size:]
+        self.env['hr.payroll.line'].browse(chunk).exists()._calculate_batch()
+        self.write({'payload': {'line_ids': remaining}, 'done_count': self.done_count + len(chunk)})
+        return not remaining
+
+    def _finish_calculate(self):
+        self.payroll_id.write({'state': 'calculated'})
+        self.payroll_id.message_post(
+            body='Planilla calculada exitosamente. Todos los montos han sido actualizados.',
+            message_type='notification'
+        )
+
+    # IMPRIMIR BOLETAS
+
+    def _start_print(self):
+        payroll = self.payroll_id
+        if not payroll.payroll_line_ids:
+            raise UserError(_('No hay empleados en esta planilla.'))
+        line_ids = payroll.payroll_line_ids.ids
+        self.write({
+            'payload': {'line_ids': line_ids, 'split': payroll.payslip_bundle_mode == 'zip'},
+            'total_count': len(line_ids),
+        })
+
+    def _run_print_chunk(self):
+        """
+        Renderiza un bloque de boletas y lo guarda como adjunto del trabajo.
+        Retorna True al terminar
+        """
+        chunk_size = self.payroll_id._get_payslip_chunk_size()
+        payload = dict(self.payload)
+        chunk, payload['line_ids'] = payload['line_ids'][:chunk_size], payload['line_ids'][chunk_size:]
+        result = _render_payslip_chunk_env(self.env, chunk, payload['split'])
+        files = result if payload['split'] else {'chunk-%06d' % self.done_count: result}
+        try:
+            for key, path in files.items():
+                self.payroll_id._create_attachment_from_file({
+                    'name': f'{key}.pdf',
+                    'mimetype': 'application/pdf',
+                    'res_model': self._name,
+                    'res_id': self.id,
+                }, path)
+        finally:
+            for path in files.values():
+                os.unlink(path)
+        self.write({'payload': payload, 'done_count': self.done_count + len(chunk)})
+        return not payload['line_ids']
+
+    def _finish_print(self):
+        payroll = self.payroll_id
+        attachments = self._get_job_files()
+        paths = {}
+        try:
+            for attachment in attachments:
+                paths[attachment.name[:-len('.pdf')]] = _write_tempfile(attachment.raw)
+            if self.payload['split']:
+                bundle_path = payroll._zip_payslip_files({int(key): path for key, path in paths.items()})
+                name, mimetype = payroll._get_payslip_bundle_name('zip'), 'application/zip'
+            else:
+                bundle_path = payroll._merge_payslip_files(list(paths.values()))
+                name, mimetype = payroll._get_payslip_bundle_name('pdf'), 'application/pdf'
+        finally:
+            for path in paths.values():
+                os.unlink(path)
+        try:
+            payroll._store_payslip_bundle(name, bundle_path, mimetype)
+        finally:
+            os.unlink(bundle_path)
+        attachments.unlink()
+        payroll.message_post(
+            body='Boletas generadas. Descárguelas desde el adjunto de boletas de la planilla.',
+            message_type='notification'
+        )
+
+    def _get_job_files(self):
+        """Adjuntos intermedios del trabajo, en el orden en que se generaron"""
+        return self.env['ir.attachment'].search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+        ], order='id')
+
+    def _cleanup_files(self):
+        self._get_job_files().unlink()
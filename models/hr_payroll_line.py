@@ -1,6 +1,31 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
+import hashlib
+import json
+
+from psycopg2.extras import execute_values
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+from ..tools import payroll_engine
+
+# Subir esta versión cuando cambie el diseño de la boleta para no reutilizar
+# PDFs generados con el diseño anterior
+PAYSLIP_TEMPLATE_VERSION = '1'
+PAYSLIP_ATTACHMENT_PREFIX = 'Boleta-'
+
+# Las líneas de planillas en estos estados quedan congeladas: sus montos ya
+# no se recalculan aunque cambien el contrato, el empleado o los parámetros
+FROZEN_PAYROLL_STATES = ('validated', 'paid')
+
+# Entradas variables del mes que se pueden cargar en bloque (Excel, reloj)
+VARIABLE_INPUTS = (
+    'worked_days', 'tardiness_count', 'medical_rest_days', 'vacation_days',
+    'overtime_amount', 'other_bonus', 'advance_payment', 'advance_gratification',
+    'judicial_retention',
+)
 
 class HrPayrollLine(models.Model):
     _name = 'hr.payroll.line'
@@ -10,20 +35,36 @@ class HrPayrollLine(models.Model):
     
     sequence = fields.Integer(string='Secuencia', default=10)
     payroll_id = fields.Many2one('hr.payroll.monthly', string='Planilla', required=True, ondelete='cascade')
+    date_period = fields.Date(related='payroll_id.date_period', string='Periodo', store=True)
     employee_id = fields.Many2one('hr.employee', string='Empleado', required=True)
     contract_id = fields.Many2one('hr.contract', string='Contrato', required=True)
     
-    # Datos del empleado (readonly, traídos del empleado)
-    identification_id = fields.Char(related='employee_id.identification_id', string='DNI', readonly=True)
-    job_id = fields.Many2one(related='employee_id.job_id', string='Cargo', readonly=True)
-    department_id = fields.Many2one(related='employee_id.department_id', string='Departamento', readonly=True)
+    # Datos del contrato usados en el cálculo (copiados a la línea para que
+    # editar el contrato no recalcule planillas cerradas)
+    contract_wage = fields.Float(string='Sueldo Contrato', digits=(10,2), compute='_compute_contract_data', store=True, readonly=False)
+    contract_night_bonus = fields.Float(string='Bonificación Contrato', digits=(10,2), compute='_compute_contract_data', store=True, readonly=False)
+    contract_essalud_percentage = fields.Float(string='% EsSalud Contrato', digits=(5,2), compute='_compute_contract_data', store=True, readonly=False)
+    contract_sctr_percentage = fields.Float(string='% SCTR Contrato', digits=(5,2), compute='_compute_contract_data', store=True, readonly=False)
+    contract_has_sctr = fields.Boolean(string='Tiene SCTR', compute='_compute_contract_data', store=True, readonly=False)
+    
+    # Datos del empleado (copiados al generar la línea para consultar y
+    # agrupar sin pasar por hr.employee; ver _refresh_employee_data)
+    identification_id = fields.Char(string='DNI', compute='_compute_employee_data', store=True, readonly=False, index=True)
+    job_id = fields.Many2one('hr.job', string='Cargo', compute='_compute_employee_data', store=True, readonly=False, index=True)
+    department_id = fields.Many2one('hr.department', string='Departamento', compute='_compute_employee_data', store=True, readonly=False, index=True)
     
     # Sistema de pensiones
-    pension_system = fields.Selection(related='employee_id.pension_system', string='Sistema Pensión', readonly=True)
-    afp_id = fields.Many2one(related='employee_id.afp_id', string='AFP', readonly=True)
-    cuspp = fields.Char(related='employee_id.cuspp', string='CUSPP', readonly=True)
-    commission_type = fields.Selection(related='employee_id.commission_type', string='Tipo Comisión', readonly=True)
-    exempt_afp_commission = fields.Boolean(related='employee_id.exempt_afp_commission', string='Exento Comisión AFP', readonly=True)
+    pension_system = fields.Selection([
+        ('onp', 'ONP'),
+        ('afp', 'AFP')
+    ], string='Sistema Pensión', compute='_compute_employee_data', store=True, readonly=False, index=True)
+    afp_id = fields.Many2one('hr.afp.pension', string='AFP', compute='_compute_employee_data', store=True, readonly=False, index=True)
+    cuspp = fields.Char(string='CUSPP', compute='_compute_employee_data', store=True, readonly=False)
+    commission_type = fields.Selection([
+        ('flow', 'Flujo'),
+        ('mixed', 'Mixta')
+    ], string='Tipo Comisión', compute='_compute_employee_data', store=True, readonly=False)
+    exempt_afp_commission = fields.Boolean(string='Exento Comisión AFP', compute='_compute_employee_data', store=True, readonly=False)
     
     # Días y asistencia
     worked_days = fields.Integer(string='Días Trabajados', default=30)
@@ -34,46 +75,49 @@ class HrPayrollLine(models.Model):
     # INGRESOS
     salary = fields.Float(string='Sueldo Base', digits=(10,2), required=True)
     family_allowance = fields.Float(string='Asignación Familiar', digits=(10,2), default=0.0)
-    night_bonus = fields.Float(string='Bonificación', compute='_compute_night_bonus', store= True , digits=(10,2))
-    medical_rest_amount = fields.Float(string='Monto Descanso Médico', default=0.0, store=True, compute='_compute_medical_rest_amount', digits=(10,2))
+    night_bonus = fields.Float(string='Bonificación', compute='_compute_amounts', store= True , digits=(10,2))
+    medical_rest_amount = fields.Float(string='Monto Descanso Médico', default=0.0, store=True, compute='_compute_amounts', digits=(10,2))
     other_bonus = fields.Float(string='Otras Bonificaciones', digits=(10,2), default=0.0)
-    vacation_amount = fields.Float(string='Monto Vacaciones', compute='_compute_vacation_amount', store=True, digits=(10,2))
+    vacation_amount = fields.Float(string='Monto Vacaciones', compute='_compute_amounts', store=True, digits=(10,2))
     overtime_amount = fields.Float(string='Horas Extras', digits=(10,2), default=0.0)
     
     # Total Ingresos
-    total_income = fields.Float(string='Total Ingresos', compute='_compute_total_income', store=True, digits=(10,2))
+    total_income = fields.Float(string='Total Ingresos', compute='_compute_amounts', store=True, digits=(10,2))
     
     # Base imponible (ingresos - bonificaciones no imponibles)
-    taxable_base = fields.Float(string='Base Imponible', compute='_compute_taxable_base', store=True, digits=(10,2))
+    taxable_base = fields.Float(string='Base Imponible', compute='_compute_amounts', store=True, digits=(10,2))
     
     # DESCUENTOS - AFP
-    afp_fund = fields.Float(string='AFP Fondo', compute='_compute_pension_discounts', store=True, digits=(10,2))
-    afp_insurance = fields.Float(string='AFP Seguro', compute='_compute_pension_discounts', store=True, digits=(10,2))
-    afp_commission = fields.Float(string='AFP Comisión', compute='_compute_pension_discounts', store=True, digits=(10,2))
-    afp_total = fields.Float(string='Total AFP', compute='_compute_pension_discounts', store=True, digits=(10,2))
-    afp_taxable_base = fields.Float('Base Imponible AFP', compute='_compute_taxable_bases', store=True)
+    afp_fund = fields.Float(string='AFP Fondo', compute='_compute_amounts', store=True, digits=(10,2))
+    afp_insurance = fields.Float(string='AFP Seguro', compute='_compute_amounts', store=True, digits=(10,2))
+    afp_commission = fields.Float(string='AFP Comisión', compute='_compute_amounts', store=True, digits=(10,2))
+    afp_total = fields.Float(string='Total AFP', compute='_compute_amounts', store=True, digits=(10,2))
+    afp_taxable_base = fields.Float('Base Imponible AFP', compute='_compute_amounts', store=True)
 
     # DESCUENTOS - ONP
-    onp_discount = fields.Float(string='ONP', compute='_compute_pension_discounts', store=True, digits=(10,2))
-    onp_taxable_base = fields.Float('Base Imponible ONP', compute='_compute_taxable_bases', store=True)
+    onp_discount = fields.Float(string='ONP', compute='_compute_amounts', store=True, digits=(10,2))
+    onp_taxable_base = fields.Float('Base Imponible ONP', compute='_compute_amounts', store=True)
 
     # OTROS DESCUENTOS
     advance_gratification = fields.Float(string='Adelanto Gratificación', digits=(10,2), default=0.0)
-    fifth_category = fields.Float(string='5ta Categoría', digits=(10,2), default=0.0)
-    tardiness_discount = fields.Float(string='Descuento Tardanzas', compute='_compute_tardiness_discount', store=True, digits=(10,2))
+    fifth_category = fields.Float(string='5ta Categoría Fija', digits=(10,2), default=0.0,
+                                  help="Monto fijo del contrato. Se usa cuando el cálculo automático de renta de "
+                                       "5ta categoría está desactivado en la configuración")
+    fifth_category_tax = fields.Float(string='5ta Categoría', compute='_compute_amounts', store=True, digits=(10,2))
+    tardiness_discount = fields.Float(string='Descuento Tardanzas', compute='_compute_amounts', store=True, digits=(10,2))
     judicial_retention = fields.Float(string='Retención Judicial', digits=(10,2), default=0.0)
     advance_payment = fields.Float(string='Adelanto', digits=(10,2), default=0.0)
     
     # Total Descuentos
-    total_discount = fields.Float(string='Total Descuentos', compute='_compute_total_discount', store=True, digits=(10,2))
+    total_discount = fields.Float(string='Total Descuentos', compute='_compute_amounts', store=True, digits=(10,2))
     
     # NETO A PAGAR
-    net_pay = fields.Float(string='Neto a Pagar', compute='_compute_net_pay', store=True, digits=(10,2))
+    net_pay = fields.Float(string='Neto a Pagar', compute='_compute_amounts', store=True, digits=(10,2))
     
     # APORTES DEL EMPLEADOR
-    essalud = fields.Float(string='EsSalud', compute='_compute_employer_contributions', store=True, digits=(10,2))
-    sctr = fields.Float(string='SCTR', compute='_compute_employer_contributions', store=True, digits=(10,2))
-    total_employer_contribution = fields.Float(string='Total Aportes Empleador', compute='_compute_employer_contributions', store=True, digits=(10,2))
+    essalud = fields.Float(string='EsSalud', compute='_compute_amounts', store=True, digits=(10,2))
+    sctr = fields.Float(string='SCTR', compute='_compute_amounts', store=True, digits=(10,2))
+    total_employer_contribution = fields.Float(string='Total Aportes Empleador', compute='_compute_amounts', store=True, digits=(10,2))
     
     # Datos de vacaciones
     vacation_from = fields.Date(string='Vacaciones Desde')
@@ -83,200 +127,82 @@ class HrPayrollLine(models.Model):
     medical_rest_from = fields.Date(string='Descanso Médico Desde')
     medical_rest_to = fields.Date(string='Descanso Médico Hasta')
     
-    @api.depends('worked_days')
-    def _compute_days_factor(self):
-        """Calcula el factor proporcional de días trabajados"""
-        for line in self:
-            line.days_factor = line.worked_days / 30.0 if line.worked_days > 0 else 0.0
+    # Huella de los datos del contrato en la última generación de líneas
+    generation_key = fields.Char(string='Clave de Generación', readonly=True, copy=False)
     
-    @api.depends('contract_id.night_bonus', 'worked_days')
-    def _compute_night_bonus(self):
-        for line in self:
-            if line.contract_id and line.contract_id.night_bonus > 0 and line.worked_days > 0:
-                daily_night_bonus = line.contract_id.night_bonus / 30
-                line.night_bonus = round(daily_night_bonus * line.worked_days, 2)
-            else:
-                line.night_bonus = 0.0
+    def init(self):
+        # Agregados por empleado y rango de períodos (semestres, años) sin
+        # recorrer todo el historial de líneas
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS hr_payroll_line_employee_period_idx
+                ON hr_payroll_line (employee_id, date_period)
+        """)
 
-    @api.depends('contract_id', 'medical_rest_days')
-    def _compute_medical_rest_amount(self):
-        for line in self:
-            if line.medical_rest_days > 0 and line.contract_id:
-                # Usar solo el sueldo base del contrato (como en Excel)
-                daily_wage = line.contract_id.wage / 30
-                line.medical_rest_amount = round(daily_wage * line.medical_rest_days, 2)
-            else:
-                line.medical_rest_amount = 0.0
-
-    @api.depends('taxable_base', 'vacation_days')
-    def _compute_vacation_amount(self):
+    @api.depends('contract_id')
+    def _compute_contract_data(self):
         """
-        Cálculo automático de monto de vacaciones
-        Fórmula: Sueldo / 30 * Días de Vacaciones
-        
-        Nota: Se calcula sobre sueldo + asignación familiar antes de calcular 
-        la base imponible (que excluye las vacaciones)
+        Copia los datos del contrato al asignarlo. Los cambios posteriores del
+        contrato se propagan solo a las líneas abiertas (ver hr.contract.write)
         """
         for line in self:
-            if line.vacation_days > 0:
-                # Base para vacaciones: sueldo + asignación familiar
-                vacation_base = line.taxable_base
-                daily_amount = vacation_base / 30
-                line.vacation_amount = round(daily_amount * line.vacation_days, 2)
-            else:
-                line.vacation_amount = 0.0
-
-    @api.depends('salary', 'family_allowance', 'night_bonus', 'medical_rest_amount', 
-                 'other_bonus', 'vacation_amount', 'overtime_amount')
-    def _compute_total_income(self):
-        for line in self:
-            line.total_income = (
-                line.salary + 
-                line.family_allowance + 
-                line.night_bonus + 
-                line.medical_rest_amount + 
-                line.other_bonus + 
-                line.vacation_amount + 
-                line.overtime_amount
-            )
-    
-    @api.depends('total_income', 'night_bonus', 'medical_rest_amount')
-    def _compute_taxable_base(self):
-        """
-        Calcula la base imponible según las reglas del Excel:
-        Base imponible = Total ingresos - Bonificaciones no imponibles (otras bonificaciones)
-        Para efectos de AFP/ONP, se excluyen bonificaciones extraordinarias
-        """
-        for line in self:
-            # Base AFP: Total Ingresos - Bonificaciones
-            line.afp_taxable_base = line.total_income - line.night_bonus
-            
-            # Base ONP: Total Ingresos - Bonificaciones - Descanso Médico  
-            line.onp_taxable_base = line.total_income - line.night_bonus - line.medical_rest_amount
-            
-            # Mantener taxable_base para compatibilidad (usar base AFP)
-            line.taxable_base = line.afp_taxable_base
-    
-    @api.depends('taxable_base', 'pension_system', 'afp_id', 'commission_type', 'exempt_afp_commission')
-    def _compute_pension_discounts(self):
-        for line in self:
-            if line.pension_system == 'afp' and line.afp_id:
-                # Calcular fondo y seguro normalmente
-                fund_discount = line.taxable_base * (line.afp_id.fund_percentage / 100)
-                insurance_discount = line.taxable_base * (line.afp_id.insurance_percentage / 100)
-                
-                # Calcular comisión según exención
-                if line.exempt_afp_commission:
-                    # Si está exento, comisión = 0
-                    commission_discount = 0.0
-                else:
-                    # Calcular comisión normal según tipo
-                    commission_type = line.commission_type or line.afp_id.commission_type
-                    
-                    if commission_type == 'mixed' and line.taxable_base > line.afp_id.tope_amount:
-                        # Si es mixta y supera el tope, usar el tope para la comisión
-                        commission_discount = line.afp_id.tope_amount * (line.afp_id.commission_mixed_percentage / 100)
-                    elif commission_type == 'mixed':
-                        commission_discount = line.taxable_base * (line.afp_id.commission_mixed_percentage / 100)
-                    else:
-                        # Flujo
-                        commission_discount = line.taxable_base * (line.afp_id.commission_flow_percentage / 100)
-                
-                line.afp_fund = round(fund_discount, 2)
-                line.afp_insurance = round(insurance_discount, 2)
-                line.afp_commission = round(commission_discount, 2)
-                line.afp_total = round(fund_discount + insurance_discount + commission_discount, 2)
-                line.onp_discount = 0.0
-                
-            elif line.pension_system == 'onp':
-                # Cálculo ONP: 13% sobre base imponible
-                onp_base = line.total_income - line.night_bonus - line.medical_rest_amount
-                onp_percentage = float(line.env['ir.config_parameter'].sudo().get_param('hr.payroll.onp_percentage', '13.0'))
-                line.onp_discount = round(onp_base * (onp_percentage / 100), 2)
-                line.afp_fund = 0.0
-                line.afp_insurance = 0.0
-                line.afp_commission = 0.0
-                line.afp_total = 0.0
-            else:
-                # Sin sistema de pensiones
-                line.afp_fund = 0.0
-                line.afp_insurance = 0.0
-                line.afp_commission = 0.0
-                line.afp_total = 0.0
-                line.onp_discount = 0.0
+            contract = line.contract_id
+            line.contract_wage = contract.wage
+            line.contract_night_bonus = contract.night_bonus
+            line.contract_essalud_percentage = contract.essalud_percentage
+            line.contract_sctr_percentage = contract.sctr_percentage
+            line.contract_has_sctr = contract.has_sctr
     
-    @api.depends('tardiness_count', 'salary', 'family_allowance')
-    def _compute_tardiness_discount(self):
+    @api.depends('employee_id')
+    def _compute_employee_data(self):
         """
-        Calcula el descuento por tardanzas según la fórmula del Excel:
-        Descuento = ((Sueldo + Asig. Familiar) / 240) * Número de tardanzas
+        Copia los datos del empleado al asignarlo. Los cambios posteriores del
+        empleado no alteran las líneas existentes hasta que se refresquen
         """
         for line in self:
-            if line.tardiness_count > 0:
-                # Base para descuento de tardanzas: sueldo + asignación familiar
-                base_tardiness = line.salary + line.family_allowance
-                # Fórmula del Excel: (base / 240) * tardanzas
-                line.tardiness_discount = round((base_tardiness / 240) * line.tardiness_count, 2)
-            else:
-                line.tardiness_discount = 0.0
+            employee = line.employee_id
+            line.identification_id = employee.identification_id
+            line.job_id = employee.job_id
+            line.department_id = employee.department_id
+            line.pension_system = employee.pension_system
+            line.afp_id = employee.afp_id
+            line.cuspp = employee.cuspp
+            line.commission_type = employee.commission_type
+            line.exempt_afp_commission = employee.exempt_afp_commission
     
-    @api.depends('afp_total', 'onp_discount', 'advance_gratification', 'fifth_category',
-                 'tardiness_discount', 'judicial_retention', 'advance_payment')
-    def _compute_total_discount(self):
-        for line in self:
-            line.total_discount = (
-                line.afp_total + 
-                line.onp_discount + 
-                line.advance_gratification + 
-                line.fifth_category + 
-                line.tardiness_discount + 
-                line.judicial_retention + 
-                line.advance_payment
-            )
+    def _refresh_employee_data(self):
+        """Vuelve a copiar los datos actuales del empleado en las líneas"""
+        lines = self._filter_open()
+        lines.employee_id.fetch(['identification_id', 'job_id', 'department_id', 'pension_system',
+                                 'afp_id', 'cuspp', 'commission_type', 'exempt_afp_commission'])
+        lines._compute_employee_data()
+        lines.flush_recordset()
     
-    @api.depends('total_income', 'total_discount')
-    def _compute_net_pay(self):
-        for line in self:
-            line.net_pay = line.total_income - line.total_discount
+    def _filter_open(self):
+        """Líneas que todavía se recalculan (planilla no validada ni pagada)"""
+        return self.filtered(lambda line: line.payroll_id.state not in FROZEN_PAYROLL_STATES)
     
-    @api.depends('salary', 'family_allowance', 'vacation_amount', 'contract_id.essalud_percentage', 'contract_id.sctr_percentage', 'contract_id.has_sctr')
-    def _compute_employer_contributions(self):
+    @api.depends('salary', 'family_allowance', 'other_bonus', 'overtime_amount',
+                 'worked_days', 'medical_rest_days', 'vacation_days', 'tardiness_count',
+                 'advance_gratification', 'fifth_category', 'judicial_retention', 'advance_payment',
+                 'contract_id', 'contract_wage', 'contract_night_bonus', 'contract_essalud_percentage',
+                 'contract_sctr_percentage', 'contract_has_sctr',
+                 'pension_system', 'afp_id', 'commission_type', 'exempt_afp_commission',
+                 'payroll_id.date_period', 'payroll_id.company_id')
+    def _compute_amounts(self):
         """
-        Calcula aportes del empleador:
-        - EsSalud: 9% sobre el salary únicamente
-        - SCTR: 1.23% sobre (Sueldo + Asignación Familiar + Vacaciones) si aplica
+        Calcula todos los montos de la línea con el motor de cálculo
+        
+        Los conceptos (bonificación, vacaciones, ingresos, bases imponibles,
+        AFP/ONP, tardanzas, descuentos, neto y aportes) forman un grafo
+        acíclico y cada uno se evalúa una sola vez por línea.
+        
+        Las líneas de planillas validadas o pagadas conservan sus montos.
         """
-        for line in self:
-            # Obtener configuración actual
-            settings = line.env['hr.payroll.settings'].get_current_settings()
-            
-            # EsSalud: Base = Sueldo + Vacaciones (como en Excel)
-            essalud_base = line.salary + line.vacation_amount + line.family_allowance
-            essalud_percentage = line.contract_id.essalud_percentage if line.contract_id else settings.essalud_percentage
-            if essalud_percentage == 0:
-                essalud_percentage = settings.essalud_percentage
-            
-            line.essalud = round(essalud_base * (essalud_percentage / 100), 2) if essalud_base > 0 else 0.0
-            
-            # SCTR: Base para SCTR (Sueldo + Asignación Familiar + Vacaciones) con mínimo RMV
-            if line.contract_id and line.contract_id.has_sctr:
-                sctr_base = line.salary + line.family_allowance + line.vacation_amount
-                # La base SCTR no puede ser menor al RMV
-                if sctr_base > 0:
-                    sctr_base = max(sctr_base, settings.rmv_amount)
-                
-                sctr_percentage = line.contract_id.sctr_percentage or settings.sctr_percentage
-                line.sctr = round(sctr_base * (sctr_percentage / 100), 2) if sctr_base > 0 else 0.0
-            else:
-                line.sctr = 0.0
-            
-            line.total_employer_contribution = line.essalud + line.sctr
-    
-    @api.depends('net_pay', 'total_employer_contribution')
-    def _compute_total_employer_cost(self):
-        """Calcula el costo total para el empleador (neto + aportes)"""
-        for line in self:
-            line.total_employer_cost = line.net_pay + line.total_employer_contribution
+        for snapshot, lines in self._filter_open()._group_by_snapshot():
+            results = payroll_engine.compute_batch(lines._prepare_batch_columns(), snapshot)
+            for name in payroll_engine.LINE_RESULTS:
+                for line, value in zip(lines, results[name]):
+                    line[name] = value
     
     @api.onchange('worked_days', 'contract_id')
     def _onchange_worked_days(self):
@@ -292,8 +218,8 @@ class HrPayrollLine(models.Model):
         """Cargar datos por defecto del empleado"""
         if self.employee_id:
             # Asignación familiar
-            family_allowance = float(self.env['ir.config_parameter'].sudo().get_param('hr.payroll.family_allowance_2025', '113.0'))
-            self.family_allowance = family_allowance if self.employee_id.has_family_allowance else 0.0
+            snapshot = self.payroll_id._get_payroll_snapshot()
+            self.family_allowance = snapshot.family_allowance_amount if self.employee_id.has_family_allowance else 0.0
             
             # Cargar contrato activo
             contract = self.env['hr.contract'].search([
@@ -310,13 +236,205 @@ class HrPayrollLine(models.Model):
     
     def _compute_all_amounts(self):
         """Método para forzar el recálculo de todos los campos computados"""
-        self._compute_total_income()
-        self._compute_taxable_base()
-        self._compute_pension_discounts()
-        self._compute_tardiness_discount()
-        self._compute_total_discount()
-        self._compute_net_pay()
-        self._compute_employer_contributions()
+        self._calculate_batch()
+
+    def _prepare_batch_columns(self):
+        """
+        Entradas de las líneas como columnas para el motor de cálculo
+        (la lectura se hace en bloque gracias al prefetch)
+        """
+        line_fields = [
+            'salary', 'family_allowance', 'other_bonus', 'overtime_amount',
+            'worked_days', 'medical_rest_days', 'vacation_days', 'tardiness_count',
+            'advance_gratification', 'fifth_category', 'judicial_retention', 'advance_payment',
+            'pension_system', 'commission_type', 'exempt_afp_commission',
+        ]
+        cols = {name: [line[name] for line in self] for name in line_fields}
+        cols['afp_id'] = [line.afp_id.id for line in self]
+        ytd = self._get_fifth_category_ytd()
+        cols['fifth_ytd_income'] = [ytd.get(line.employee_id.id, (0.0, 0.0))[0] for line in self]
+        cols['fifth_ytd_withheld'] = [ytd.get(line.employee_id.id, (0.0, 0.0))[1] for line in self]
+        cols['has_contract'] = [bool(line.contract_id) for line in self]
+        for name in ('contract_wage', 'contract_night_bonus', 'contract_essalud_percentage',
+                     'contract_sctr_percentage', 'contract_has_sctr'):
+            cols[name] = [line[name] for line in self]
+        return cols
+
+    def _get_fifth_category_ytd(self):
+        """
+        Renta de 5ta de los meses anteriores de los empleados de las líneas,
+        en una sola lectura (las líneas son de una misma compañía y período)
+        """
+        payroll = self[:1].payroll_id
+        if not payroll.date_period:
+            return {}
+        return self.env['hr.payroll.fifth.accumulator']._get_ytd(payroll, self.employee_id.ids)
+
+    def _group_by_snapshot(self):
+        """Agrupa las líneas por compañía y período, con sus parámetros vigentes"""
+        groups = {}
+        for payroll, lines in self.grouped('payroll_id').items():
+            snapshot = payroll._get_payroll_snapshot()
+            key = (snapshot.company_id, snapshot.period)
+            if key in groups:
+                groups[key] = (snapshot, groups[key][1] | lines)
+            else:
+                groups[key] = (snapshot, lines)
+        return list(groups.values())
+
+    def _calculate_batch(self):
+        """
+        Recalcula todas las líneas en una sola pasada del motor de cálculo
+        y escribe los resultados con un único UPDATE
+        """
+        lines = self._filter_open()
+        if not lines:
+            return
+        lines.flush_recordset()
+        workers, shard_size, verify = self._get_calculation_params()
+
+        for snapshot, lines in lines._group_by_snapshot():
+            cols = lines._prepare_batch_columns()
+            if workers > 1 and len(lines) > shard_size:
+                try:
+                    results = payroll_engine.compute_parallel(cols, snapshot, workers, shard_size, verify)
+                except payroll_engine.PayrollMismatchError as error:
+                    raise UserError(_('El cálculo paralelo no coincide con el secuencial: %s', error))
+            else:
+                results = payroll_engine.compute_batch(cols, snapshot)
+            lines._write_batch_results(results)
+
+    @api.model
+    def _get_calculation_params(self):
+        """
+        Parámetros del cálculo en paralelo (ir.config_parameter)
+        
+        Returns:
+            tuple: procesos (1 = secuencial), líneas por fragmento y si se
+                   verifica el resultado contra el cálculo secuencial
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        workers = max(int(ICP.get_param('hr.payroll.calc_workers', '1')), 1)
+        shard_size = max(int(ICP.get_param('hr.payroll.calc_shard_size', '5000')), 1)
+        verify = ICP.get_param('hr.payroll.calc_verify', 'False').lower() in ('1', 'true')
+        return workers, shard_size, verify
+
+    @api.model
+    def _recompute_impacted(self, conditions):
+        """
+        Recalcula solo las líneas abiertas afectadas por un cambio de parámetros
+        
+        Args:
+            conditions (list): condiciones SQL sobre las tablas hr_payroll_line
+                               (alias line) y hr_payroll_monthly (alias payroll);
+                               se recalculan las líneas que cumplan alguna
+        
+        Returns:
+            hr.payroll.line: líneas recalculadas
+        """
+        conditions = [condition for condition in conditions if condition]
+        if not conditions or self.env.context.get('skip_payroll_impact'):
+            return self.browse()
+        self.env.flush_all()
+        self.env.cr.execute(SQL(
+            """
+            SELECT line.id
+              FROM hr_payroll_line AS line
+              JOIN hr_payroll_monthly AS payroll ON payroll.id = line.payroll_id
+             WHERE payroll.state NOT IN %s
+               AND (%s)
+            """,
+            FROZEN_PAYROLL_STATES,
+            SQL(' OR ').join(SQL('(%s)', condition) for condition in conditions),
+        ))
+        lines = self.sudo().browse(row[0] for row in self.env.cr.fetchall())
+        lines._calculate_batch()
+        return lines
+
+    def _write_batch_results(self, results):
+        """Escribe las columnas calculadas con un único UPDATE ... FROM (VALUES ...)"""
+        fnames = list(results)
+        rows = list(zip(self.ids, *(results[name] for name in fnames)))
+        query = """
+            UPDATE hr_payroll_line AS line
+               SET %s, write_uid = %d, write_date = (now() at time zone 'UTC')
+              FROM (VALUES %%s) AS val(id, %s)
+             WHERE line.id = val.id
+        """ % (
+            ', '.join(f'"{name}" = val."{name}"' for name in fnames),
+            self.env.uid,
+            ', '.join(f'"{name}"' for name in fnames),
+        )
+        template = '(%s)' % ', '.join(['%s'] * (len(fnames) + 1))
+        execute_values(self.env.cr._obj, query, rows, template=template, page_size=1000)
+
+        # Refrescar caché y propagar a los totales de la planilla sin volver a
+        # disparar los campos computados de las propias líneas
+        self.invalidate_recordset(fnames, flush=False)
+        with self.env.protecting([self._fields[name] for name in fnames], self):
+            self.modified(fnames)
+    
+    def _bulk_update_inputs(self, values):
+        """
+        Actualiza entradas variables de muchas líneas con un único UPDATE y
+        recalcula los montos una sola vez al final
+        
+        Si cambian los días trabajados, el sueldo base se ajusta a los días
+        igual que en la edición manual.
+        
+        Args:
+            values (dict): {id de línea: {campo de VARIABLE_INPUTS: valor}}
+        
+        Returns:
+            hr.payroll.line: líneas actualizadas
+        """
+        lines = self.browse(list(values))
+        if not lines:
+            return lines
+        if len(lines._filter_open()) != len(lines):
+            raise UserError(_('No se pueden modificar líneas de planillas validadas o pagadas.'))
+        fnames = sorted({name for line_values in values.values() for name in line_values})
+        unknown = set(fnames) - set(VARIABLE_INPUTS)
+        if unknown:
+            raise UserError(_('Campos no permitidos en la carga masiva: %s', ', '.join(sorted(unknown))))
+
+        lines.flush_recordset()
+        if 'worked_days' in fnames:
+            fnames.append('salary')
+            for line in lines:
+                days = values[line.id].get('worked_days')
+                if days is not None and line.contract_id:
+                    wage = line.contract_wage
+                    values[line.id]['salary'] = wage if days == 30 else round(wage / 30 * days, 2)
+
+        # Los valores que no vienen quedan en NULL y conservan el valor actual
+        rows = [(line_id, *(line_values.get(name) for name in fnames)) for line_id, line_values in values.items()]
+        query = """
+            UPDATE hr_payroll_line AS line
+               SET %s, write_uid = %d, write_date = (now() at time zone 'UTC')
+              FROM (VALUES %%s) AS val(id, %s)
+             WHERE line.id = val.id
+        """ % (
+            ', '.join(f'"{name}" = COALESCE(val."{name}", line."{name}")' for name in fnames),
+            self.env.uid,
+            ', '.join(f'"{name}"' for name in fnames),
+        )
+        template = '(%%s, %s)' % ', '.join(f'%s::{self._fields[name].column_type[1]}' for name in fnames)
+        execute_values(self.env.cr._obj, query, rows, template=template, page_size=1000)
+
+        # Marcar los cambios sin disparar el cálculo línea por línea: los
+        # montos se recalculan en bloque a continuación
+        lines.invalidate_recordset(fnames, flush=False)
+        results = [self._fields[name] for name in payroll_engine.LINE_RESULTS]
+        with self.env.protecting(results, lines):
+            lines.modified(fnames)
+        lines._calculate_batch()
+        return lines
+
+    def _register_hook(self):
+        """Rechaza la instalación si el grafo de conceptos de planilla tiene ciclos"""
+        payroll_engine.check_graph()
+        return super()._register_hook()
     
     def get_payroll_summary(self):
         """Retorna un resumen de la línea de planilla"""
@@ -337,10 +455,57 @@ class HrPayrollLine(models.Model):
         self.ensure_one()
         return self.env.ref('peruanita_payroll.action_report_payslip').report_action(self)
 
+    def _get_payslip_template_version(self):
+        """Versión del diseño: constante del módulo + última modificación de las vistas QWeb"""
+        views = [
+            self.env.ref('peruanita_payroll.report_payslip', raise_if_not_found=False),
+            self.env.ref('peruanita_payroll.report_payslip_document', raise_if_not_found=False),
+        ]
+        stamps = [str(view.write_date) for view in views if view]
+        return '/'.join([PAYSLIP_TEMPLATE_VERSION] + stamps)
+
+    def get_payslip_attachment_name(self):
+        """
+        Nombre del adjunto en caché de la boleta, usado por el reporte
+        
+        Se arma con un hash de los datos de la boleta y la versión del diseño,
+        así un cambio en cualquiera de ellos genera un PDF nuevo. Solo las
+        planillas validadas o pagadas guardan su boleta.
+        """
+        self.ensure_one()
+        if self.payroll_id.state not in ('validated', 'paid'):
+            return False
+        payload = json.dumps(
+            [self._get_payslip_template_version(), self.get_payslip_data()],
+            sort_keys=True, ensure_ascii=False,
+        )
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+        return f'{PAYSLIP_ATTACHMENT_PREFIX}{self.id}-{digest}.pdf'
+
+    def _unlink_payslip_attachments(self):
+        """Elimina las boletas en caché de estas líneas"""
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+            ('name', '=like', f'{PAYSLIP_ATTACHMENT_PREFIX}%'),
+        ])
+        attachments.unlink()
+
     def get_payslip_data(self):
         """Obtener datos formateados para la boleta con codificación UTF-8 correcta"""
         self.ensure_one()
+        return self.get_payslip_data_multi()[self.id]
+
+    def get_payslip_data_multi(self):
+        """
+        Obtener los datos formateados de las boletas de todas las líneas
+        
+        Precarga en bloque la compañía, contrato, cargo, departamento y AFP
+        de todas las líneas antes de formatearlas.
         
+        Returns:
+            dict: datos de la boleta indexados por id de línea
+        """
         # Función helper para limpiar texto y asegurar UTF-8
         def clean_text(text):
             """Limpiar y asegurar codificación correcta"""
@@ -351,75 +516,88 @@ class HrPayrollLine(models.Model):
                 return text.strip()
             return str(text).strip()
         
-        # Obtener texto del sistema de pensiones
-        pension_text = ''
-        if self.pension_system == 'onp':
-            pension_text = 'ONP'
-        elif self.pension_system == 'afp':
-            pension_text = 'AFP'
+        months_spanish = {
+            1: 'ENERO', 2: 'FEBRERO', 3: 'MARZO', 4: 'ABRIL',
+            5: 'MAYO', 6: 'JUNIO', 7: 'JULIO', 8: 'AGOSTO',
+            9: 'SEPTIEMBRE', 10: 'OCTUBRE', 11: 'NOVIEMBRE', 12: 'DICIEMBRE'
+        }
         
-        # Formatear período en español
-        period_text = ''
-        if self.payroll_id.date_period:
-            months_spanish = {
-                1: 'ENERO', 2: 'FEBRERO', 3: 'MARZO', 4: 'ABRIL',
-                5: 'MAYO', 6: 'JUNIO', 7: 'JULIO', 8: 'AGOSTO',
-                9: 'SEPTIEMBRE', 10: 'OCTUBRE', 11: 'NOVIEMBRE', 12: 'DICIEMBRE'
-            }
-            month_num = self.payroll_id.date_period.month
-            year = self.payroll_id.date_period.year
-            period_text = f"{months_spanish.get(month_num, 'MES')} {year}"
+        # Precarga de relaciones para todo el lote (una consulta por modelo)
+        self.payroll_id.company_id.mapped('name')
+        self.contract_id.mapped('date_start')
+        self.employee_id.mapped('name')
+        self.job_id.mapped('name')
+        self.department_id.mapped('name')
+        self.afp_id.mapped('name')
         
-        return {
-            # Datos de la empresa
-            'company_name': clean_text(self.payroll_id.company_id.name) or 'PERUANITA E.I.R.L.',
-            'company_vat': clean_text(self.payroll_id.company_id.vat) or '20455005869',
-            'company_address': clean_text(f"{self.payroll_id.company_id.street or ''} {self.payroll_id.company_id.street2 or ''}") or 'Calle Francia A 9 - APTASA Cerro Colorado',
+        result = {}
+        for line in self:
+            # Obtener texto del sistema de pensiones
+            pension_text = ''
+            if line.pension_system == 'onp':
+                pension_text = 'ONP'
+            elif line.pension_system == 'afp':
+                pension_text = 'AFP'
+        
+            # Formatear período en español
+            period_text = ''
+            if line.payroll_id.date_period:
+                month_num = line.payroll_id.date_period.month
+                year = line.payroll_id.date_period.year
+                period_text = f"{months_spanish.get(month_num, 'MES')} {year}"
+        
+            result[line.id] = {
+                # Datos de la empresa
+                'company_name': clean_text(line.payroll_id.company_id.name) or 'PERUANITA E.I.R.L.',
+                'company_vat': clean_text(line.payroll_id.company_id.vat) or '20455005869',
+                'company_address': clean_text(f"{line.payroll_id.company_id.street or ''} {line.payroll_id.company_id.street2 or ''}") or 'Calle Francia A 9 - APTASA Cerro Colorado',
             
-            # Datos del empleado
-            'employee_name': clean_text(self.employee_id.name) or '',
-            'employee_identification': clean_text(self.identification_id) or '',
-            'job_title': clean_text(self.job_id.name if self.job_id else '') or '',
-            'date_start': self.contract_id.date_start.strftime('%d/%m/%y') if self.contract_id and self.contract_id.date_start else '',
-            'employee_type': 'EMPLEADO',
-            'department': clean_text(self.department_id.name if self.department_id else '') or 'PRODUCCIÓN',
-            'pension_system': pension_text,
-            'pension_name': clean_text(self.afp_id.name) or '',
-            'cuspp': clean_text(self.cuspp) or '',
+                # Datos del empleado
+                'employee_name': clean_text(line.employee_id.name) or '',
+                'employee_identification': clean_text(line.identification_id) or '',
+                'job_title': clean_text(line.job_id.name if line.job_id else '') or '',
+                'date_start': line.contract_id.date_start.strftime('%d/%m/%y') if line.contract_id and line.contract_id.date_start else '',
+                'employee_type': 'EMPLEADO',
+                'department': clean_text(line.department_id.name if line.department_id else '') or 'PRODUCCIÓN',
+                'pension_system': pension_text,
+                'pension_name': clean_text(line.afp_id.name) or '',
+                'cuspp': clean_text(line.cuspp) or '',
             
-            # Período
-            'period': period_text,
+                # Período
+                'period': period_text,
             
-            # Días trabajados
-            'worked_days': f"{self.worked_days:.2f}",
-            'vacation_days': f"{self.vacation_days:.2f}",
-            'tardiness_count': f"{self.tardiness_count:.2f}",
+                # Días trabajados
+                'worked_days': f"{line.worked_days:.2f}",
+                'vacation_days': f"{line.vacation_days:.2f}",
+                'tardiness_count': f"{line.tardiness_count:.2f}",
             
-            # Ingresos
-            'basic_salary': f"{self.taxable_base:.2f}",
-            'salary': f"{self.salary:.2f}",
-            'family_allowance': f"{self.family_allowance:.2f}",
-            'vacation_pay': f"{self.vacation_amount:.2f}",
-            'productivity_bonus': f"{self.other_bonus:.2f}",
-            'medical_rest': f"{self.medical_rest_amount:.2f}",
-            'overtime': f"{self.overtime_amount:.2f}",
-            'night_bonus': f"{self.night_bonus:.2f}",
-            'total_income': f"{self.total_income:.2f}",
+                # Ingresos
+                'basic_salary': f"{line.taxable_base:.2f}",
+                'salary': f"{line.salary:.2f}",
+                'family_allowance': f"{line.family_allowance:.2f}",
+                'vacation_pay': f"{line.vacation_amount:.2f}",
+                'productivity_bonus': f"{line.other_bonus:.2f}",
+                'medical_rest': f"{line.medical_rest_amount:.2f}",
+                'overtime': f"{line.overtime_amount:.2f}",
+                'night_bonus': f"{line.night_bonus:.2f}",
+                'total_income': f"{line.total_income:.2f}",
             
-            # Descuentos
-            'onp_discount': f"{self.onp_discount:.2f}",
-            'afp_fund': f"{self.afp_fund:.2f}",
-            'afp_insurance': f"{self.afp_insurance:.2f}",
-            'afp_commission': f"{self.afp_commission:.2f}",
-            'fifth_category': f"{self.fifth_category:.2f}",
-            'advance_payment': f"{self.advance_payment:.2f}",
-            'tardiness_discount': f"{self.tardiness_discount:.2f}",
-            'total_discount': f"{self.total_discount:.2f}",
+                # Descuentos
+                'onp_discount': f"{line.onp_discount:.2f}",
+                'afp_fund': f"{line.afp_fund:.2f}",
+                'afp_insurance': f"{line.afp_insurance:.2f}",
+                'afp_commission': f"{line.afp_commission:.2f}",
+                'fifth_category': f"{line.fifth_category_tax:.2f}",
+                'advance_payment': f"{line.advance_payment:.2f}",
+                'tardiness_discount': f"{line.tardiness_discount:.2f}",
+                'total_discount': f"{line.total_discount:.2f}",
             
-            # Aportes del empleador
-            'essalud': f"{self.essalud:.2f}",
-            'total_contributions': f"{self.total_employer_contribution:.2f}",
+                # Aportes del empleador
+                'essalud': f"{line.essalud:.2f}",
+                'total_contributions': f"{line.total_employer_contribution:.2f}",
             
-            # Neto a pagar
-            'net_pay': f"{self.net_pay:.2f}",
-        }
\ No newline at end of file
+                # Neto a pagar
+                'net_pay': f"{line.net_pay:.2f}",
+            }
+        
+        return result
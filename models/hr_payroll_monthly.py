@@ -1,10 +1,70 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from collections import defaultdict
+
+from psycopg2.extras import RealDictCursor
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 
+from .hr_payroll_line import VARIABLE_INPUTS
+
+PAYSLIP_REPORT = 'peruanita_payroll.action_report_payslip'
+
+# Estados en los que un trabajo en segundo plano ocupa la planilla
+ACTIVE_JOB_STATES = ('pending', 'running')
+
+
+def _write_tempfile(content, suffix='.pdf'):
+    """Guarda el contenido en un archivo temporal y retorna su ruta"""
+    handle, path = tempfile.mkstemp(suffix=suffix, prefix='boletas_')
+    with os.fdopen(handle, 'wb') as tmp:
+        tmp.write(content)
+    return path
+
+
+def _render_payslip_chunk_env(env, line_ids, split):
+    """
+    Renderiza un bloque de boletas
+
+    Returns:
+        str | dict: ruta del PDF del bloque, o {id línea: ruta} si split es True
+    """
+    report = env['ir.actions.report']
+    if not split:
+        pdf_content, _content_type = report._render_qweb_pdf(PAYSLIP_REPORT, res_ids=line_ids)
+        return _write_tempfile(pdf_content)
+
+    # Un PDF por línea: Odoo separa el PDF del bloque por registro; si no
+    # puede hacerlo se renderiza la línea sola
+    streams = report._render_qweb_pdf_prepare_streams(PAYSLIP_REPORT, {}, res_ids=line_ids)
+    # Guardar en caché las boletas recién generadas (planillas validadas o pagadas)
+    report_sudo = report._get_report(PAYSLIP_REPORT).sudo()
+    if report_sudo.attachment:
+        attachment_vals_list = report._prepare_pdf_report_attachment_vals_list(report_sudo, streams)
+        if attachment_vals_list:
+            env['ir.attachment'].sudo().create(attachment_vals_list)
+    paths = {}
+    for line_id in line_ids:
+        stream_data = streams.get(line_id)
+        if stream_data and stream_data.get('stream'):
+            content = stream_data['stream'].getvalue()
+        else:
+            content = report._render_qweb_pdf(PAYSLIP_REPORT, res_ids=[line_id])[0]
+        paths[line_id] = _write_tempfile(content)
+    return paths
+
 class HrPayrollMonthly(models.Model):
     _name = 'hr.payroll.monthly'
     _description = 'Planilla Mensual'
@@ -47,15 +107,15 @@ class HrPayrollMonthly(models.Model):
     total_employer_cost = fields.Float(string='Costo Total Empleador', compute='_compute_totals', store=True, digits=(10,2))
     
     # Desglose de descuentos para análisis
-    total_afp_discount = fields.Float(string='Total AFP', compute='_compute_detailed_totals', store=True, digits=(10,2))
-    total_onp_discount = fields.Float(string='Total ONP', compute='_compute_detailed_totals', store=True, digits=(10,2))
-    total_other_discounts = fields.Float(string='Otros Descuentos', compute='_compute_detailed_totals', store=True, digits=(10,2))
+    total_afp_discount = fields.Float(string='Total AFP', compute='_compute_totals', store=True, digits=(10,2))
+    total_onp_discount = fields.Float(string='Total ONP', compute='_compute_totals', store=True, digits=(10,2))
+    total_other_discounts = fields.Float(string='Otros Descuentos', compute='_compute_totals', store=True, digits=(10,2))
     
     # Desglose de aportes empleador
-    total_essalud = fields.Float(string='Total EsSalud', compute='_compute_detailed_totals', store=True, digits=(10,2))
-    total_sctr = fields.Float(string='Total SCTR', compute='_compute_detailed_totals', store=True, digits=(10,2))
+    total_essalud = fields.Float(string='Total EsSalud', compute='_compute_totals', store=True, digits=(10,2))
+    total_sctr = fields.Float(string='Total SCTR', compute='_compute_totals', store=True, digits=(10,2))
     
-    employee_count = fields.Integer(string='Número de Empleados', compute='_compute_employee_count', store=True)
+    employee_count = fields.Integer(string='Número de Empleados', compute='_compute_totals', store=True)
     
     notes = fields.Text(string='Notas')
     
@@ -72,6 +132,26 @@ class HrPayrollMonthly(models.Model):
     ], string='Método de Pago', tracking=True)
     payment_reference = fields.Char(string='Referencia de Pago', tracking=True)
     
+    # Impresión masiva de boletas
+    payslip_bundle_mode = fields.Selection([
+        ('pdf', 'Un solo PDF'),
+        ('zip', 'ZIP con un PDF por empleado')
+    ], string='Formato de Boletas', default='pdf', required=True)
+    payslip_bundle_attachment_id = fields.Many2one('ir.attachment', string='Boletas Generadas', readonly=True, copy=False)
+    
+    # Trabajos en segundo plano (generar, calcular e imprimir)
+    job_ids = fields.One2many('hr.payroll.job', 'payroll_id', string='Trabajos')
+    job_id = fields.Many2one('hr.payroll.job', string='Último Trabajo', compute='_compute_job_status')
+    job_type = fields.Selection(related='job_id.job_type', string='Tipo de Trabajo')
+    job_state = fields.Selection(related='job_id.state', string='Estado del Trabajo')
+    job_progress = fields.Float(related='job_id.progress', string='Avance del Trabajo')
+    job_error_message = fields.Text(related='job_id.error_message', string='Error del Trabajo')
+    
+    @api.depends('job_ids.state')
+    def _compute_job_status(self):
+        for record in self:
+            record.job_id = record.job_ids[:1]
+    
     @api.depends('date_period')
     def _compute_dates(self):
         for record in self:
@@ -82,40 +162,105 @@ class HrPayrollMonthly(models.Model):
                 next_month = record.date_from + relativedelta(months=1)
                 record.date_to = next_month - relativedelta(days=1)
     
-    @api.depends('payroll_line_ids')
-    def _compute_employee_count(self):
-        for record in self:
-            record.employee_count = len(record.payroll_line_ids)
-    
-    @api.depends('payroll_line_ids.total_income', 'payroll_line_ids.total_discount', 
-                 'payroll_line_ids.net_pay', 'payroll_line_ids.total_employer_contribution')
-    def _compute_totals(self):
-        for record in self:
-            record.total_income = sum(line.total_income for line in record.payroll_line_ids)
-            record.total_employee_discount = sum(line.total_discount for line in record.payroll_line_ids)
-            record.total_net_pay = sum(line.net_pay for line in record.payroll_line_ids)
-            record.total_employer_contribution = sum(line.total_employer_contribution for line in record.payroll_line_ids)
-            # Costo total empleador = Neto a pagar + Aportes empleador
-            record.total_employer_cost = record.total_net_pay + record.total_employer_contribution
+    # Columnas de hr.payroll.line que se suman en la cabecera
+    _TOTALS_LINE_FIELDS = [
+        'payroll_id', 'total_income', 'total_discount', 'net_pay', 'total_employer_contribution',
+        'afp_total', 'onp_discount', 'advance_gratification', 'fifth_category_tax',
+        'tardiness_discount', 'judicial_retention', 'advance_payment', 'essalud', 'sctr',
+    ]
+    # Claves de los totales agregados por planilla
+    _TOTALS_KEYS = [
+        'employee_count', 'total_income', 'total_discount', 'net_pay', 'total_employer_contribution',
+        'afp_total', 'onp_discount', 'other_discounts', 'essalud', 'sctr',
+    ]
     
-    @api.depends('payroll_line_ids.afp_total', 'payroll_line_ids.onp_discount', 
-                 'payroll_line_ids.advance_gratification', 'payroll_line_ids.fifth_category',
+    @api.depends('payroll_line_ids', 'payroll_line_ids.total_income', 'payroll_line_ids.total_discount',
+                 'payroll_line_ids.net_pay', 'payroll_line_ids.total_employer_contribution',
+                 'payroll_line_ids.afp_total', 'payroll_line_ids.onp_discount',
+                 'payroll_line_ids.advance_gratification', 'payroll_line_ids.fifth_category_tax',
                  'payroll_line_ids.tardiness_discount', 'payroll_line_ids.judicial_retention',
                  'payroll_line_ids.advance_payment', 'payroll_line_ids.essalud', 'payroll_line_ids.sctr')
-    def _compute_detailed_totals(self):
+    def _compute_totals(self):
+        """
+        Calcula los totales de cabecera, el desglose de descuentos y aportes
+        y el número de empleados con una sola consulta agrupada para todas
+        las planillas a la vez
+        """
+        stored = self.filtered('id')
+        totals = stored._read_line_totals() if stored else {}
         for record in self:
+            if record.id:
+                values = totals.get(record.id) or dict.fromkeys(self._TOTALS_KEYS, 0.0)
+            else:
+                # Registro en edición (onchange): sumar en memoria
+                values = record._sum_line_totals()
+            record.employee_count = int(values['employee_count'])
+            record.total_income = values['total_income']
+            record.total_employee_discount = values['total_discount']
+            record.total_net_pay = values['net_pay']
+            record.total_employer_contribution = values['total_employer_contribution']
+            # Costo total empleador = Neto a pagar + Aportes empleador
+            record.total_employer_cost = values['net_pay'] + values['total_employer_contribution']
             # Descuentos por categoría
-            record.total_afp_discount = sum(line.afp_total for line in record.payroll_line_ids)
-            record.total_onp_discount = sum(line.onp_discount for line in record.payroll_line_ids)
-            record.total_other_discounts = sum(
-                line.advance_gratification + line.fifth_category + line.tardiness_discount + 
-                line.judicial_retention + line.advance_payment 
-                for line in record.payroll_line_ids
-            )
-            
+            record.total_afp_discount = values['afp_total']
+            record.total_onp_discount = values['onp_discount']
+            record.total_other_discounts = values['other_discounts']
             # Aportes empleador por categoría
-            record.total_essalud = sum(line.essalud for line in record.payroll_line_ids)
-            record.total_sctr = sum(line.sctr for line in record.payroll_line_ids)
+            record.total_essalud = values['essalud']
+            record.total_sctr = values['sctr']
+    
+    def _read_line_totals(self):
+        """Totales de las líneas agrupados por planilla, en una sola consulta SQL"""
+        self.env['hr.payroll.line'].flush_model(self._TOTALS_LINE_FIELDS)
+        self.env.cr.execute("""
+            SELECT payroll_id,
+                   COUNT(*),
+                   COALESCE(SUM(total_income), 0),
+                   COALESCE(SUM(total_discount), 0),
+                   COALESCE(SUM(net_pay), 0),
+                   COALESCE(SUM(total_employer_contribution), 0),
+                   COALESCE(SUM(afp_total), 0),
+                   COALESCE(SUM(onp_discount), 0),
+                   COALESCE(SUM(COALESCE(advance_gratification, 0) + COALESCE(fifth_category_tax, 0)
+                                + COALESCE(tardiness_discount, 0) + COALESCE(judicial_retention, 0)
+                                + COALESCE(advance_payment, 0)), 0),
+                   COALESCE(SUM(essalud), 0),
+                   COALESCE(SUM(sctr), 0)
+              FROM hr_payroll_line
+             WHERE payroll_id IN %s
+             GROUP BY payroll_id
+        """, [tuple(self.ids)])
+        return {
+            row[0]: dict(zip(self._TOTALS_KEYS, (float(value) for value in row[1:])))
+            for row in self.env.cr.fetchall()
+        }
+    
+    def _sum_line_totals(self):
+        """Totales calculados en memoria para un registro aún no guardado"""
+        self.ensure_one()
+        lines = self.payroll_line_ids
+        return {
+            'employee_count': len(lines),
+            'total_income': sum(lines.mapped('total_income')),
+            'total_discount': sum(lines.mapped('total_discount')),
+            'net_pay': sum(lines.mapped('net_pay')),
+            'total_employer_contribution': sum(lines.mapped('total_employer_contribution')),
+            'afp_total': sum(lines.mapped('afp_total')),
+            'onp_discount': sum(lines.mapped('onp_discount')),
+            'other_discounts': sum(
+                line.advance_gratification + line.fifth_category_tax + line.tardiness_discount +
+                line.judicial_retention + line.advance_payment
+                for line in lines
+            ),
+            'essalud': sum(lines.mapped('essalud')),
+            'sctr': sum(lines.mapped('sctr')),
+        }
+    
+    def _get_payroll_snapshot(self):
+        """Parámetros de planilla vigentes para la compañía y el período de esta planilla"""
+        payroll = self[:1]
+        period = (payroll.date_period or fields.Date.context_today(self)).strftime('%Y-%m')
+        return self.env['hr.payroll.settings']._get_payroll_snapshot(payroll.company_id.id or self.env.company.id, period)
     
     # RESTRICCIONES DE SEGURIDAD SEGÚN ESTADO
     
@@ -270,103 +415,397 @@ class HrPayrollMonthly(models.Model):
     # ACCIONES DE ESTADO - SIN NOTIFICACIONES
     
     def action_generate_lines(self):
-        """Genera las líneas de planilla basadas en contratos activos"""
-        self.ensure_one()
+        """
+        Genera las líneas de planilla basadas en contratos activos
+        
+        Es incremental: agrega las líneas de contratos nuevos, actualiza las de
+        contratos modificados y elimina las de contratos que ya no están
+        vigentes. Los datos ingresados a mano (tardanzas, horas extras,
+        adelantos, etc.) se conservan.
         
+        Acepta varias planillas: los contratos se leen una sola vez por
+        compañía y período, y las líneas de todas se escriben en un solo lote.
+        """
         # Solo permitir en borrador
-        if self.state != 'draft':
+        if any(payroll.state != 'draft' for payroll in self):
             raise UserError(_('Solo se pueden generar líneas en planillas en borrador.'))
+        self._check_no_active_job()
         
-        # Eliminar líneas existentes
-        self.payroll_line_ids.unlink()
+        self._generate_lines(require_contracts=len(self) == 1)
         
-        # Buscar contratos activos
-        contracts = self.env['hr.contract'].search([
+        # Retornar True para que no haya notificación popup
+        return True
+    
+    def _generate_lines(self, require_contracts=False):
+        """
+        Genera las líneas de planillas en borrador sin trabajos en proceso
+        
+        Args:
+            require_contracts (bool): fallar si alguna planilla no tiene
+                                      contratos vigentes en vez de omitirla
+        """
+        # Las planillas grandes se procesan en segundo plano
+        Contract = self.env['hr.contract']
+        background = self.filtered(lambda payroll: payroll._use_background_job(
+            Contract.search_count(payroll._get_contract_domain())))
+        for payroll in background:
+            payroll._enqueue_job('generate')
+        payrolls = self - background
+        if not payrolls:
+            return
+        
+        plans = payrolls._prepare_line_plans()
+        if require_contracts and not all(plan['contract_count'] for plan in plans.values()):
+            raise UserError(_('No se encontraron contratos activos para el período seleccionado.'))
+        
+        # Las planillas sin contratos vigentes conservan sus líneas
+        self._apply_line_plan(self._merge_line_plans(
+            plan for plan in plans.values() if plan['contract_count']))
+        
+        for payroll in payrolls:
+            plan = plans[payroll.id]
+            if plan['contract_count']:
+                body = (f"Líneas de planilla generadas: {len(plan['to_create'])} nuevas, "
+                        f"{len(plan['to_update'])} actualizadas y {len(plan['to_unlink'])} eliminadas.")
+            else:
+                body = 'No se encontraron contratos activos para el período seleccionado.'
+            payroll.message_post(body=body, message_type='notification')
+    
+    def _get_contract_domain(self):
+        """Contratos vigentes en el período de la planilla"""
+        self.ensure_one()
+        return [
             ('state', '=', 'open'),
+            ('company_id', '=', self.company_id.id),
             ('date_start', '<=', self.date_to),
             '|',
             ('date_end', '=', False),
             ('date_end', '>=', self.date_from)
-        ])
+        ]
+    
+    def _get_contract_read_fields(self):
+        """Campos del contrato que se leen para generar las líneas"""
+        return ['employee_id', 'wage', 'date_start', 'date_end', 'other_bonus', 'fifth_category',
+                'night_bonus', 'essalud_percentage', 'sctr_percentage', 'has_sctr']
+    
+    def _get_employee_read_fields(self):
+        """Campos del empleado que se leen para generar las líneas"""
+        return ['has_family_allowance']
+    
+    def _prepare_line_values(self, contract, employee, snapshot):
+        """
+        Valores de la línea que se derivan del contrato y del empleado
         
-        if not contracts:
-            raise UserError(_('No se encontraron contratos activos para el período seleccionado.'))
+        Args:
+            contract (dict): contrato leído con search_read
+            employee (dict): empleado leído con read
+            snapshot (PayrollSnapshot): parámetros vigentes del período
+        """
+        # Calcular días trabajados (por defecto 30)
+        worked_days = 30
+        
+        # Si el contrato empezó este mes
+        if contract['date_start'] > self.date_from:
+            worked_days = (self.date_to - contract['date_start']).days + 1
         
-        lines_to_create = []
+        # Si el contrato terminó este mes
+        if contract['date_end'] and contract['date_end'] < self.date_to:
+            worked_days = min(worked_days, (contract['date_end'] - self.date_from).days + 1)
+        
+        # Asignación familiar desde configuración
+        family_allowance = snapshot.family_allowance_amount if employee.get('has_family_allowance') else 0.0
+        
+        # Calcular salario proporcional a días trabajados
+        salary = contract['wage']
+        if worked_days != 30:
+            daily_wage = contract['wage'] / 30
+            salary = round(daily_wage * worked_days, 2)
+        
+        return {
+            'employee_id': contract['employee_id'],
+            'contract_id': contract['id'],
+            'worked_days': worked_days,
+            'salary': salary,
+            'family_allowance': family_allowance,
+            'other_bonus': contract['other_bonus'],
+            'fifth_category': contract['fifth_category'],
+            'contract_wage': contract['wage'],
+            'contract_night_bonus': contract['night_bonus'],
+            'contract_essalud_percentage': contract['essalud_percentage'],
+            'contract_sctr_percentage': contract['sctr_percentage'],
+            'contract_has_sctr': contract['has_sctr'],
+        }
+    
+    @api.model
+    def _prepare_line_update(self, values, line, contract):
+        """
+        Valores generados que se escriben en una línea existente
+
+        Las entradas variables (días, bonificaciones, adelantos, etc.) se
+        cargan o editan a mano y se conservan; el sueldo se recalcula con los
+        días trabajados que ya tiene la línea.
+        """
+        update = {name: value for name, value in values.items() if name not in VARIABLE_INPUTS}
+        days = line['worked_days']
+        update['salary'] = contract['wage'] if days == 30 else round(contract['wage'] / 30 * days, 2)
+        return update
+
+    @api.model
+    def _get_generation_key(self, values):
+        """Huella de los valores generados, para detectar contratos modificados"""
+        payload = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    def _prepare_line_plan(self):
+        """Plan de generación de líneas de una sola planilla (ver _prepare_line_plans)"""
+        self.ensure_one()
+        return self._prepare_line_plans()[self.id]
+    
+    def _prepare_line_plans(self):
+        """
+        Compara los contratos vigentes con las líneas existentes de cada planilla
+        
+        Las planillas se agrupan por compañía y período: por grupo se leen
+        contratos y empleados en bloque y se resuelven los parámetros una sola
+        vez. Una línea se actualiza solo si cambiaron los datos de su contrato
+        desde la última generación.
+        
+        Returns:
+            dict: {id planilla: plan}, cada plan con contract_count, to_create
+                  (lista de valores), to_update ({id línea: valores}) y
+                  to_unlink (ids de líneas)
+        """
+        lines_by_payroll = defaultdict(list)
+        for line in self.payroll_line_ids.read(['payroll_id', 'contract_id', 'generation_key', 'worked_days'],
+                                               load=None):
+            lines_by_payroll[line['payroll_id']].append(line)
+        
+        plans = {}
+        groups = self.grouped(lambda payroll: (payroll.company_id, payroll.date_from, payroll.date_to))
+        for payrolls in groups.values():
+            snapshot = payrolls[0]._get_payroll_snapshot()
+            contracts = self.env['hr.contract'].search_read(
+                payrolls[0]._get_contract_domain(), self._get_contract_read_fields(), load=None)
+            employee_ids = list({contract['employee_id'] for contract in contracts if contract['employee_id']})
+            employees = {
+                employee['id']: employee
+                for employee in self.env['hr.employee'].browse(employee_ids).read(
+                    self._get_employee_read_fields(), load=None)
+            }
+            for payroll in payrolls:
+                plans[payroll.id] = payroll._diff_line_plan(
+                    contracts, employees, snapshot, lines_by_payroll[payroll.id])
+        return plans
+    
+    def _diff_line_plan(self, contracts, employees, snapshot, lines):
+        """
+        Plan de una planilla a partir de los contratos y sus líneas actuales
+        
+        Args:
+            contracts (list): contratos vigentes leídos con search_read
+            employees (dict): {id empleado: valores leídos}
+            snapshot (PayrollSnapshot): parámetros vigentes del período
+            lines (list): líneas de la planilla leídas con read
+        """
+        self.ensure_one()
+        existing = {}
+        to_unlink = []
+        for line in lines:
+            if line['contract_id'] in existing:
+                # Línea duplicada para el mismo contrato
+                to_unlink.append(line['id'])
+            else:
+                existing[line['contract_id']] = line
+        
+        to_create = []
+        to_update = {}
         for contract in contracts:
-            employee = contract.employee_id
-            
-            # Calcular días trabajados (por defecto 30)
-            worked_days = 30
-            
-            # Si el contrato empezó este mes
-            if contract.date_start > self.date_from:
-                worked_days = (self.date_to - contract.date_start).days + 1
-            
-            # Si el contrato terminó este mes
-            if contract.date_end and contract.date_end < self.date_to:
-                worked_days = min(worked_days, (contract.date_end - self.date_from).days + 1)
-            
-            # Asignación familiar desde configuración
-            settings = self.env['hr.payroll.settings'].get_current_settings()
-            family_allowance = settings.family_allowance_amount if employee.has_family_allowance else 0.0
-            
-            # Calcular salario proporcional a días trabajados
-            salary = contract.wage
-            if worked_days != 30:
-                daily_wage = contract.wage / 30
-                salary = round(daily_wage * worked_days, 2)
-            
-            lines_to_create.append({
-                'payroll_id': self.id,
-                'employee_id': employee.id,
-                'contract_id': contract.id,
-                'worked_days': worked_days,
-                'salary': salary,
-                'family_allowance': family_allowance,
-                'other_bonus': contract.other_bonus,
-                'fifth_category': contract.fifth_category,
-            })
-        
-        self.env['hr.payroll.line'].create(lines_to_create)
+            if not contract['employee_id']:
+                continue
+            values = self._prepare_line_values(contract, employees.get(contract['employee_id'], {}), snapshot)
+            values['generation_key'] = self._get_generation_key(values)
+            line = existing.pop(contract['id'], None)
+            if line is None:
+                to_create.append(dict(values, payroll_id=self.id))
+            elif line['generation_key'] != values['generation_key']:
+                to_update[line['id']] = self._prepare_line_update(values, line, contract)
+        
+        # Contratos que ya no están vigentes en el período
+        to_unlink.extend(line['id'] for line in existing.values())
+        
+        return {
+            'contract_count': len(contracts),
+            'to_create': to_create,
+            'to_update': to_update,
+            'to_unlink': to_unlink,
+        }
+    
+    @api.model
+    def _merge_line_plans(self, plans):
+        """Une los planes de varias planillas para aplicarlos en un solo lote"""
+        merged = {'contract_count': 0, 'to_create': [], 'to_update': {}, 'to_unlink': []}
+        for plan in plans:
+            merged['contract_count'] += plan['contract_count']
+            merged['to_create'].extend(plan['to_create'])
+            merged['to_update'].update(plan['to_update'])
+            merged['to_unlink'].extend(plan['to_unlink'])
+        return merged
+    
+    def _apply_line_plan(self, plan):
+        """
+        Aplica el plan de generación de líneas
+        
+        Returns:
+            tuple: cantidad de líneas creadas, actualizadas y eliminadas
+        """
+        Line = self.env['hr.payroll.line']
+        if plan['to_unlink']:
+            Line.browse(plan['to_unlink']).unlink()
+        if plan['to_create']:
+            Line.create(plan['to_create'])
+        
+        # Agrupar las actualizaciones con los mismos valores en un solo write
+        updates = defaultdict(list)
+        for line_id, values in plan['to_update'].items():
+            updates[tuple(sorted(values.items()))].append(line_id)
+        for values, line_ids in updates.items():
+            Line.browse(line_ids).write(dict(values))
         
+        return len(plan['to_create']), len(plan['to_update']), len(plan['to_unlink'])
+    
+    # TRABAJOS EN SEGUNDO PLANO
+    
+    def _use_background_job(self, count):
+        """Las planillas con al menos hr.payroll.job_min_lines registros se procesan en segundo plano"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        min_lines = int(ICP.get_param('hr.payroll.job_min_lines', '1000'))
+        return min_lines > 0 and count >= min_lines
+    
+    def _check_no_active_job(self):
+        """Impide operar la planilla mientras tenga un trabajo pendiente o en proceso"""
+        if self.env['hr.payroll.job'].search_count([
+            ('payroll_id', 'in', self.ids),
+            ('state', 'in', ACTIVE_JOB_STATES),
+        ]):
+            raise UserError(_('La planilla tiene un trabajo en segundo plano en proceso. Espere a que termine.'))
+    
+    def _enqueue_job(self, job_type):
+        """Programa la acción como trabajo en segundo plano"""
+        self.ensure_one()
+        job = self.env['hr.payroll.job'].create({'payroll_id': self.id, 'job_type': job_type})
         self.message_post(
-            body=f'Se generaron {len(lines_to_create)} líneas de planilla automáticamente.',
+            body=f'{dict(job._fields["job_type"].selection)[job_type]}: se procesará en segundo plano.',
             message_type='notification'
         )
+        return True
+    
+    def action_refresh_employee_data(self):
+        """
+        Actualiza en las líneas los datos del empleado (DNI, cargo,
+        departamento y sistema de pensiones) de planillas en borrador
+        """
+        if any(payroll.state != 'draft' for payroll in self):
+            raise UserError(_('Solo se pueden actualizar los datos de empleados en planillas en borrador.'))
         
-        # Retornar True para que no haya notificación popup
+        self.payroll_line_ids._refresh_employee_data()
+        
+        for payroll in self:
+            payroll.message_post(
+                body='Datos de empleados actualizados en las líneas de planilla.',
+                message_type='notification'
+            )
         return True
     
     def action_calculate(self):
-        """Calcula todos los montos de la planilla - SIN NOTIFICACIÓN"""
-        self.ensure_one()
+        """
+        Calcula todos los montos de la planilla - SIN NOTIFICACIÓN
         
-        if not self.payroll_line_ids:
+        Acepta varias planillas: las líneas de todas se calculan en un solo
+        lote, con un snapshot de parámetros por compañía y período.
+        """
+        if any(payroll.state not in ('draft', 'calculated') for payroll in self):
+            raise UserError(_('Solo se pueden calcular planillas en borrador o calculadas.'))
+        if len(self) == 1 and not self.payroll_line_ids:
             raise UserError(_('No hay líneas de planilla para calcular.'))
+        self._check_no_active_job()
         
-        # Forzar recálculo de todas las líneas
-        for line in self.payroll_line_ids:
-            line._compute_all_amounts()
+        # Las planillas grandes se procesan en segundo plano
+        background = self.filtered(lambda payroll: payroll._use_background_job(len(payroll.payroll_line_ids)))
+        for payroll in background:
+            payroll._enqueue_job('calculate')
+        payrolls = (self - background).filtered('payroll_line_ids')
+        if not payrolls:
+            return True
+        
+        # Recalcular todas las líneas en un solo lote
+        payrolls.payroll_line_ids._calculate_batch()
         
         # Usar write() para actualizar la vista inmediatamente
-        self.write({'state': 'calculated'})
+        payrolls.write({'state': 'calculated'})
         
         # Registro en chatter solamente
-        self.message_post(
-            body='Planilla calculada exitosamente. Todos los montos han sido actualizados.',
-            message_type='notification'
-        )
+        for payroll in payrolls:
+            payroll.message_post(
+                body='Planilla calculada exitosamente. Todos los montos han sido actualizados.',
+                message_type='notification'
+            )
         
         # Retornar True - NO display_notification
         return True
+    
+    @api.model
+    def recalculate_payrolls(self, company_ids=None, date_from=None, date_to=None, regenerate=False):
+        """
+        Recalcula en un solo lote las planillas abiertas (borrador o
+        calculadas), por ejemplo después de cambiar tasas AFP o la RMV
+        
+        Args:
+            company_ids (list): compañías a incluir (por defecto las permitidas)
+            date_from (date|str): primer período a incluir
+            date_to (date|str): último período a incluir
+            regenerate (bool): regenerar antes las líneas de planillas en borrador
+        
+        Returns:
+            list: ids de las planillas recalculadas (o enviadas a segundo plano)
+        """
+        domain = [
+            ('state', 'in', ('draft', 'calculated')),
+            ('company_id', 'in', company_ids or self.env.companies.ids),
+        ]
+        if date_from:
+            domain.append(('date_period', '>=', date_from))
+        if date_to:
+            domain.append(('date_period', '<=', date_to))
+        payrolls = self.search(domain)
+        
+        # Omitir las planillas con un trabajo en segundo plano en proceso
+        busy = self.env['hr.payroll.job'].search([
+            ('payroll_id', 'in', payrolls.ids),
+            ('state', 'in', ACTIVE_JOB_STATES),
+        ]).payroll_id
+        payrolls -= busy
+        
+        if regenerate:
+            drafts = payrolls.filtered(lambda payroll: payroll.state == 'draft')
+            drafts._generate_lines()
+            # Las planillas enviadas a segundo plano se calculan después
+            payrolls -= self.env['hr.payroll.job'].search([
+                ('payroll_id', 'in', drafts.ids),
+                ('state', 'in', ACTIVE_JOB_STATES),
+            ]).payroll_id
         
+        payrolls = payrolls.filtered('payroll_line_ids')
+        if payrolls:
+            payrolls.action_calculate()
+        return payrolls.ids
+    
     def action_validate(self):
         """Valida la planilla - SIN NOTIFICACIÓN"""
         self.ensure_one()
         
         if not self.payroll_line_ids:
             raise UserError(_('No se puede validar una planilla sin empleados.'))
+        self._check_no_active_job()
         
         # Validar que no haya errores en los cálculos
         error_lines = []
@@ -445,6 +884,9 @@ class HrPayrollMonthly(models.Model):
             'validated_date': False
         })
         
+        # Las boletas en caché dejan de ser válidas
+        self.payroll_line_ids._unlink_payslip_attachments()
+        
         # Registro en chatter solamente
         self.message_post(
             body='Planilla regresada a borrador. Ahora se pueden realizar modificaciones.',
@@ -494,12 +936,242 @@ class HrPayrollMonthly(models.Model):
         }
 
     def action_print_all_payslips(self):
-        """Generar todas las boletas de la planilla en un solo PDF"""
+        """
+        Generar todas las boletas de la planilla por bloques
+        
+        Las líneas se renderizan en bloques de tamaño configurable, uno tras
+        otro en la misma transacción (las planillas grandes, por bloques en el
+        trabajo en segundo plano), y el resultado (un solo PDF o un ZIP con un
+        PDF por empleado) se guarda como adjunto de la planilla.
+        """
         self.ensure_one()
         if not self.payroll_line_ids:
             raise UserError(_('No hay empleados en esta planilla.'))
+        self._check_no_active_job()
+        
+        if self._use_background_job(len(self.payroll_line_ids)):
+            return self._enqueue_job('print')
+        
+        attachment = self._generate_payslip_bundle()
+        return self._download_attachment_action(attachment)
+    
+    def _get_payslip_chunk_size(self):
+        """Tamaño de bloque para la impresión masiva de boletas"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        return max(int(ICP.get_param('hr.payroll.payslip_chunk_size', '50')), 1)
+    
+    def _split_payslip_chunks(self, chunk_size):
+        """Ids de las líneas en bloques de chunk_size"""
+        line_ids = self.payroll_line_ids.ids
+        return [line_ids[i:i + chunk_size] for i in range(0, len(line_ids), chunk_size)]
+    
+    def _render_payslip_chunks(self, chunks, split=False):
+        """
+        Renderiza los bloques de boletas uno tras otro con el entorno actual,
+        de modo que se imprimen también las líneas aún no confirmadas y la
+        caché de boletas queda en la misma transacción. Las planillas grandes
+        se imprimen por bloques en el trabajo en segundo plano.
+        """
+        self.env.flush_all()
+        return [_render_payslip_chunk_env(self.env, chunk, split) for chunk in chunks]
+    
+    def _get_payslip_bundle_name(self, extension):
+        return f"Boletas - {self.name.replace('/', '-')}.{extension}"
+    
+    def _generate_payslip_bundle(self):
+        """Genera el PDF único o el ZIP de boletas y lo guarda como adjunto"""
+        self.ensure_one()
+        chunks = self._split_payslip_chunks(self._get_payslip_chunk_size())
+        split = self.payslip_bundle_mode == 'zip'
+        
+        rendered = self._render_payslip_chunks(chunks, split=split)
+        paths = []
+        for result in rendered:
+            paths.extend(result.values() if split else [result])
+        try:
+            if split:
+                line_paths = {}
+                for result in rendered:
+                    line_paths.update(result)
+                bundle_path = self._zip_payslip_files(line_paths)
+                name, mimetype = self._get_payslip_bundle_name('zip'), 'application/zip'
+            else:
+                bundle_path = self._merge_payslip_files(paths)
+                name, mimetype = self._get_payslip_bundle_name('pdf'), 'application/pdf'
+        finally:
+            for path in paths:
+                os.unlink(path)
+        
+        try:
+            return self._store_payslip_bundle(name, bundle_path, mimetype)
+        finally:
+            os.unlink(bundle_path)
+    
+    def _store_payslip_bundle(self, name, path, mimetype):
+        """Reemplaza el adjunto de boletas de la planilla con el archivo en disco"""
+        return self._store_export_file('payslip_bundle_attachment_id', name, path, mimetype)
+    
+    def _store_export_file(self, field_name, name, path, mimetype):
+        """Reemplaza el adjunto guardado en el campo field_name con el archivo en disco"""
+        self.ensure_one()
+        self[field_name].unlink()
+        attachment = self._create_attachment_from_file(self._prepare_export_attachment_vals(name, mimetype), path)
+        self[field_name] = attachment
+        return attachment
+    
+    def _prepare_export_attachment_vals(self, name, mimetype):
+        return {
+            'name': name,
+            'mimetype': mimetype,
+            'res_model': self._name,
+            'res_id': self.id,
+        }
+    
+    @api.model
+    def _create_attachment_from_file(self, vals, path):
+        """
+        Crea un adjunto copiando el archivo al filestore por bloques, sin
+        cargarlo en memoria. Si los adjuntos se guardan en la base de datos
+        no queda otra que leerlo completo.
+        """
+        Attachment = self.env['ir.attachment']
+        if Attachment._storage() != 'file':
+            with open(path, 'rb') as handle:
+                return Attachment.create(dict(vals, raw=handle.read()))
+        
+        sha = hashlib.sha1()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                sha.update(block)
+        checksum = sha.hexdigest()
+        fname, full_path = Attachment._get_path(b'', checksum)
+        if not os.path.exists(full_path):
+            shutil.copyfile(path, full_path)
+        # Si la transacción se revierte, el recolector elimina el archivo
+        Attachment._mark_for_gc(fname)
+        return Attachment.create(dict(
+            vals, store_fname=fname, checksum=checksum, file_size=os.path.getsize(path)))
+    
+    def _download_attachment_action(self, attachment):
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/web/content/{attachment.id}?download=true',
+            'target': 'self',
+        }
+    
+    @api.model
+    def _stream_query(self, query, chunk_size=2000):
+        """
+        Ejecuta la consulta con un cursor del lado del servidor y entrega las
+        filas (diccionarios) de a chunk_size, sin cargar todo el resultado
+        
+        Args:
+            query (SQL): consulta a ejecutar
+        """
+        self.env.flush_all()
+        connection = self.env.cr._obj.connection
+        with connection.cursor(name=f'hr_payroll_stream_{id(query)}', cursor_factory=RealDictCursor) as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query.code, query.params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield from rows
+    
+    @api.model
+    def _zip_files(self, files):
+        """
+        Empaqueta archivos en un ZIP escrito en disco
+        
+        Args:
+            files (dict): {nombre dentro del ZIP: ruta del archivo}
+        
+        Returns:
+            str: ruta del ZIP (el llamador lo elimina)
+        """
+        handle, output = tempfile.mkstemp(suffix='.zip', prefix='export_')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    for name, path in files.items():
+                        archive.write(path, name)
+        except Exception:
+            os.unlink(output)
+            raise
+        return output
+    
+    @api.model
+    def _merge_payslip_files(self, paths):
+        """
+        Une los PDF de los bloques en un archivo en disco, en una sola pasada
+        
+        Con qpdf instalado las páginas se copian fuera de Python, sin cargar
+        los bloques en memoria; si no, se arma un único PdfFileWriter con las
+        páginas de todos los bloques y se escribe una vez.
+        
+        Returns:
+            str: ruta del PDF unido (el llamador lo elimina)
+        """
+        output = _write_tempfile(b'')
+        try:
+            qpdf = shutil.which('qpdf')
+            if qpdf:
+                self._merge_pdf_qpdf(qpdf, paths, output)
+            else:
+                self._merge_pdf_writer(paths, output)
+        except Exception:
+            os.unlink(output)
+            raise
+        return output
+    
+    @api.model
+    def _merge_pdf_qpdf(self, qpdf, paths, output):
+        """Concatena los PDF con qpdf; las rutas van en un archivo de argumentos"""
+        handle, args_path = tempfile.mkstemp(suffix='.txt', prefix='qpdf_')
+        try:
+            with os.fdopen(handle, 'w') as args:
+                args.write('\n'.join(['--empty', '--pages', *paths, '--', output]) + '\n')
+            result = subprocess.run([qpdf, f'@{args_path}'], capture_output=True, text=True)
+        finally:
+            os.unlink(args_path)
+        # 3: terminó con advertencias (PDF reparados al leerlos)
+        if result.returncode not in (0, 3):
+            raise UserError(_('No se pudieron unir las boletas: %s', result.stderr.strip()))
+    
+    @api.model
+    def _merge_pdf_writer(self, paths, output):
+        """Concatena los PDF con un único PdfFileWriter"""
+        writer = PdfFileWriter()
+        handles = []
+        try:
+            for path in paths:
+                handle = open(path, 'rb')
+                handles.append(handle)
+                reader = PdfFileReader(handle, strict=False)
+                for page in range(reader.getNumPages()):
+                    writer.addPage(reader.getPage(page))
+            with open(output, 'wb') as stream:
+                writer.write(stream)
+        finally:
+            for handle in handles:
+                handle.close()
+    
+    def _zip_payslip_files(self, line_paths):
+        """
+        Empaqueta un PDF por empleado en un ZIP escrito en disco
         
-        return self.env.ref('peruanita_payroll.action_print_multiple_payslips').report_action(self)
+        Returns:
+            str: ruta del ZIP (el llamador lo elimina)
+        """
+        period = self.date_period.strftime('%Y-%m')
+        lines = self.env['hr.payroll.line'].browse(list(line_paths))
+        names = {line.id: line.employee_id.name or str(line.id) for line in lines}
+        files = {}
+        for line_id, path in line_paths.items():
+            employee = re.sub(r'[\\/:*?"<>|]', '_', names[line_id])
+            files[f'Boleta - {employee} - {period} ({line_id}).pdf'] = path
+        return self._zip_files(files)
 
     def action_print_payroll_summary(self):
         """Generar resumen de planilla en PDF"""
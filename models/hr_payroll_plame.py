@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import tempfile
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+# Tipo de documento de identidad (Tabla 3 SUNAT): DNI
+PLAME_DOC_TYPE_DNI = '01'
+
+# Horas de la jornada ordinaria diaria (archivo .jor)
+PLAME_DAILY_HOURS = 8
+
+# Conceptos del archivo .rem (Tabla 22 PLAME) y columnas de hr.payroll.line
+# que suma cada uno
+PLAME_CONCEPTS = (
+    ('0121', ('salary',)),                                   # Remuneración o jornal básico
+    ('0201', ('family_allowance',)),                         # Asignación familiar
+    ('0105', ('overtime_amount',)),                          # Trabajo en sobretiempo (25%)
+    ('0118', ('vacation_amount',)),                          # Remuneración vacacional
+    ('0304', ('night_bonus',)),                              # Bonificación por turno nocturno
+    ('0307', ('other_bonus',)),                              # Otras bonificaciones regulares
+    ('0916', ('medical_rest_amount',)),                      # Descanso médico
+    ('0601', ('afp_commission',)),                           # Comisión AFP porcentual
+    ('0606', ('afp_insurance',)),                            # Prima de seguro AFP
+    ('0608', ('afp_fund',)),                                 # SPP - Aportación obligatoria
+    ('0607', ('onp_discount',)),                             # Sistema Nacional de Pensiones
+    ('0605', ('fifth_category_tax',)),                       # Renta de quinta categoría
+    ('0703', ('judicial_retention',)),                       # Descuento por mandato judicial
+    ('0701', ('advance_payment', 'advance_gratification')),  # Adelanto
+    ('0704', ('tardiness_discount',)),                       # Tardanzas
+)
+
+# Tipos de suspensión de la relación laboral (Tabla 21) del archivo .snl
+PLAME_SUSPENSIONS = (
+    ('23', 'vacation_days'),       # Vacaciones
+    ('20', 'medical_rest_days'),   # Enfermedad o accidente (primeros 20 días)
+)
+
+# Máximo de errores que se muestran al validar
+PLAME_MAX_ERRORS = 50
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    plame_attachment_id = fields.Many2one('ir.attachment', string='Archivos PLAME', readonly=True, copy=False)
+
+    def action_export_plame(self):
+        """
+        Genera los archivos .rem, .jor y .snl de la PLAME en un ZIP
+
+        Las líneas se leen por bloques desde un cursor del servidor y se
+        validan y escriben en una sola pasada, sin cargar toda la planilla
+        en memoria.
+        """
+        self.ensure_one()
+        if self.state not in ('calculated', 'validated', 'paid'):
+            raise UserError(_('Solo se puede exportar la PLAME de planillas calculadas, validadas o pagadas.'))
+        if self.payroll_type != 'monthly':
+            # Las líneas de beneficios conservan el sueldo copiado del mes
+            raise UserError(_('Solo se puede exportar la PLAME de planillas mensuales.'))
+
+        attachment = self._generate_plame_files()
+        return self._download_attachment_action(attachment)
+
+    def _get_plame_concepts(self):
+        """Conceptos del archivo .rem: ((código, (columnas,)), ...)"""
+        return PLAME_CONCEPTS
+
+    def _get_plame_prefix(self):
+        """Prefijo de los archivos: 0601 + período (AAAAMM) + RUC"""
+        ruc = re.sub(r'\D', '', self.company_id.vat or '')
+        if len(ruc) != 11:
+            raise UserError(_('La compañía %s debe tener un RUC de 11 dígitos para exportar la PLAME.',
+                              self.company_id.name))
+        return f"0601{self.date_period.strftime('%Y%m')}{ruc}"
+
+    def _check_plame_concepts(self, concepts):
+        """Los códigos de concepto deben tener 4 dígitos y no repetirse"""
+        codes = [code for code, _columns in concepts]
+        invalid = [code for code in codes if not re.fullmatch(r'\d{4}', code)]
+        if invalid:
+            raise UserError(_('Códigos de concepto PLAME inválidos: %s', ', '.join(invalid)))
+        if len(set(codes)) != len(codes):
+            raise UserError(_('Hay códigos de concepto PLAME repetidos.'))
+
+    def _get_plame_query(self, concepts):
+        columns = sorted({column for _code, names in concepts for column in names}
+                         | {name for _code, name in PLAME_SUSPENSIONS})
+        return SQL(
+            """
+            SELECT line.id, line.identification_id, line.pension_system, line.cuspp,
+                   line.worked_days, employee.name AS employee_name, %s
+              FROM hr_payroll_line AS line
+              JOIN hr_employee AS employee ON employee.id = line.employee_id
+             WHERE line.payroll_id = %s
+             ORDER BY line.identification_id, line.id
+            """,
+            SQL(', ').join(SQL('COALESCE(line.%s, 0) AS %s', SQL.identifier(name), SQL.identifier(name))
+                           for name in columns),
+            self.id,
+        )
+
+    def _validate_plame_row(self, row, previous_dni):
+        """Errores de una fila: DNI de 8 dígitos, DNI no repetido y CUSPP de los afiliados a AFP"""
+        errors = []
+        dni = (row['identification_id'] or '').strip()
+        name = row['employee_name']
+        if not re.fullmatch(r'\d{8}', dni):
+            errors.append(_('%(name)s: DNI inválido "%(dni)s".', name=name, dni=dni))
+        elif dni == previous_dni:
+            errors.append(_('%(name)s: el DNI %(dni)s está repetido en la planilla.', name=name, dni=dni))
+        if not row['pension_system']:
+            errors.append(_('%s: no tiene sistema de pensiones.', name))
+        elif row['pension_system'] == 'afp' and not re.fullmatch(r'[A-Z0-9]{12}', (row['cuspp'] or '').strip()):
+            errors.append(_('%(name)s: CUSPP inválido "%(cuspp)s".', name=name, cuspp=row['cuspp'] or ''))
+        return errors
+
+    def _format_plame_rows(self, row, concepts):
+        """Registros de una línea para los archivos .rem, .jor y .snl"""
+        document = f"{PLAME_DOC_TYPE_DNI}|{row['identification_id'].strip()}"
+        rem = []
+        for code, columns in concepts:
+            amount = round(sum(row[column] for column in columns), 2)
+            if amount:
+                rem.append(f'{document}|{code}|{amount:.2f}|{amount:.2f}|')
+        suspended = sum(row[name] for _code, name in PLAME_SUSPENSIONS)
+        hours = max((row['worked_days'] or 0) - suspended, 0) * PLAME_DAILY_HOURS
+        jor = [f'{document}|{hours}|0|0|0|']
+        snl = [f'{document}|{code}|{row[name]}|' for code, name in PLAME_SUSPENSIONS if row[name] > 0]
+        return rem, jor, snl
+
+    def _generate_plame_files(self):
+        """Valida y escribe los archivos en disco en una sola pasada y guarda el ZIP"""
+        prefix = self._get_plame_prefix()
+        concepts = self._get_plame_concepts()
+        self._check_plame_concepts(concepts)
+
+        extensions = ('rem', 'jor', 'snl')
+        paths = {}
+        handles = {}
+        errors = []
+        error_count = 0
+        previous_dni = None
+        try:
+            for extension in extensions:
+                handle, paths[extension] = tempfile.mkstemp(suffix=f'.{extension}', prefix='plame_')
+                handles[extension] = os.fdopen(handle, 'w', encoding='ascii', errors='replace', newline='\r\n')
+
+            for row in self._stream_query(self._get_plame_query(concepts)):
+                row_errors = self._validate_plame_row(row, previous_dni)
+                previous_dni = (row['identification_id'] or '').strip()
+                if row_errors:
+                    error_count += len(row_errors)
+                    errors.extend(row_errors[:PLAME_MAX_ERRORS - len(errors)])
+                    continue
+                if error_count:
+                    # Con errores ya no se escribe: solo se sigue validando
+                    continue
+                for extension, records in zip(extensions, self._format_plame_rows(row, concepts)):
+                    for record in records:
+                        handles[extension].write(record + '\n')
+
+            for handle in handles.values():
+                handle.close()
+            if error_count:
+                message = '\n'.join(errors)
+                if error_count > len(errors):
+                    message += '\n' + _('... y %s errores más.', error_count - len(errors))
+                raise UserError(_('No se pudo exportar la PLAME:\n%s', message))
+            if previous_dni is None:
+                raise UserError(_('No hay líneas en esta planilla.'))
+
+            zip_path = self._zip_files({f'{prefix}.{extension}': paths[extension] for extension in extensions})
+        finally:
+            for handle in handles.values():
+                handle.close()
+            for path in paths.values():
+                os.unlink(path)
+
+        try:
+            return self._store_export_file('plame_attachment_id', f'{prefix}.zip', zip_path, 'application/zip')
+        finally:
+            os.unlink(zip_path)
@@ -1,6 +1,63 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from datetime import date
+from typing import NamedTuple
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+
+from ..tools.payroll_engine import PayrollSnapshot, find_effective
+
+# Condición SQL de las líneas afectadas por cada parámetro, según la versión
+# ya modificada y los valores anterior y nuevo. Los parámetros que no figuran
+# no cambian los montos calculados (la asignación familiar se toma al generar
+# las líneas)
+SETTINGS_IMPACT = {
+    'onp_percentage': lambda settings, old, new: SQL("line.pension_system = 'onp'"),
+    # EsSalud del contrato en cero: se usa el porcentaje de la configuración
+    'essalud_percentage': lambda settings, old, new: SQL(
+        "COALESCE(line.contract_essalud_percentage, 0) = 0"),
+    'sctr_percentage': lambda settings, old, new: SQL(
+        "line.contract_has_sctr AND COALESCE(line.contract_sctr_percentage, 0) = 0"),
+    # La base SCTR no puede ser menor a la RMV: solo cambian las bases bajo el mayor de los dos topes
+    'rmv_amount': lambda settings, old, new: SQL(
+        "line.contract_has_sctr AND COALESCE(line.sctr, 0) > 0 AND "
+        "COALESCE(line.salary, 0) + COALESCE(line.family_allowance, 0) + COALESCE(line.vacation_amount, 0) < %s",
+        max(old, new)),
+    # La UIT solo interviene en la renta de 5ta categoría calculada. Si en la
+    # misma escritura se activa o desactiva el cálculo, su propio impacto ya
+    # cubre todas las líneas, por lo que basta el valor actual
+    'uit_amount': lambda settings, old, new: SQL("TRUE") if settings.compute_fifth_category else SQL("FALSE"),
+    'compute_fifth_category': lambda settings, old, new: SQL("TRUE"),
+}
+
+# Cambios que alteran qué configuración está vigente: afectan a toda la compañía
+SETTINGS_SCOPE_FIELDS = ('active', 'company_id', 'valid_from', 'valid_to')
+
+# Tabla con el contador que forma parte de la clave de los parámetros en caché
+# (configuración y tasas AFP). Se actualiza en la misma transacción que el
+# cambio, así los demás workers ven el nuevo valor junto con los datos nuevos
+SNAPSHOT_GENERATION_TABLE = 'hr_payroll_snapshot_generation'
+
+# Clave de caché con la generación vigente de los parámetros
+SNAPSHOT_GENERATION_KEY = "self.env['hr.payroll.settings']._get_snapshot_generation()"
+
+
+class SettingsVersion(NamedTuple):
+    """Valores de una versión de la configuración (ver _get_settings_index)"""
+    id: int
+    valid_from: date
+    valid_to: date
+    rmv_amount: float
+    uit_amount: float
+    family_allowance_amount: float
+    onp_percentage: float
+    essalud_percentage: float
+    sctr_percentage: float
+    tope_prima_amount: float
+    compute_fifth_category: bool
+
 
 class HrPayrollSettings(models.Model):
     _name = 'hr.payroll.settings'
@@ -32,10 +89,23 @@ class HrPayrollSettings(models.Model):
     tope_prima_amount = fields.Float(string='Tope Prima (Comisión Mixta)', digits=(10,2), default=12027.91, required=True,
                                     help="Tope máximo para el cálculo de comisión mixta en AFP Prima")
     
+    # Renta de 5ta categoría
+    compute_fifth_category = fields.Boolean(string='Calcular Renta de 5ta Categoría', default=False,
+                                            help="Calcula la retención mensual de 5ta categoría con la proyección anual "
+                                                 "y el acumulado del año. Si no está marcado se usa el monto fijo de "
+                                                 "cada contrato")
+    
     # Campos de control
     year = fields.Integer(string='Año', default=lambda self: fields.Date.today().year, required=True)
     company_id = fields.Many2one('res.company', string='Compañía', default=lambda self: self.env.company, required=True)
     
+    # Vigencia: cada planilla usa la versión vigente en su período
+    valid_from = fields.Date(string='Vigente Desde', compute='_compute_valid_from', store=True, readonly=False,
+                             required=True, index=True,
+                             help="Primer día en que se aplican estos parámetros")
+    valid_to = fields.Date(string='Vigente Hasta',
+                           help="Último día en que se aplican estos parámetros. Vacío: hasta la siguiente versión")
+    
     # Campos informativos calculados
     total_employee_cost_percentage = fields.Float(string='% Total Costo Empleado', compute='_compute_total_percentages', 
                                                   digits=(5,2), store=True,
@@ -46,14 +116,86 @@ class HrPayrollSettings(models.Model):
         for record in self:
             record.total_employee_cost_percentage = record.essalud_percentage + record.sctr_percentage
     
+    @api.depends('year')
+    def _compute_valid_from(self):
+        for record in self:
+            if not record.valid_from and record.year:
+                record.valid_from = date(record.year, 1, 1)
+    
+    @api.constrains('valid_from', 'valid_to', 'company_id', 'active')
+    def _check_validity(self):
+        """Las versiones activas de una compañía no pueden superponerse"""
+        for record in self.filtered('active'):
+            if record.valid_to and record.valid_to < record.valid_from:
+                raise ValidationError(_('La fecha "Vigente Hasta" no puede ser anterior a "Vigente Desde".'))
+            domain = [
+                ('id', '!=', record.id),
+                ('company_id', '=', record.company_id.id),
+                '|', ('valid_to', '=', False), ('valid_to', '>=', record.valid_from),
+            ]
+            if record.valid_to:
+                domain.append(('valid_from', '<=', record.valid_to))
+            overlap = self.search(domain, limit=1)
+            if overlap:
+                raise ValidationError(_(
+                    'La vigencia de "%(name)s" se superpone con la de "%(other)s".',
+                    name=record.name, other=overlap.name,
+                ))
+    
+    @api.model
+    @tools.ormcache('company_id', SNAPSHOT_GENERATION_KEY)
+    def _get_settings_index(self, company_id):
+        """
+        Versiones activas de la configuración de la compañía ordenadas por
+        inicio de vigencia, para búsqueda binaria por fecha
+        
+        Returns:
+            tuple: (fechas valid_from, versiones SettingsVersion, fechas valid_to)
+        """
+        versions = tuple(
+            SettingsVersion(**{name: values[name] for name in SettingsVersion._fields})
+            for values in self.sudo().search_read(
+                [('company_id', '=', company_id)], list(SettingsVersion._fields),
+                order='valid_from, id', load=None)
+        )
+        return (
+            tuple(version.valid_from for version in versions),
+            versions,
+            tuple(version.valid_to for version in versions),
+        )
+    
+    @api.model
+    def _find_settings_version(self, company_id, day):
+        """Versión de la configuración vigente en la fecha, o None si ninguna la cubre"""
+        starts, versions, ends = self._get_settings_index(company_id)
+        return find_effective(starts, versions, day, ends)
+    
+    def _get_period_condition(self):
+        """Condición SQL de las planillas cuyo período usa esta versión"""
+        self.ensure_one()
+        _starts, versions, _ends = self._get_settings_index(self.company_id.id)
+        ids = [version.id for version in versions]
+        if self.id not in ids:
+            return None
+        position = ids.index(self.id)
+        conditions = [
+            SQL("payroll.company_id = %s", self.company_id.id),
+            SQL("payroll.date_from >= %s", self.valid_from),
+        ]
+        if self.valid_to:
+            conditions.append(SQL("payroll.date_from <= %s", self.valid_to))
+        elif position + 1 < len(versions):
+            conditions.append(SQL("payroll.date_from < %s", versions[position + 1].valid_from))
+        return SQL(' AND ').join(conditions)
+    
     @api.model
     def get_current_settings(self):
-        """Obtiene la configuración activa actual"""
-        settings = self.search([
-            ('active', '=', True),
-            ('company_id', '=', self.env.company.id)
-        ], limit=1, order='id desc')
+        """Obtiene la configuración vigente hoy"""
+        version = self._find_settings_version(self.env.company.id, fields.Date.context_today(self))
+        settings = self.browse(version.id) if version else self.browse()
         
+        if not settings and self._get_settings_index(self.env.company.id)[1]:
+            raise UserError(_('Ninguna configuración de planilla está vigente hoy.'))
         if not settings:
             # Crear configuración por defecto si no existe
             settings = self.create({
@@ -78,22 +220,140 @@ class HrPayrollSettings(models.Model):
         settings = self.get_current_settings()
         return getattr(settings, parameter_name, default_value)
     
+    @api.model
+    @tools.ormcache('company_id', 'period', SNAPSHOT_GENERATION_KEY)
+    def _get_payroll_snapshot(self, company_id, period):
+        """
+        Retorna los parámetros de planilla de una compañía y período ('AAAA-MM')
+        como un PayrollSnapshot inmutable.
+
+        Usa la versión de la configuración y las tasas AFP vigentes el primer
+        día del período. El resultado queda en la caché del proceso y se
+        invalida con _invalidate_payroll_snapshot(), que se propaga a todos
+        los workers al confirmar la transacción.
+        """
+        day = date(int(period[:4]), int(period[5:7]), 1)
+        settings = self._find_settings_version(company_id, day)
+        if not settings and self._get_settings_index(company_id)[1]:
+            raise UserError(_('No hay configuración de planilla vigente para el período %s.', period))
+        if not settings:
+            # Sin configuración: usar los valores por defecto sin crear registros
+            settings = self.sudo().new({'company_id': company_id})
+
+        return PayrollSnapshot(
+            company_id=company_id,
+            period=period,
+            rmv_amount=settings.rmv_amount,
+            uit_amount=settings.uit_amount,
+            family_allowance_amount=settings.family_allowance_amount,
+            onp_percentage=settings.onp_percentage,
+            essalud_percentage=settings.essalud_percentage,
+            sctr_percentage=settings.sctr_percentage,
+            tope_prima_amount=settings.tope_prima_amount,
+            compute_fifth_category=bool(settings.compute_fifth_category),
+            afp_rates=self.env['hr.afp.pension.rate']._get_afp_rates(day),
+        )
+
+    def init(self):
+        self.env.cr.execute(SQL(
+            "CREATE TABLE IF NOT EXISTS %s (generation integer NOT NULL)",
+            SQL.identifier(SNAPSHOT_GENERATION_TABLE),
+        ))
+        self.env.cr.execute(SQL(
+            "INSERT INTO %s (generation) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM %s)",
+            SQL.identifier(SNAPSHOT_GENERATION_TABLE), SQL.identifier(SNAPSHOT_GENERATION_TABLE),
+        ))
+
+    @api.model
+    def _get_snapshot_generation(self):
+        """Generación vigente de los parámetros en caché, según la transacción actual"""
+        self.env.cr.execute(SQL("SELECT generation FROM %s", SQL.identifier(SNAPSHOT_GENERATION_TABLE)))
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _invalidate_payroll_snapshot(self):
+        """
+        Invalida los parámetros en caché en este y en los demás workers
+
+        Solo cambia la generación que forma parte de su clave: el resto de la
+        caché del registro se conserva y las entradas anteriores salen de la
+        caché a medida que se dejan de usar.
+        """
+        self.env.cr.execute(SQL(
+            "UPDATE %s SET generation = generation + 1", SQL.identifier(SNAPSHOT_GENERATION_TABLE)))
+
+    def _recompute_company_lines(self, company_ids):
+        """Recalcula las líneas abiertas de las compañías"""
+        if company_ids:
+            self.env['hr.payroll.line']._recompute_impacted([
+                SQL("payroll.company_id IN %s", tuple(company_ids)),
+            ])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self._invalidate_payroll_snapshot()
+        records._recompute_company_lines(records.filtered('active').company_id.ids)
+        return records
+
+    def write(self, vals):
+        impact_fields = [fname for fname in SETTINGS_IMPACT if fname in vals]
+        scope_changed = any(fname in vals for fname in SETTINGS_SCOPE_FIELDS)
+        old_values = {
+            record.id: {fname: record[fname] for fname in impact_fields}
+            for record in self
+        }
+        old_companies = self.company_id
+        res = super().write(vals)
+        self._invalidate_payroll_snapshot()
+
+        if scope_changed:
+            self._recompute_company_lines((old_companies | self.company_id).ids)
+        else:
+            # Solo las líneas de los períodos de la versión que dependen de lo modificado
+            conditions = []
+            for record in self.filtered('active'):
+                period_condition = record._get_period_condition()
+                for fname in impact_fields:
+                    old, new = old_values[record.id][fname], record[fname]
+                    if period_condition and old != new:
+                        conditions.append(SQL(
+                            "%s AND %s", period_condition, SETTINGS_IMPACT[fname](record, old, new),
+                        ))
+            self.env['hr.payroll.line']._recompute_impacted(conditions)
+        return res
+
+    def unlink(self):
+        company_ids = self.filtered('active').company_id.ids
+        res = super().unlink()
+        self._invalidate_payroll_snapshot()
+        self._recompute_company_lines(company_ids)
+        return res
+
     def action_activate(self):
-        """Activa esta configuración y desactiva las demás"""
+        """Activa esta configuración y desactiva las que se superponen con su vigencia"""
         self.ensure_one()
         
-        # Desactivar todas las configuraciones de la misma empresa
-        other_settings = self.search([
+        # Desactivar las configuraciones de la misma empresa con vigencia superpuesta
+        domain = [
             ('company_id', '=', self.company_id.id),
-            ('id', '!=', self.id)
-        ])
+            ('id', '!=', self.id),
+            '|', ('valid_to', '=', False), ('valid_to', '>=', self.valid_from),
+        ]
+        if self.valid_to:
+            domain.append(('valid_from', '<=', self.valid_to))
+        other_settings = self.with_context(skip_payroll_impact=True).search(domain)
         other_settings.write({'active': False})
         
         # Activar esta configuración
-        self.active = True
+        self.with_context(skip_payroll_impact=True).active = True
         
         # Actualizar topes en AFP si es necesario
-        self._update_afp_topes()
+        self.with_context(skip_payroll_impact=True)._update_afp_topes()
+        self._invalidate_payroll_snapshot()
+        
+        # Recalcular una sola vez las planillas abiertas de la compañía
+        self._recompute_company_lines(self.company_id.ids)
         
         return {
             'type': 'ir.actions.client',
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+from odoo import models, fields, api, _, Command
+from odoo.exceptions import UserError
+
+from ..tools import payroll_engine
+
+# Parámetros del snapshot que se pueden simular
+SIMULATION_PARAMETERS = (
+    'rmv_amount', 'uit_amount', 'family_allowance_amount', 'onp_percentage',
+    'essalud_percentage', 'sctr_percentage', 'tope_prima_amount',
+)
+
+# Tasas de AFP que se pueden simular
+SIMULATION_AFP_FIELDS = (
+    'fund_percentage', 'insurance_percentage', 'commission_flow_percentage', 'commission_mixed_percentage',
+)
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    def action_open_simulation(self):
+        """Abre el asistente de simulación de parámetros"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Simular Parámetros'),
+            'res_model': 'hr.payroll.simulation',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'default_payroll_id': self.id},
+        }
+
+    def simulate_parameters(self, overrides, afp_overrides=None, raise_minimum_wages=True):
+        """
+        Calcula la planilla con otros parámetros sin escribir nada
+
+        Las líneas se calculan en memoria dos veces con el motor, con los
+        parámetros vigentes y con los simulados, de modo que la diferencia
+        se debe solo al cambio de parámetros.
+
+        Args:
+            overrides (dict): {parámetro de SIMULATION_PARAMETERS: valor}
+            afp_overrides (dict): {id de AFP: {tasa de SIMULATION_AFP_FIELDS: valor}}
+            raise_minimum_wages (bool): elevar a la nueva RMV los sueldos menores
+
+        Returns:
+            dict: 'lines' (una fila por línea), 'departments' (una fila por
+                  departamento) y 'totals', con el neto a pagar y el costo del
+                  empleador actuales, simulados y su diferencia
+        """
+        self.ensure_one()
+        if self.payroll_type != 'monthly':
+            raise UserError(_('Solo se pueden simular planillas mensuales.'))
+        unknown = set(overrides) - set(SIMULATION_PARAMETERS)
+        for values in (afp_overrides or {}).values():
+            unknown |= set(values) - set(SIMULATION_AFP_FIELDS)
+        if unknown:
+            raise UserError(_('Parámetros de simulación desconocidos: %s', ', '.join(sorted(unknown))))
+        lines = self.payroll_line_ids
+        if not lines:
+            raise UserError(_('No hay líneas de planilla para simular.'))
+
+        snapshot = self._get_payroll_snapshot()
+        simulated = payroll_engine.simulated_snapshot(snapshot, overrides, afp_overrides)
+        cols = lines._prepare_batch_columns()
+        current = payroll_engine.compute_batch(cols, snapshot)
+        result = payroll_engine.compute_batch(
+            payroll_engine.simulated_inputs(cols, snapshot, simulated, raise_minimum_wages), simulated)
+        return self._summarize_simulation(lines, current, result)
+
+    @api.model
+    def _summarize_simulation(self, lines, current, result):
+        """Diferencias por línea, por departamento y totales de dos resultados del motor"""
+        keys = ('net_pay', 'employer_cost')
+        rows = []
+        departments = defaultdict(lambda: dict.fromkeys(
+            ('employee_count',) + keys + tuple(f'simulated_{key}' for key in keys), 0))
+        for index, line in enumerate(lines):
+            before = {
+                'net_pay': current['net_pay'][index],
+                'employer_cost': current['net_pay'][index] + current['total_employer_contribution'][index],
+            }
+            after = {
+                'net_pay': result['net_pay'][index],
+                'employer_cost': result['net_pay'][index] + result['total_employer_contribution'][index],
+            }
+            row = {'line_id': line.id, 'employee_id': line.employee_id.id, 'department_id': line.department_id.id}
+            department = departments[line.department_id.id]
+            department['employee_count'] += 1
+            for key in keys:
+                row[key] = round(before[key], 2)
+                row[f'simulated_{key}'] = round(after[key], 2)
+                row[f'{key}_delta'] = round(after[key] - before[key], 2)
+                department[key] += before[key]
+                department[f'simulated_{key}'] += after[key]
+            rows.append(row)
+
+        department_rows = []
+        totals = dict.fromkeys(('employee_count',) + keys + tuple(f'simulated_{key}' for key in keys), 0)
+        for department_id, values in departments.items():
+            row = {'department_id': department_id, 'employee_count': values['employee_count']}
+            for key in keys:
+                row[key] = round(values[key], 2)
+                row[f'simulated_{key}'] = round(values[f'simulated_{key}'], 2)
+                row[f'{key}_delta'] = round(values[f'simulated_{key}'] - values[key], 2)
+            for name, value in values.items():
+                totals[name] += value
+            department_rows.append(row)
+        for key in keys:
+            totals[key] = round(totals[key], 2)
+            totals[f'simulated_{key}'] = round(totals[f'simulated_{key}'], 2)
+            totals[f'{key}_delta'] = round(totals[f'simulated_{key}'] - totals[key], 2)
+        department_rows.sort(key=lambda row: row['employer_cost_delta'], reverse=True)
+        return {'lines': rows, 'departments': department_rows, 'totals': totals}
+
+
+class HrPayrollSimulation(models.TransientModel):
+    """
+    Simulación de un cambio de parámetros (RMV, UIT, tasas de AFP, etc.)
+    sobre una planilla, sin modificar la configuración ni las líneas
+    """
+    _name = 'hr.payroll.simulation'
+    _description = 'Simulación de Parámetros de Planilla'
+
+    payroll_id = fields.Many2one('hr.payroll.monthly', string='Planilla', required=True, readonly=True)
+    currency_id = fields.Many2one(related='payroll_id.currency_id')
+
+    # Parámetros simulados (por defecto los vigentes en el período)
+    rmv_amount = fields.Float(string='RMV', digits=(10,2))
+    uit_amount = fields.Float(string='UIT', digits=(10,2))
+    family_allowance_amount = fields.Float(string='Asignación Familiar', digits=(10,2),
+                                           help="Si solo se cambia la RMV se usa el 10% de la nueva RMV")
+    onp_percentage = fields.Float(string='Porcentaje ONP (%)', digits=(5,2))
+    essalud_percentage = fields.Float(string='Porcentaje EsSalud (%)', digits=(5,2))
+    sctr_percentage = fields.Float(string='Porcentaje SCTR (%)', digits=(5,2))
+    tope_prima_amount = fields.Float(string='Tope Prima (Comisión Mixta)', digits=(10,2),
+                                     help="Se aplica como tope de la comisión mixta de todas las AFP")
+    raise_minimum_wages = fields.Boolean(string='Elevar Sueldos a la Nueva RMV', default=True,
+                                         help="Los sueldos de contrato menores a la nueva RMV se elevan a ella")
+    afp_line_ids = fields.One2many('hr.payroll.simulation.afp', 'simulation_id', string='Tasas AFP')
+
+    # Resultado
+    simulated = fields.Boolean(readonly=True)
+    department_line_ids = fields.One2many('hr.payroll.simulation.department', 'simulation_id',
+                                          string='Por Departamento', readonly=True)
+    employee_count = fields.Integer(string='Empleados', readonly=True)
+    net_pay = fields.Float(string='Neto Actual', digits=(12,2), readonly=True)
+    simulated_net_pay = fields.Float(string='Neto Simulado', digits=(12,2), readonly=True)
+    net_pay_delta = fields.Float(string='Diferencia Neto', digits=(12,2), readonly=True)
+    employer_cost = fields.Float(string='Costo Actual', digits=(12,2), readonly=True)
+    simulated_employer_cost = fields.Float(string='Costo Simulado', digits=(12,2), readonly=True)
+    employer_cost_delta = fields.Float(string='Diferencia Costo', digits=(12,2), readonly=True)
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        payroll = self.env['hr.payroll.monthly'].browse(res.get('payroll_id'))
+        if not payroll:
+            return res
+        snapshot = payroll._get_payroll_snapshot()
+        for name in SIMULATION_PARAMETERS:
+            res.setdefault(name, getattr(snapshot, name))
+        # Solo las AFP de los empleados de la planilla
+        afp_ids = set(payroll.payroll_line_ids.afp_id.ids)
+        res.setdefault('afp_line_ids', [
+            Command.create({'afp_id': rates.id, **{name: getattr(rates, name) for name in SIMULATION_AFP_FIELDS}})
+            for rates in snapshot.afp_rates if rates.id in afp_ids
+        ])
+        return res
+
+    def _get_overrides(self):
+        """Parámetros y tasas de AFP que difieren de los vigentes"""
+        snapshot = self.payroll_id._get_payroll_snapshot()
+        overrides = {
+            name: self[name] for name in SIMULATION_PARAMETERS
+            if round(self[name] - getattr(snapshot, name), 2)
+        }
+        afp_overrides = {}
+        for line in self.afp_line_ids:
+            rates = snapshot.afp(line.afp_id.id)
+            changed = {
+                name: line[name] for name in SIMULATION_AFP_FIELDS
+                if rates is None or round(line[name] - getattr(rates, name), 2)
+            }
+            if changed:
+                afp_overrides[line.afp_id.id] = changed
+        return overrides, afp_overrides
+
+    def action_simulate(self):
+        self.ensure_one()
+        overrides, afp_overrides = self._get_overrides()
+        summary = self.payroll_id.simulate_parameters(overrides, afp_overrides, self.raise_minimum_wages)
+        self.write({
+            'simulated': True,
+            'department_line_ids': [Command.clear()] + [
+                Command.create({key: row[key] for key in row}) for row in summary['departments']
+            ],
+            **summary['totals'],
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class HrPayrollSimulationAfp(models.TransientModel):
+    _name = 'hr.payroll.simulation.afp'
+    _description = 'Tasas AFP Simuladas'
+
+    simulation_id = fields.Many2one('hr.payroll.simulation', required=True, ondelete='cascade')
+    afp_id = fields.Many2one('hr.afp.pension', string='AFP', required=True)
+    fund_percentage = fields.Float(string='Fondo (%)', digits=(5,2))
+    insurance_percentage = fields.Float(string='Seguro (%)', digits=(5,2))
+    commission_flow_percentage = fields.Float(string='Comisión Flujo (%)', digits=(5,2))
+    commission_mixed_percentage = fields.Float(string='Comisión Mixta (%)', digits=(5,2))
+
+
+class HrPayrollSimulationDepartment(models.TransientModel):
+    _name = 'hr.payroll.simulation.department'
+    _description = 'Resultado de Simulación por Departamento'
+    _order = 'employer_cost_delta desc'
+
+    simulation_id = fields.Many2one('hr.payroll.simulation', required=True, ondelete='cascade')
+    department_id = fields.Many2one('hr.department', string='Departamento')
+    employee_count = fields.Integer(string='Empleados')
+    net_pay = fields.Float(string='Neto Actual', digits=(12,2))
+    simulated_net_pay = fields.Float(string='Neto Simulado', digits=(12,2))
+    net_pay_delta = fields.Float(string='Diferencia Neto', digits=(12,2))
+    employer_cost = fields.Float(string='Costo Actual', digits=(12,2))
+    simulated_employer_cost = fields.Float(string='Costo Simulado', digits=(12,2))
+    employer_cost_delta = fields.Float(string='Diferencia Costo', digits=(12,2))
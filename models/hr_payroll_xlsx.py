@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.misc import xlsxwriter
+
+from .hr_payroll_line import VARIABLE_INPUTS
+
+# Columnas de la hoja, en el orden de la planilla en Excel. Las dos primeras
+# identifican al trabajador; el resto son campos de hr.payroll.line
+XLSX_KEY_COLUMNS = ('identification_id', 'employee_name')
+XLSX_LINE_COLUMNS = (
+    'worked_days', 'tardiness_count', 'medical_rest_days', 'vacation_days',
+    'salary', 'family_allowance', 'night_bonus', 'medical_rest_amount', 'other_bonus',
+    'vacation_amount', 'overtime_amount', 'total_income', 'taxable_base',
+    'afp_fund', 'afp_insurance', 'afp_commission', 'afp_total', 'onp_discount',
+    'advance_gratification', 'fifth_category', 'fifth_category_tax', 'tardiness_discount',
+    'judicial_retention', 'advance_payment', 'total_discount', 'net_pay',
+    'essalud', 'sctr', 'total_employer_contribution',
+)
+
+
+class HrPayrollMonthly(models.Model):
+    _inherit = 'hr.payroll.monthly'
+
+    xlsx_attachment_id = fields.Many2one('ir.attachment', string='Planilla en Excel', readonly=True, copy=False)
+
+    def action_export_xlsx(self):
+        """
+        Exporta la planilla a Excel, una fila por línea y la fila de totales
+
+        Las filas se leen por bloques desde un cursor del servidor y se
+        escriben en modo de memoria constante: cada fila se vuelca a disco
+        apenas se completa.
+        """
+        self.ensure_one()
+        if not self.payroll_line_ids:
+            raise UserError(_('No hay líneas en esta planilla.'))
+
+        attachment = self._generate_xlsx()
+        return self._download_attachment_action(attachment)
+
+    def action_import_inputs(self):
+        """Abre el asistente para cargar las entradas variables (Excel editado o CSV del reloj)"""
+        self.ensure_one()
+        if self.state not in ('draft', 'calculated'):
+            raise UserError(_('Solo se pueden cargar entradas en planillas en borrador o calculadas.'))
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Importar Entradas'),
+            'res_model': 'hr.payroll.input.import',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'default_payroll_id': self.id},
+        }
+
+    def _get_xlsx_headers(self):
+        """Encabezados de la hoja: etiqueta de cada columna"""
+        line_fields = self.env['hr.payroll.line']._fields
+        return [_('DNI'), _('Empleado')] + [line_fields[name].string for name in XLSX_LINE_COLUMNS]
+
+    def _get_xlsx_query(self):
+        return SQL(
+            """
+            SELECT line.identification_id, employee.name AS employee_name, %s
+              FROM hr_payroll_line AS line
+              JOIN hr_employee AS employee ON employee.id = line.employee_id
+             WHERE line.payroll_id = %s
+             ORDER BY line.sequence, employee.name, line.id
+            """,
+            SQL(', ').join(SQL('COALESCE(line.%s, 0) AS %s', SQL.identifier(name), SQL.identifier(name))
+                           for name in XLSX_LINE_COLUMNS),
+            self.id,
+        )
+
+    def _generate_xlsx(self):
+        """Escribe la hoja en disco fila por fila y la guarda como adjunto"""
+        line_fields = self.env['hr.payroll.line']._fields
+        amount_columns = [name for name in XLSX_LINE_COLUMNS if line_fields[name].type == 'float']
+        totals = dict.fromkeys(amount_columns, 0.0)
+
+        handle, path = tempfile.mkstemp(suffix='.xlsx', prefix='planilla_')
+        os.close(handle)
+        try:
+            workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+            sheet = workbook.add_worksheet(self.date_period.strftime('%Y-%m'))
+            bold = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top'})
+            money = workbook.add_format({'num_format': '#,##0.00'})
+            editable = workbook.add_format({'bg_color': '#FFF2CC'})
+            editable_money = workbook.add_format({'num_format': '#,##0.00', 'bg_color': '#FFF2CC'})
+            total_money = workbook.add_format({'num_format': '#,##0.00', 'bold': True, 'top': 1})
+
+            headers = self._get_xlsx_headers()
+            sheet.set_column(0, 0, 12)
+            sheet.set_column(1, 1, 40)
+            sheet.set_column(2, len(headers) - 1, 14)
+            sheet.freeze_panes(1, 2)
+            sheet.write_row(0, 0, headers, bold)
+
+            row_index = 0
+            for row in self._stream_query(self._get_xlsx_query()):
+                row_index += 1
+                sheet.write_string(row_index, 0, row['identification_id'] or '')
+                sheet.write_string(row_index, 1, row['employee_name'] or '')
+                for column, name in enumerate(XLSX_LINE_COLUMNS, start=len(XLSX_KEY_COLUMNS)):
+                    if name in totals:
+                        totals[name] += row[name]
+                        cell_format = editable_money if name in VARIABLE_INPUTS else money
+                    else:
+                        cell_format = editable if name in VARIABLE_INPUTS else None
+                    sheet.write_number(row_index, column, row[name], cell_format)
+
+            # Fila de totales: fórmulas con el resultado ya calculado
+            total_row = row_index + 1
+            sheet.write_string(total_row, 1, _('TOTALES'), bold)
+            for column, name in enumerate(XLSX_LINE_COLUMNS, start=len(XLSX_KEY_COLUMNS)):
+                if name in totals:
+                    letter = xlsxwriter.utility.xl_col_to_name(column)
+                    sheet.write_formula(total_row, column, f'=SUM({letter}2:{letter}{total_row})',
+                                        total_money, round(totals[name], 2))
+            workbook.close()
+
+            return self._store_export_file(
+                'xlsx_attachment_id', f'Planilla {self.name.replace("/", "-")}.xlsx', path,
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        finally:
+            os.unlink(path)
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de cálculo por lotes de la planilla.
+
+No depende del ORM: recibe las entradas de todas las líneas como columnas
+(un diccionario de listas del mismo largo) y devuelve los montos calculados
+también como columnas. Cada monto es un concepto con entradas declaradas;
+los conceptos forman un grafo acíclico que se evalúa en orden topológico.
+"""
+
+import multiprocessing
+import sys
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+from itertools import repeat
+from typing import NamedTuple
+
+
+class AfpRates(NamedTuple):
+    """Tasas vigentes de una AFP"""
+    id: int
+    code: str
+    fund_percentage: float
+    insurance_percentage: float
+    commission_flow_percentage: float
+    commission_mixed_percentage: float
+    commission_type: str
+    tope_amount: float
+
+
+@dataclass(frozen=True)
+class PayrollSnapshot:
+    """
+    Parámetros de planilla vigentes para una compañía y un período.
+
+    Es inmutable para poder compartirlo entre líneas, planillas y procesos.
+    """
+    company_id: int
+    period: str
+    rmv_amount: float
+    uit_amount: float
+    family_allowance_amount: float
+    onp_percentage: float
+    essalud_percentage: float
+    sctr_percentage: float
+    tope_prima_amount: float
+    afp_rates: tuple = ()
+    compute_fifth_category: bool = False
+    _afp_index: dict = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, '_afp_index', {rates.id: rates for rates in self.afp_rates})
+
+    def afp(self, afp_id):
+        """Retorna las tasas de la AFP o None si no existe"""
+        return self._afp_index.get(afp_id) if afp_id else None
+
+
+def find_effective(starts, versions, day, ends=None):
+    """
+    Versión vigente en una fecha por búsqueda binaria.
+
+    Args:
+        starts (tuple): fechas de inicio de vigencia, ordenadas
+        versions (tuple): versiones en el mismo orden que starts
+        day (date): fecha a consultar
+        ends (tuple): fechas de fin de vigencia (None o False: sin fin), en
+                      el mismo orden que starts
+
+    Returns:
+        la última versión que empieza en o antes de la fecha, o None si la
+        fecha es anterior a todas o posterior al fin de esa versión
+    """
+    position = bisect_right(starts, day) - 1
+    if position < 0:
+        return None
+    if ends and ends[position] and day > ends[position]:
+        return None
+    return versions[position]
+
+
+class PayrollGraphError(Exception):
+    """Definición inválida del grafo de conceptos (ciclo o entrada desconocida)"""
+
+
+class PayrollMismatchError(Exception):
+    """El cálculo paralelo no coincide con el cálculo secuencial"""
+
+
+class Concept(NamedTuple):
+    """
+    Concepto de planilla: calcula una o más columnas a partir de otras.
+
+    compute recibe el snapshot seguido de las columnas de inputs, en orden,
+    y retorna una columna (o una tupla de columnas si hay varias salidas).
+    """
+    outputs: tuple
+    inputs: tuple
+    compute: object
+
+
+# Columnas de entrada que el motor espera recibir
+LINE_INPUTS = (
+    # Línea de planilla
+    'salary', 'family_allowance', 'other_bonus', 'overtime_amount',
+    'worked_days', 'medical_rest_days', 'vacation_days', 'tardiness_count',
+    'advance_gratification', 'fifth_category', 'judicial_retention', 'advance_payment',
+    # Contrato
+    'has_contract', 'contract_wage', 'contract_night_bonus',
+    'contract_essalud_percentage', 'contract_sctr_percentage', 'contract_has_sctr',
+    # Sistema de pensiones del empleado
+    'pension_system', 'afp_id', 'commission_type', 'exempt_afp_commission',
+    # Renta de 5ta de los meses anteriores y retenciones anteriores al mes
+    # de corte (planillas validadas)
+    'fifth_ytd_income', 'fifth_ytd_withheld',
+)
+
+# Columnas que el motor calcula y que se guardan en hr.payroll.line
+LINE_RESULTS = (
+    'night_bonus', 'medical_rest_amount', 'vacation_amount', 'total_income',
+    'afp_taxable_base', 'onp_taxable_base', 'taxable_base',
+    'afp_fund', 'afp_insurance', 'afp_commission', 'afp_total', 'onp_discount',
+    'fifth_category_tax', 'tardiness_discount', 'total_discount', 'net_pay',
+    'essalud', 'sctr', 'total_employer_contribution',
+)
+
+# Renta de 5ta categoría: deducción anual en UIT y tramos de la escala
+# progresiva acumulativa (hasta N UIT, tasa %); el último tramo no tiene tope
+FIFTH_CATEGORY_DEDUCTION_UIT = 7
+FIFTH_CATEGORY_BRACKETS = ((5, 8.0), (20, 14.0), (35, 17.0), (45, 20.0), (None, 30.0))
+
+# Retención mensual de 5ta (art. 40 del Reglamento de la LIR): por mes, el
+# divisor del impuesto anual y el mes desde el cual las retenciones ya no se
+# restan. De enero a marzo no se resta nada; diciembre regulariza el saldo.
+FIFTH_CATEGORY_SCHEDULE = {
+    1: (12, 1), 2: (12, 1), 3: (12, 1),
+    4: (9, 4),
+    5: (8, 5), 6: (8, 5), 7: (8, 5),
+    8: (5, 8),
+    9: (4, 9), 10: (4, 9), 11: (4, 9),
+    12: (1, 12),
+}
+
+# Conceptos registrados con @concept, en orden de declaración
+CONCEPTS = []
+
+
+def concept(*outputs, inputs):
+    """Registra una función como concepto de planilla"""
+    def decorator(func):
+        CONCEPTS.append(Concept(tuple(outputs), tuple(inputs), func))
+        return func
+    return decorator
+
+
+def resolve_order(concepts, inputs=LINE_INPUTS):
+    """
+    Ordena los conceptos topológicamente.
+
+    Raises:
+        PayrollGraphError: si un concepto usa una columna que nadie produce,
+            si dos conceptos producen la misma columna o si hay un ciclo
+    """
+    producers = {}
+    for item in concepts:
+        for output in item.outputs:
+            if output in producers or output in inputs:
+                raise PayrollGraphError(f'La columna "{output}" se define más de una vez')
+            producers[output] = item
+
+    for item in concepts:
+        for name in item.inputs:
+            if name not in producers and name not in inputs:
+                raise PayrollGraphError(f'El concepto {item.outputs} usa la columna desconocida "{name}"')
+
+    # Algoritmo de Kahn
+    pending = {item.outputs: {producers[name].outputs for name in item.inputs if name in producers}
+               for item in concepts}
+    by_outputs = {item.outputs: item for item in concepts}
+    order = []
+    ready = [outputs for outputs, deps in pending.items() if not deps]
+    while ready:
+        outputs = ready.pop(0)
+        order.append(by_outputs[outputs])
+        del pending[outputs]
+        for other, deps in pending.items():
+            if outputs in deps:
+                deps.discard(outputs)
+                if not deps and other not in ready:
+                    ready.append(other)
+    if pending:
+        cycle = ', '.join('/'.join(outputs) for outputs in pending)
+        raise PayrollGraphError(f'Dependencia cíclica entre los conceptos: {cycle}')
+    return order
+
+
+_ORDER = []
+
+
+def check_graph():
+    """Valida el grafo de conceptos y guarda su orden de cálculo"""
+    _ORDER[:] = resolve_order(CONCEPTS)
+    missing = set(LINE_RESULTS) - {name for item in _ORDER for name in item.outputs}
+    if missing:
+        raise PayrollGraphError(f'Columnas sin concepto que las calcule: {", ".join(sorted(missing))}')
+    return list(_ORDER)
+
+
+def fifth_category_annual_tax(net_income, uit_amount):
+    """Impuesto anual de 5ta categoría sobre la renta neta, por tramos de UIT"""
+    tax = 0.0
+    lower = 0.0
+    for limit, rate in FIFTH_CATEGORY_BRACKETS:
+        upper = limit * uit_amount if limit is not None else net_income
+        if net_income <= lower:
+            break
+        tax += (min(net_income, upper) - lower) * (rate / 100)
+        lower = upper
+    return tax
+
+
+def _pension_discounts(taxable_base, onp_base, pension_system, afp_id, commission_type,
+                       exempt, snapshot):
+    """Fondo, seguro, comisión, total AFP y ONP de una línea"""
+    afp = snapshot.afp(afp_id)
+    if pension_system == 'afp' and afp:
+        fund = taxable_base * (afp.fund_percentage / 100)
+        insurance = taxable_base * (afp.insurance_percentage / 100)
+        if exempt:
+            commission = 0.0
+        else:
+            ctype = commission_type or afp.commission_type
+            if ctype == 'mixed':
+                # Comisión mixta con tope
+                commission = min(taxable_base, afp.tope_amount) * (afp.commission_mixed_percentage / 100)
+            else:
+                commission = taxable_base * (afp.commission_flow_percentage / 100)
+        return (round(fund, 2), round(insurance, 2), round(commission, 2),
+                round(fund + insurance + commission, 2), 0.0)
+    if pension_system == 'onp':
+        return 0.0, 0.0, 0.0, 0.0, round(onp_base * (snapshot.onp_percentage / 100), 2)
+    return 0.0, 0.0, 0.0, 0.0, 0.0
+
+
+# ---------------------------------------------------------------------------
+# Conceptos de la planilla (fórmulas del Excel)
+# ---------------------------------------------------------------------------
+
+@concept('night_bonus', inputs=('has_contract', 'contract_night_bonus', 'worked_days'))
+def _night_bonus(snapshot, has_contract, bonus, worked_days):
+    """Bonificación del contrato proporcional a los días trabajados"""
+    return [
+        round(b / 30 * days, 2) if has and b > 0 and days > 0 else 0.0
+        for has, b, days in zip(has_contract, bonus, worked_days)
+    ]
+
+
+@concept('medical_rest_amount', inputs=('has_contract', 'contract_wage', 'medical_rest_days'))
+def _medical_rest_amount(snapshot, has_contract, wage, days):
+    """Descanso médico: solo el sueldo base del contrato / 30 * días"""
+    return [
+        round(w / 30 * d, 2) if has and d > 0 else 0.0
+        for has, w, d in zip(has_contract, wage, days)
+    ]
+
+
+@concept('vacation_amount', inputs=('has_contract', 'contract_wage', 'family_allowance', 'vacation_days'))
+def _vacation_amount(snapshot, has_contract, wage, family, days):
+    """Vacaciones: (Sueldo del contrato + Asig. Familiar) / 30 * días de vacaciones"""
+    return [
+        round(((w if has else 0.0) + f) / 30 * d, 2) if d > 0 else 0.0
+        for has, w, f, d in zip(has_contract, wage, family, days)
+    ]
+
+
+@concept('total_income', inputs=('salary', 'family_allowance', 'night_bonus', 'medical_rest_amount',
+                                  'other_bonus', 'vacation_amount', 'overtime_amount'))
+def _total_income(snapshot, *columns):
+    return [sum(values) for values in zip(*columns)]
+
+
+@concept('afp_taxable_base', inputs=('total_income', 'night_bonus'))
+def _afp_taxable_base(snapshot, total_income, night_bonus):
+    """Base AFP: Total Ingresos - Bonificaciones"""
+    return [ti - nb for ti, nb in zip(total_income, night_bonus)]
+
+
+@concept('onp_taxable_base', inputs=('afp_taxable_base', 'medical_rest_amount'))
+def _onp_taxable_base(snapshot, afp_base, medical_rest):
+    """Base ONP: Total Ingresos - Bonificaciones - Descanso Médico"""
+    return [ab - mr for ab, mr in zip(afp_base, medical_rest)]
+
+
+@concept('taxable_base', inputs=('afp_taxable_base',))
+def _taxable_base(snapshot, afp_base):
+    """Se mantiene por compatibilidad: es la base AFP"""
+    return list(afp_base)
+
+
+@concept('afp_fund', 'afp_insurance', 'afp_commission', 'afp_total', 'onp_discount',
+         inputs=('taxable_base', 'onp_taxable_base', 'pension_system', 'afp_id',
+                 'commission_type', 'exempt_afp_commission'))
+def _pension(snapshot, taxable_base, onp_base, pension_system, afp_id, commission_type, exempt):
+    rows = [
+        _pension_discounts(tb, ob, ps, afp, ct, ex, snapshot)
+        for tb, ob, ps, afp, ct, ex in zip(taxable_base, onp_base, pension_system, afp_id,
+                                           commission_type, exempt)
+    ]
+    if not rows:
+        return [], [], [], [], []
+    return tuple(list(column) for column in zip(*rows))
+
+
+@concept('tardiness_discount', inputs=('salary', 'family_allowance', 'tardiness_count'))
+def _tardiness_discount(snapshot, salary, family, count):
+    """Tardanzas: ((Sueldo + Asig. Familiar) / 240) * tardanzas"""
+    return [
+        round((s + f) / 240 * c, 2) if c > 0 else 0.0
+        for s, f, c in zip(salary, family, count)
+    ]
+
+
+@concept('fifth_category_tax', inputs=('fifth_category', 'total_income', 'fifth_ytd_income', 'fifth_ytd_withheld'))
+def _fifth_category_tax(snapshot, fixed, total_income, ytd_income, ytd_withheld):
+    """
+    Retención de 5ta categoría del mes
+
+    Sin cálculo automático es el monto fijo de la línea. Con cálculo
+    automático se proyecta la renta anual (acumulado de los meses anteriores
+    + remuneración del mes por los meses que faltan + gratificaciones
+    pendientes) y se le resta la deducción de 7 UIT; al impuesto anual se le
+    restan las retenciones anteriores al mes de corte y se divide entre el
+    divisor del mes (FIFTH_CATEGORY_SCHEDULE).
+    """
+    if not snapshot.compute_fifth_category:
+        return list(fixed)
+    month = int(snapshot.period[5:7])
+    remaining = 12 - month
+    divisor = FIFTH_CATEGORY_SCHEDULE[month][0]
+    # Gratificaciones de julio y diciembre que aún no se pagan
+    gratifications = 2 if month < 7 else 1 if month < 12 else 0
+    deduction = FIFTH_CATEGORY_DEDUCTION_UIT * snapshot.uit_amount
+    result = []
+    for ti, income, withheld in zip(total_income, ytd_income, ytd_withheld):
+        projected = income + ti * (1 + remaining + gratifications)
+        tax = fifth_category_annual_tax(projected - deduction, snapshot.uit_amount)
+        result.append(round(max(tax - withheld, 0.0) / divisor, 2))
+    return result
+
+
+@concept('total_discount', inputs=('afp_total', 'onp_discount', 'advance_gratification', 'fifth_category_tax',
+                                    'tardiness_discount', 'judicial_retention', 'advance_payment'))
+def _total_discount(snapshot, *columns):
+    return [sum(values) for values in zip(*columns)]
+
+
+@concept('net_pay', inputs=('total_income', 'total_discount'))
+def _net_pay(snapshot, total_income, total_discount):
+    return [ti - td for ti, td in zip(total_income, total_discount)]
+
+
+@concept('employer_base', inputs=('salary', 'family_allowance', 'vacation_amount'))
+def _employer_base(snapshot, salary, family, vacation):
+    """Base de aportes del empleador: Sueldo + Asig. Familiar + Vacaciones"""
+    return [s + f + v for s, f, v in zip(salary, family, vacation)]
+
+
+@concept('essalud', inputs=('employer_base', 'has_contract', 'contract_essalud_percentage'))
+def _essalud(snapshot, base, has_contract, percentage):
+    result = []
+    for b, has, pct in zip(base, has_contract, percentage):
+        pct = (pct if has else 0.0) or snapshot.essalud_percentage
+        result.append(round(b * (pct / 100), 2) if b > 0 else 0.0)
+    return result
+
+
+@concept('sctr', inputs=('employer_base', 'has_contract', 'contract_has_sctr', 'contract_sctr_percentage'))
+def _sctr(snapshot, base, has_contract, has_sctr, percentage):
+    result = []
+    for b, has, sctr, pct in zip(base, has_contract, has_sctr, percentage):
+        if has and sctr and b > 0:
+            # La base SCTR no puede ser menor a la RMV
+            pct = pct or snapshot.sctr_percentage
+            result.append(round(max(b, snapshot.rmv_amount) * (pct / 100), 2))
+        else:
+            result.append(0.0)
+    return result
+
+
+@concept('total_employer_contribution', inputs=('essalud', 'sctr'))
+def _total_employer_contribution(snapshot, essalud, sctr):
+    return [e + s for e, s in zip(essalud, sctr)]
+
+
+def compute_batch(cols, snapshot):
+    """
+    Calcula todos los montos de un lote de líneas en una sola pasada.
+
+    Cada concepto se evalúa una sola vez, en orden topológico.
+
+    Args:
+        cols (dict): columnas de entrada (ver LINE_INPUTS)
+        snapshot (PayrollSnapshot): parámetros vigentes del período
+
+    Returns:
+        dict: columnas calculadas (ver LINE_RESULTS)
+    """
+    order = _ORDER or check_graph()
+    values = dict(cols)
+    for item in order:
+        result = item.compute(snapshot, *(values[name] for name in item.inputs))
+        if len(item.outputs) == 1:
+            values[item.outputs[0]] = result
+        else:
+            values.update(zip(item.outputs, result))
+    return {name: values[name] for name in LINE_RESULTS}
+
+
+# ---------------------------------------------------------------------------
+# Beneficios semestrales: gratificación y CTS
+# ---------------------------------------------------------------------------
+
+# Columnas que calculan los beneficios (además de total_income y net_pay)
+BENEFIT_RESULTS = (
+    'months_worked', 'computable_remuneration', 'gratification_amount',
+    'extraordinary_bonus', 'cts_amount',
+)
+
+# Meses del semestre y meses con un concepto variable para que sea computable
+SEMESTER_MONTHS = 6
+VARIABLE_MIN_MONTHS = 3
+
+
+def compute_benefits(kind, cols, snapshot):
+    """
+    Calcula la gratificación ('gratification') o la CTS ('cts') de un lote.
+
+    La remuneración computable es el sueldo y la asignación familiar vigentes
+    más el promedio del semestre de los conceptos variables (horas extras y
+    bonificación) percibidos en al menos tres meses. La gratificación es la
+    computable por los meses trabajados / 6, más la bonificación
+    extraordinaria (porcentaje de EsSalud). La CTS es la computable más un
+    sexto de la última gratificación, por los meses trabajados / 12.
+
+    Con cálculo automático de 5ta, a la gratificación se le retiene el
+    impuesto que genera como ingreso extraordinario.
+
+    Args:
+        kind (str): 'gratification' o 'cts'
+        cols (dict): columnas wage, family_allowance, days, overtime,
+                     overtime_months, night_bonus, night_bonus_months,
+                     last_gratification y essalud_percentage (y
+                     fifth_ytd_income para la gratificación con 5ta)
+        snapshot (PayrollSnapshot): parámetros vigentes del período
+
+    Returns:
+        dict: columnas de LINE_RESULTS (en cero salvo total_income,
+              fifth_category_tax, total_discount y net_pay) y de
+              BENEFIT_RESULTS
+    """
+    count = len(cols['wage'])
+    results = {name: [0.0] * count for name in LINE_RESULTS + BENEFIT_RESULTS}
+    for row in range(count):
+        months = min(cols['days'][row] / 30, SEMESTER_MONTHS)
+        computable = cols['wage'][row] + cols['family_allowance'][row]
+        for name in ('overtime', 'night_bonus'):
+            if cols[f'{name}_months'][row] >= VARIABLE_MIN_MONTHS:
+                computable += cols[name][row] / SEMESTER_MONTHS
+        results['months_worked'][row] = round(months, 2)
+        results['computable_remuneration'][row] = round(computable, 2)
+        if kind == 'gratification':
+            gratification = round(computable * months / SEMESTER_MONTHS, 2)
+            percentage = cols['essalud_percentage'][row] or snapshot.essalud_percentage
+            bonus = round(gratification * (percentage / 100), 2)
+            results['gratification_amount'][row] = gratification
+            results['extraordinary_bonus'][row] = bonus
+            total = gratification + bonus
+        else:
+            base = computable + cols['last_gratification'][row] / SEMESTER_MONTHS
+            total = round(base * months / 12, 2)
+            results['cts_amount'][row] = total
+        results['total_income'][row] = total
+        if kind == 'gratification' and snapshot.compute_fifth_category:
+            tax = fifth_category_extraordinary_tax(
+                snapshot, cols['wage'][row] + cols['family_allowance'][row], total, cols['fifth_ytd_income'][row])
+            results['fifth_category_tax'][row] = tax
+            results['total_discount'][row] = tax
+        results['net_pay'][row] = total - results['total_discount'][row]
+    return results
+
+
+def fifth_category_extraordinary_tax(snapshot, monthly_income, extraordinary, ytd_income):
+    """
+    Retención de 5ta de un ingreso extraordinario (gratificación): diferencia
+    entre el impuesto anual proyectado con y sin ese ingreso. La proyección
+    es el acumulado anterior más la remuneración mensual por los meses que
+    faltan, incluido el actual, y la gratificación de diciembre si es de julio.
+    """
+    month = int(snapshot.period[5:7])
+    pending = 1 if month < 12 else 0
+    projected = ytd_income + monthly_income * (13 - month + pending)
+    net_income = projected - FIFTH_CATEGORY_DEDUCTION_UIT * snapshot.uit_amount
+    tax = fifth_category_annual_tax(net_income + extraordinary, snapshot.uit_amount)
+    return round(tax - fifth_category_annual_tax(net_income, snapshot.uit_amount), 2)
+
+
+# ---------------------------------------------------------------------------
+# Simulación de cambios de parámetros
+# ---------------------------------------------------------------------------
+
+# Asignación familiar: porcentaje de la RMV
+FAMILY_ALLOWANCE_RMV_PERCENTAGE = 10.0
+
+
+def simulated_snapshot(snapshot, overrides, afp_overrides=None):
+    """
+    Copia del snapshot con otros parámetros.
+
+    Si se cambia la RMV y no la asignación familiar, esta se recalcula como
+    el 10% de la nueva RMV. El tope de la prima se aplica al tope de cada
+    AFP, que es el que usa la comisión mixta, salvo que la AFP tenga su
+    propio tope simulado.
+
+    Args:
+        overrides (dict): {campo del snapshot: valor}
+        afp_overrides (dict): {id de AFP: {campo de AfpRates: valor}}
+    """
+    overrides = dict(overrides)
+    afp_overrides = afp_overrides or {}
+    if 'rmv_amount' in overrides and 'family_allowance_amount' not in overrides:
+        overrides['family_allowance_amount'] = round(
+            overrides['rmv_amount'] * FAMILY_ALLOWANCE_RMV_PERCENTAGE / 100, 2)
+    if afp_overrides or 'tope_prima_amount' in overrides:
+        tope = {'tope_amount': overrides['tope_prima_amount']} if 'tope_prima_amount' in overrides else {}
+        overrides['afp_rates'] = tuple(
+            rates._replace(**{**tope, **afp_overrides.get(rates.id, {})})
+            for rates in snapshot.afp_rates
+        )
+    return replace(snapshot, **overrides)
+
+
+def simulated_inputs(cols, snapshot, simulated, raise_minimum_wages=True):
+    """
+    Entradas de las líneas con los parámetros simulados.
+
+    La asignación familiar de quienes la reciben pasa al nuevo monto y, si
+    raise_minimum_wages es True, los sueldos de contrato por debajo de la
+    nueva RMV se elevan a ella (el sueldo del mes conserva la proporción de
+    días trabajados).
+
+    Returns:
+        dict: columnas de entrada; las que no cambian se comparten con cols
+    """
+    result = dict(cols)
+    if simulated.family_allowance_amount != snapshot.family_allowance_amount:
+        result['family_allowance'] = [
+            simulated.family_allowance_amount if amount > 0 else 0.0 for amount in cols['family_allowance']
+        ]
+    if raise_minimum_wages and simulated.rmv_amount > snapshot.rmv_amount:
+        rmv = simulated.rmv_amount
+        wages, salaries = [], []
+        for has_contract, wage, salary in zip(cols['has_contract'], cols['contract_wage'], cols['salary']):
+            if has_contract and 0 < wage < rmv:
+                wages.append(rmv)
+                salaries.append(round(salary * rmv / wage, 2))
+            else:
+                wages.append(wage)
+                salaries.append(salary)
+        result['contract_wage'] = wages
+        result['salary'] = salaries
+    return result
+
+
+def compute_projection(cols, months, snapshots, base=None):
+    """
+    Calcula en una pasada filas proyectadas de varios meses.
+
+    Las filas de los meses con los mismos parámetros se calculan juntas (una
+    pasada de compute_batch por cada juego de parámetros distinto). Sin
+    cálculo automático de 5ta categoría el período no interviene en los
+    montos, así que los meses se agrupan aunque sus períodos difieran.
+
+    Args:
+        cols (dict): columnas de LINE_INPUTS, una fila por contrato y mes
+        months (list): posición en snapshots del mes de cada fila
+        snapshots (list): PayrollSnapshot de cada mes
+        base (PayrollSnapshot): si se indica, los sueldos de contrato menores
+                                a la RMV de cada mes se elevan a ella (ver
+                                simulated_inputs)
+
+    Returns:
+        dict: columnas calculadas (ver LINE_RESULTS) en el orden de las filas
+    """
+    keys = [
+        snapshot if snapshot.compute_fifth_category else replace(snapshot, period='')
+        for snapshot in snapshots
+    ]
+    groups = {}
+    for row, month in enumerate(months):
+        groups.setdefault(keys[month], (snapshots[month], []))[1].append(row)
+
+    results = {name: [0.0] * len(months) for name in LINE_RESULTS}
+    for snapshot, rows in groups.values():
+        part = {name: [column[row] for row in rows] for name, column in cols.items()}
+        if base is not None:
+            part = simulated_inputs(part, base, snapshot)
+        computed = compute_batch(part, snapshot)
+        for name in LINE_RESULTS:
+            column = results[name]
+            for row, value in zip(rows, computed[name]):
+                column[row] = value
+    return results
+
+
+def split_columns(cols, size):
+    """Divide las columnas en fragmentos de a lo más `size` líneas"""
+    count = len(next(iter(cols.values()), ()))
+    return [
+        {name: column[start:start + size] for name, column in cols.items()}
+        for start in range(0, count, size)
+    ]
+
+
+def merge_columns(parts):
+    """Une los resultados de varios fragmentos conservando el orden"""
+    merged = {name: [] for name in LINE_RESULTS}
+    for part in parts:
+        for name in LINE_RESULTS:
+            merged[name].extend(part[name])
+    return merged
+
+
+def compare_results(expected, actual):
+    """
+    Verifica que dos resultados coincidan al céntimo.
+
+    Raises:
+        PayrollMismatchError: con la primera columna y fila que difieren
+    """
+    for name in LINE_RESULTS:
+        if len(expected[name]) != len(actual[name]):
+            raise PayrollMismatchError(f'{name}: {len(expected[name])} filas contra {len(actual[name])}')
+        for row, (a, b) in enumerate(zip(expected[name], actual[name])):
+            if round(a * 100) != round(b * 100):
+                raise PayrollMismatchError(f'{name}, fila {row}: {a} contra {b}')
+
+
+# Nombre con el que los procesos del cálculo en paralelo cargan este archivo:
+# se carga directamente desde su ruta, sin importar Odoo ni el módulo
+WORKER_MODULE = 'peruanita_payroll_engine'
+
+# Código que registra este archivo como WORKER_MODULE. Los procesos lo
+# ejecutan con exec como inicializador, porque todavía no pueden importar
+# ninguna función del motor
+WORKER_BOOTSTRAP = """
+import importlib.util, sys
+if name not in sys.modules:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+"""
+
+
+def load_worker_module():
+    """
+    Carga este archivo como WORKER_MODULE en el proceso principal, de modo
+    que las funciones enviadas a los procesos se serializan por referencia
+    a un módulo que ellos pueden cargar
+    """
+    exec(WORKER_BOOTSTRAP, {'name': WORKER_MODULE, 'path': __file__})
+    return sys.modules[WORKER_MODULE]
+
+
+def dump_snapshot(snapshot):
+    """Snapshot como diccionario de tipos básicos, para enviarlo a otro proceso"""
+    values = {item.name: getattr(snapshot, item.name) for item in fields(snapshot) if item.init}
+    values['afp_rates'] = [tuple(rates) for rates in snapshot.afp_rates]
+    return values
+
+
+def load_snapshot(values):
+    """Reconstruye el snapshot a partir de dump_snapshot"""
+    return PayrollSnapshot(**dict(values, afp_rates=tuple(AfpRates(*rates) for rates in values['afp_rates'])))
+
+
+def compute_shard(snapshot_values, cols):
+    """Calcula un fragmento en un proceso del cálculo en paralelo"""
+    return compute_batch(cols, load_snapshot(snapshot_values))
+
+
+def compute_parallel(cols, snapshot, workers, shard_size, verify=False):
+    """
+    Calcula un lote grande repartiéndolo en fragmentos entre procesos.
+
+    Los procesos se crean con spawn (un intérprete nuevo, sin copiar los
+    hilos ni los bloqueos del servidor) y cargan solo este archivo; entre
+    procesos viajan las columnas y el snapshot como tipos básicos.
+
+    Args:
+        cols (dict): columnas de entrada (ver LINE_INPUTS)
+        snapshot (PayrollSnapshot): parámetros vigentes del período
+        workers (int): cantidad máxima de procesos
+        shard_size (int): líneas por fragmento
+        verify (bool): comparar contra el cálculo secuencial
+
+    Returns:
+        dict: columnas calculadas (ver LINE_RESULTS)
+    """
+    _ORDER or check_graph()
+    shards = split_columns(cols, max(shard_size, 1))
+    if workers <= 1 or len(shards) <= 1:
+        return compute_batch(cols, snapshot)
+
+    worker = load_worker_module()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=context,
+                             initializer=exec,
+                             initargs=(WORKER_BOOTSTRAP, {'name': WORKER_MODULE, 'path': __file__})) as executor:
+        results = merge_columns(executor.map(worker.compute_shard, repeat(dump_snapshot(snapshot)), shards))
+
+    if verify:
+        compare_results(compute_batch(cols, snapshot), results)
+    return results